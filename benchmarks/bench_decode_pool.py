@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Whole-system refresh, serial vs. DecodePool: every realtime feed URL gets a copy of a
+# recorded payload, which is parsed and extracted in this process, then in N workers.
+#
+#   python benchmarks/bench_decode_pool.py [PATH] [--copies 1] [--workers 1,2,4] [--repeat 10]
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mta_decode_pool import DecodePool, decode_trains, encode_trains, extract_payload
+from mta_rail import realtime_feed_urls
+from mta_replay import FeedReplay
+
+def best_of(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def replicated_payload(feed, copies):
+    # Same feed with its entities repeated, trip_ids kept unique per copy
+    if copies == 1:
+        return feed.SerializeToString()
+    from google.transit import gtfs_realtime_pb2
+    big = gtfs_realtime_pb2.FeedMessage()
+    big.header.CopyFrom(feed.header)
+    for copy in range(copies):
+        for entity in feed.entity:
+            new = big.entity.add()
+            new.CopyFrom(entity)
+            if new.HasField('trip_update'):
+                new.trip_update.trip.trip_id += f"#{copy}"
+            if new.HasField('vehicle'):
+                new.vehicle.trip.trip_id += f"#{copy}"
+    return big.SerializeToString()
+
+def signature(results):
+    return {route: [(t.trip_id, t.next_stop_id, t.time_until, t.arrival_time, t.current_status, t.section_name,
+                     t.next_station_index, t.direction) for t in trains]
+            for route, trains in results.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serial vs. process-pool feed decoding")
+    parser.add_argument('path', nargs='?', default=os.path.join(ROOT, "feed_debug.txt"), help='Recorded feed or directory of snapshots (the first one is used)')
+    parser.add_argument('--copies', type=int, default=1, help='Replicate each feed\'s entities this many times')
+    parser.add_argument('--workers', type=str, default=None, help='Comma-separated pool sizes (default: 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed iterations per mode (best is reported)')
+    args = parser.parse_args()
+
+    frame = next(iter(FeedReplay(args.path)), None)
+    if frame is None:
+        sys.exit(f"No recorded feeds found at {args.path}")
+    payload = replicated_payload(frame.feed, args.copies)
+    routes = sorted({e.trip_update.trip.route_id for e in frame.feed.entity if e.HasField('trip_update')})
+    # Distinct keys per feed, same work per feed
+    payloads = {url: (payload, routes) for url in realtime_feed_urls.values()}
+    now = frame.now
+    if args.workers:
+        sizes = [int(n) for n in args.workers.split(',')]
+    else:
+        sizes, n = [], 1
+        while n < (os.cpu_count() or 1):
+            sizes.append(n)
+            n *= 2
+        sizes.append(os.cpu_count() or 1)
+    print(f"{len(payloads)} feeds x {len(payload)} bytes, routes: {', '.join(routes)}; {os.cpu_count()} CPU(s)")
+
+    def serial():
+        results = {}
+        for url, (data, url_routes) in payloads.items():
+            # Keyed by feed so every copy's trains are kept, as the pool's are below
+            for route, trains in extract_payload(data, url_routes, now):
+                results[(url, route)] = trains
+        return results
+
+    serial_secs, serial_results = best_of(serial, args.repeat)
+    extracted = extract_payload(payload, routes, now)
+    encode_secs, encoded = best_of(lambda: encode_trains(extracted), args.repeat)
+    decode_secs, _ = best_of(lambda: decode_trains(encoded, routes), args.repeat)
+    trains = sum(len(t) for t in serial_results.values())
+    print(f"{trains} trains; records {len(encoded) * len(payloads)} bytes "
+          f"(encode {encode_secs * 1000:.3f} ms, decode {decode_secs * 1000:.3f} ms per feed)\n")
+
+    expected = signature(dict(extracted))
+    print(f"{'mode':>12s} {'time':>11s} {'speedup':>8s}")
+    print(f"{'serial':>12s} {serial_secs * 1000:8.2f} ms {1.0:7.2f}x")
+    for size in sizes:
+        with DecodePool(size) as pool:
+            # Warm the workers (imports, station tables, shared blocks) before timing
+            for url in payloads:
+                assert signature(pool.decode_all({url: payloads[url]}, now)) == expected, "pool result mismatch"
+            secs, _ = best_of(lambda: pool.decode_all(payloads, now), args.repeat)
+        print(f"{f'{size} worker(s)':>12s} {secs * 1000:8.2f} ms {serial_secs / secs:7.2f}x")
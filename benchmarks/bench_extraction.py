@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Compares TrainGetter.get_trains against the original getattr/try-based extraction
+# on a recorded feed, replicated to whole-system size.
+#
+#   python benchmarks/bench_extraction.py [--feed feed_debug.txt] [--copies 6] [--repeat 20]
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+from google.transit import gtfs_realtime_pb2
+import mta_rail
+from mta_rail import Train, TrainGetter, _secs_until
+from mta_feed_fetcher import load_feed_payload
+
+def legacy_get_trains(traingetter, feed, route):
+    # TrainGetter.get_trains as it was before the single-pass rewrite
+    trip_updates = {}
+    vehicles = {}
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            try:
+                trip = entity.trip_update.trip
+                trip_id = getattr(trip, "trip_id", None)
+                route_id = getattr(trip, "route_id", None)
+                if trip_id and route_id == route:
+                    trip_updates[trip_id] = entity.trip_update
+            except Exception:
+                continue
+        if entity.HasField('vehicle'):
+            try:
+                veh_trip = entity.vehicle.trip
+                veh_trip_id = getattr(veh_trip, "trip_id", None)
+                if veh_trip_id:
+                    vehicles[veh_trip_id] = entity.vehicle
+            except Exception:
+                continue
+
+    trains = []
+    for trip_id, tu in trip_updates.items():
+        try:
+            route_id = tu.trip.route_id
+        except Exception:
+            continue
+        if route_id != route:
+            continue
+
+        next_stop_id = "(no stop)"
+        arrival_ts = None
+        for stu in tu.stop_time_update:
+            at = getattr(stu, "arrival", None)
+            dt = getattr(stu, "departure", None)
+            if at and getattr(at, "time", 0):
+                arrival_ts = getattr(at, "time")
+                next_stop_id = getattr(stu, "stop_id", "(no stop)")
+                break
+            if dt and getattr(dt, "time", 0):
+                arrival_ts = getattr(dt, "time")
+                next_stop_id = getattr(stu, "stop_id", "(no stop)")
+                break
+
+        secs = _secs_until(arrival_ts) if arrival_ts else 0.0
+
+        direction_char = None
+        if len(next_stop_id) > 1 and next_stop_id[-1] in ('N', 'S'):
+            direction_char = next_stop_id[-1]
+
+        direction = None
+        try:
+            direction = tu.trip.direction_id
+        except Exception:
+            pass
+
+        veh = vehicles.get(trip_id)
+        veh_stop = None
+        status = None
+        if veh:
+            try:
+                veh_stop = veh.stop_id if hasattr(veh, "stop_id") else None
+            except Exception:
+                veh_stop = None
+            try:
+                status = gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus.Name(veh.current_status)
+            except Exception:
+                status = str(getattr(veh, "current_status", ""))
+
+        base_stop_id = next_stop_id[:-1] if direction_char else next_stop_id
+        station_name = traingetter.station_id_to_name(base_stop_id)
+        station_index = traingetter.station_name_to_index(station_name) if station_name else -1
+        section_name = traingetter.stop_id_to_section.get(base_stop_id)
+
+        trains.append(Train(
+            trip_id=trip_id,
+            route_id=route_id,
+            start_date=tu.trip.start_date if hasattr(tu.trip, "start_date") else "",
+            next_stop_id=next_stop_id,
+            time_until=secs,
+            direction=direction,
+            next_station_index=station_index,
+            direction_char=direction_char,
+            vehicle_stop_id=veh_stop,
+            current_status=status,
+            section_name=section_name
+        ))
+
+    def get_sort_key(train):
+        is_to_endpoint = (train.direction_char == 'N')
+        primary_sort = train.next_station_index - is_to_endpoint
+        primary_sort *= -1
+        secondary_sort = train.time_until
+        secondary_sort *= (1 if is_to_endpoint else -1)
+        return (primary_sort, secondary_sort)
+
+    try:
+        trains = sorted(trains, key=get_sort_key)
+    except Exception:
+        pass
+    return trains
+
+def replicated_feed(path, copies):
+    base = gtfs_realtime_pb2.FeedMessage()
+    base.ParseFromString(load_feed_payload(path))
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.CopyFrom(base.header)
+    for copy in range(copies):
+        for entity in base.entity:
+            new = feed.entity.add()
+            new.CopyFrom(entity)
+            # Keep trip_ids unique across copies so every copy yields trains
+            if new.HasField('trip_update'):
+                new.trip_update.trip.trip_id += f"#{copy}"
+            if new.HasField('vehicle'):
+                new.vehicle.trip.trip_id += f"#{copy}"
+    return feed
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+if __name__ == "__main__":
+    bench_parser = argparse.ArgumentParser(description="Benchmark train extraction from a GTFS-RT feed")
+    bench_parser.add_argument('--feed', type=str, default=os.path.join(ROOT, "feed_debug.txt"), help='Recorded feed (text or binary protobuf)')
+    bench_parser.add_argument('--copies', type=int, default=6, help='Replicate the feed entities this many times')
+    bench_parser.add_argument('--repeat', type=int, default=20, help='Timed iterations per implementation')
+    bench_args = bench_parser.parse_args()
+
+    feed = replicated_feed(bench_args.feed, bench_args.copies)
+    entities = len(feed.entity)
+    routes = sorted({e.trip_update.trip.route_id for e in feed.entity if e.HasField('trip_update')})
+    traingetters = {route: TrainGetter(route) for route in routes}
+    print(f"{entities} entities, {feed.ByteSize()} bytes, routes: {', '.join(routes)}")
+
+    # Both implementations must agree before timing them
+    for route, traingetter in traingetters.items():
+        old = [(t.trip_id, t.next_stop_id, t.current_status) for t in legacy_get_trains(traingetter, feed, route)]
+        new = [(t.trip_id, t.next_stop_id, t.current_status) for t in traingetter.get_trains(feed)]
+        assert old == new, f"extraction mismatch on route {route}"
+
+    def run_legacy():
+        for route, traingetter in traingetters.items():
+            legacy_get_trains(traingetter, feed, route)
+
+    def run_per_route():
+        for traingetter in traingetters.values():
+            traingetter.get_trains(feed)
+
+    def run_bucketed():
+        trip_updates, vehicles = mta_rail.bucket_feed(feed, routes)
+        for route, traingetter in traingetters.items():
+            traingetter.build_trains(trip_updates[route], vehicles)
+
+    results = [
+        ("legacy get_trains, per route", timed(run_legacy, bench_args.repeat)),
+        ("get_trains, per route", timed(run_per_route, bench_args.repeat)),
+        ("bucket_feed + build_trains", timed(run_bucketed, bench_args.repeat)),
+    ]
+    baseline = results[0][1]
+    for name, secs in results:
+        print(f"{name:32s} {secs * 1000:8.2f} ms  {entities / secs:12,.0f} entities/s  {baseline / secs:5.1f}x")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# HeadwayTracker throughput over a simulated service day: every route runs trips along
+# a line of stops (fixed run time, dwell and jittered headways), snapshotted every
+# --interval seconds, and the observations are replayed as history records (the
+# mta_history path) and as Trains (the live / recorded-feed path).
+#
+#   python benchmarks/bench_headways.py [--routes 20] [--hours 24] [--interval 30] [--stops 30]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mta_headways import HeadwayTracker
+from mta_history import HistoryRecord
+from mta_rail import Train
+
+def simulate(routes, hours, interval, stops, headway, run, dwell, seed=1):
+    # Snapshots in time order: [(observed, [(route, record), ...]), ...]
+    rng = random.Random(seed)
+    day = int(hours * 3600)
+    trip_length = stops * (run + dwell)
+    trips = []
+    for r in range(routes):
+        route = f"R{r}"
+        start = rng.randrange(headway)
+        while start < day:
+            trips.append((route, f"{start * 100 // 60:06d}_{route}..S", start))
+            start += max(30, int(rng.gauss(headway, headway * 0.3)))
+    snapshots = []
+    for observed in range(0, day + trip_length, interval):
+        records = []
+        for route, trip_id, start in trips:
+            elapsed = observed - start
+            if not 0 <= elapsed < trip_length:
+                continue
+            index, offset = divmod(elapsed, run + dwell)
+            # Running to stop `index`, then dwelling there
+            stopped = offset >= run
+            arrival = start + index * (run + dwell) + run
+            records.append((route, HistoryRecord(observed, route, trip_id, f"S{index:02d}S", arrival,
+                                                 "STOPPED_AT" if stopped else "IN_TRANSIT_TO", index)))
+        snapshots.append((observed, records))
+    return snapshots
+
+def as_trains(snapshots):
+    trains = []
+    for observed, records in snapshots:
+        by_route = {}
+        for route, r in records:
+            by_route.setdefault(route, []).append(Train(r.trip_id, route, "20250101", r.stop_id, float(r.arrival_time - observed),
+                                                         1, r.station_index, "S", r.stop_id, r.current_status, None, None,
+                                                         r.arrival_time))
+        trains.append((observed, by_route))
+    return trains
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark headway/dwell inference over a simulated day")
+    parser.add_argument('--routes', type=int, default=20, help='Simulated routes')
+    parser.add_argument('--hours', type=float, default=24.0, help='Hours of service')
+    parser.add_argument('--interval', type=int, default=30, help='Seconds between snapshots')
+    parser.add_argument('--stops', type=int, default=30, help='Stops per trip')
+    parser.add_argument('--headway', type=int, default=240, help='Mean seconds between trips')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snapshots = simulate(args.routes, args.hours, args.interval, args.stops, args.headway, run=90, dwell=30)
+    observations = sum(len(records) for _, records in snapshots)
+    print(f"{args.routes} routes, {args.hours:g}h every {args.interval}s: {observations} observations "
+          f"(simulated in {time.perf_counter() - started:.2f}s)\n")
+
+    tracker = HeadwayTracker()
+    records = [record for _, records in snapshots for _, record in records]
+    started = time.perf_counter()
+    visits = sum(1 for _ in tracker.observe_records(records))
+    elapsed = time.perf_counter() - started
+    print(f"{'history records':>16s} {elapsed:6.2f}s  {observations / elapsed / 1000:7.0f}k obs/s  {visits} visits")
+    del records
+
+    trains = as_trains(snapshots)
+    del snapshots
+    tracker = HeadwayTracker()
+    started = time.perf_counter()
+    visits = 0
+    for observed, by_route in trains:
+        for route, route_trains in by_route.items():
+            visits += len(tracker.observe(route, route_trains, observed))
+    elapsed = time.perf_counter() - started
+    print(f"{'trains':>16s} {elapsed:6.2f}s  {observations / elapsed / 1000:7.0f}k obs/s  {visits} visits")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Per-stage timings over recorded feeds, with no network access: protobuf parse,
+# extraction (bucket_feed + TrainGetter.extract_trains), sort/group and render,
+# per route and for all routes together.
+#
+#   python benchmarks/bench_replay.py [PATH] [-R all] [--repeat 10]
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mta_rail import TrainGetter, bucket_feed, group_by_section, order_trains, parse_routes, print_route
+from mta_replay import FeedReplay
+from google.transit import gtfs_realtime_pb2
+
+STAGES = ("parse", "extract", "sort/group", "render")
+
+def best_of(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def bench_frame(frame, routes, traingetters, repeat):
+    # Stage timings for one snapshot: {route or 'all': {stage: seconds}}, plus train counts
+    payload = frame.feed.SerializeToString()
+
+    def parse():
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(payload)
+        return feed
+
+    parse_secs, feed = best_of(parse, repeat)
+    bucket_secs, (trip_updates, vehicles) = best_of(lambda: bucket_feed(feed, routes), repeat)
+
+    timings, counts = {}, {}
+    totals = dict.fromkeys(STAGES, 0.0)
+    totals["parse"] = parse_secs
+    totals["extract"] = bucket_secs
+    for route in routes:
+        if not trip_updates[route]:
+            continue
+        traingetter = traingetters[route]
+        extract_secs, keyed = best_of(lambda: traingetter.extract_trains(trip_updates[route], vehicles, now=frame.now), repeat)
+        sort_secs, trains = best_of(lambda: group_by_section(traingetter, order_trains(list(keyed))), repeat)
+        trains = order_trains(list(keyed))
+
+        def render():
+            with contextlib.redirect_stdout(io.StringIO()):
+                print_route(traingetter, trains)
+
+        render_secs, _ = best_of(render, repeat)
+        # A single-route run pays the whole parse and bucket pass by itself
+        timings[route] = {"parse": parse_secs, "extract": bucket_secs + extract_secs, "sort/group": sort_secs, "render": render_secs}
+        counts[route] = len(trains)
+        totals["extract"] += extract_secs
+        totals["sort/group"] += sort_secs
+        totals["render"] += render_secs
+    timings["all"] = totals
+    counts["all"] = sum(counts.values())
+    return timings, counts, len(feed.entity), len(payload)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parse/extract/sort/render over recorded feeds")
+    parser.add_argument('path', nargs='?', default=os.path.join(ROOT, "feed_debug.txt"), help='Recorded feed or directory of snapshots')
+    parser.add_argument('-R', '--routes', type=str, default='all', help="Comma-separated routes, or 'all'")
+    parser.add_argument('--repeat', type=int, default=10, help='Timed iterations per stage (best is reported)')
+    args = parser.parse_args()
+
+    routes = parse_routes(args.routes)
+    traingetters = {route: TrainGetter(route) for route in routes}
+
+    sums, counts_sum, frames = {}, {}, 0
+    for frame in FeedReplay(args.path):
+        timings, counts, entities, size = bench_frame(frame, routes, traingetters, args.repeat)
+        print(f"{os.path.basename(frame.path)}: {entities} entities, {size} bytes")
+        frames += 1
+        for key, stages in timings.items():
+            acc = sums.setdefault(key, dict.fromkeys(STAGES, 0.0))
+            for stage, secs in stages.items():
+                acc[stage] += secs
+            counts_sum[key] = counts_sum.get(key, 0) + counts[key]
+
+    if not frames:
+        sys.exit(f"No recorded feeds found at {args.path}")
+
+    print(f"\nMean per snapshot over {frames} snapshot(s), best of {args.repeat}:")
+    print(f"{'route':>6s} {'trains':>7s} " + " ".join(f"{stage:>11s}" for stage in STAGES) + f" {'total':>11s}")
+    for key in [k for k in sums if k != "all"] + ["all"]:
+        stages = sums[key]
+        cells = " ".join(f"{stages[stage] / frames * 1000:8.3f} ms" for stage in STAGES)
+        total = sum(stages.values()) / frames * 1000
+        print(f"{key:>6s} {counts_sum[key] / frames:7.0f} {cells} {total:8.3f} ms")
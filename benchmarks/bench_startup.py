@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# Startup latency of the CLI: bare `import mta_rail`, and time to first output /
+# exit for --self-test and for a route served by a local fixture feed server.
+#
+#   python benchmarks/bench_startup.py [--runs 10] [--feed feed_debug.txt] [--route 1]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def time_command(cmd, runs):
+    # (first-output latencies, total latencies) in seconds over `runs` fresh processes
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    first, total = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        line = proc.stdout.readline()
+        first.append(time.perf_counter() - started if line else float("nan"))
+        proc.communicate()
+        total.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(cmd)} exited with {proc.returncode}")
+    return first, total
+
+def report(name, samples):
+    samples = [s * 1000 for s in samples]
+    print(f"{name:40s} min {min(samples):8.1f} ms   median {statistics.median(samples):8.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup latency")
+    parser.add_argument('--runs', type=int, default=10, help='Fresh processes per measurement')
+    parser.add_argument('--feed', type=str, default=os.path.join(ROOT, "feed_debug.txt"), help='Recorded feed for the fixture server')
+    parser.add_argument('--route', type=str, default='1', help='Route to render from the fixture feed')
+    args = parser.parse_args()
+
+    python = sys.executable
+    _, baseline = time_command([python, "-c", "pass"], args.runs)
+    report("python -c pass (interpreter floor)", baseline)
+    _, imported = time_command([python, "-c", "import mta_rail"], args.runs)
+    report("import mta_rail", imported)
+
+    first, total = time_command([python, "mta_rail.py", "--self-test"], args.runs)
+    report("--self-test first output", first)
+    report("--self-test exit", total)
+
+    from mta_feed_fetcher import load_feed_payload, make_fixture_server
+    server = make_fixture_server(load_feed_payload(args.feed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        first, total = time_command([python, "mta_rail.py", "-r", args.route, "--feed-base-url", base_url], args.runs)
+        report(f"-r {args.route} (fixture) first output", first)
+        report(f"-r {args.route} (fixture) exit", total)
+    finally:
+        server.shutdown()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+
+if TYPE_CHECKING:
+    from google.transit import gtfs_realtime_pb2
+
+@dataclass(slots=True)
+class Arrival:
+    stop_id: str
+    direction_char: Optional[str]
+    route_id: str
+    trip_id: str
+    arrival_time: int
+    departure_time: int
+
+def _arrival_time(arrival: Arrival) -> int:
+    return arrival.arrival_time
+
+def extract_arrivals(feed: gtfs_realtime_pb2.FeedMessage, routes: Optional[Iterable[str]] = None) -> Dict[str, List[Arrival]]:
+    # Base stop_id -> arrivals sorted by time, from every stop_time_update of every trip
+    routes = set(routes) if routes is not None else None
+    by_stop: Dict[str, List[Arrival]] = {}
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        tu = entity.trip_update
+        trip = tu.trip
+        route_id = trip.route_id
+        if routes is not None and route_id not in routes:
+            continue
+        trip_id = trip.trip_id
+        for stu in tu.stop_time_update:
+            arrival_ts = stu.arrival.time
+            departure_ts = stu.departure.time
+            if not (arrival_ts or departure_ts):
+                continue
+            stop_id = stu.stop_id
+            direction_char = stop_id[-1] if len(stop_id) > 1 and stop_id[-1] in ('N', 'S') else None
+            base_stop_id = stop_id[:-1] if direction_char else stop_id
+            by_stop.setdefault(base_stop_id, []).append(
+                Arrival(base_stop_id, direction_char, route_id, trip_id, arrival_ts or departure_ts, departure_ts or arrival_ts))
+    for arrivals in by_stop.values():
+        arrivals.sort(key=_arrival_time)
+    return by_stop
+
+class ArrivalIndex():
+    # Inverted index over all tracked feeds. Each feed's contribution is replaced as a
+    # whole when it updates, and only the stops that feed touches are re-merged, so a
+    # poll costs O(updates in that feed) and a board query is a bisect plus a slice.
+    def __init__(self) -> None:
+        self._by_feed: Dict[str, Dict[str, List[Arrival]]] = {}
+        self._by_stop: Dict[str, List[Arrival]] = {}
+
+    def update_feed(self, feed_key: str, feed: gtfs_realtime_pb2.FeedMessage, routes: Optional[Iterable[str]] = None) -> Set[str]:
+        # Returns the stop_ids whose boards changed
+        new = extract_arrivals(feed, routes)
+        old = self._by_feed.get(feed_key, {})
+        self._by_feed[feed_key] = new
+
+        changed = set()
+        for stop_id in old.keys() | new.keys():
+            if old.get(stop_id) == new.get(stop_id):
+                continue
+            changed.add(stop_id)
+            parts = [by_stop[stop_id] for by_stop in self._by_feed.values() if stop_id in by_stop]
+            if not parts:
+                self._by_stop.pop(stop_id, None)
+            elif len(parts) == 1:
+                self._by_stop[stop_id] = parts[0]
+            else:
+                self._by_stop[stop_id] = list(heapq.merge(*parts, key=_arrival_time))
+        return changed
+
+    def remove_feed(self, feed_key: str) -> Set[str]:
+        from google.transit import gtfs_realtime_pb2
+        changed = self.update_feed(feed_key, gtfs_realtime_pb2.FeedMessage())
+        del self._by_feed[feed_key]
+        return changed
+
+    def stops(self) -> List[str]:
+        return list(self._by_stop)
+
+    def board(self, stop_id: str, now: Optional[float] = None, limit: Optional[int] = None,
+              direction: Optional[str] = None, routes: Optional[Iterable[str]] = None) -> List[Arrival]:
+        # Upcoming arrivals at a base stop_id, soonest first, skipping ones already past `now`
+        arrivals = self._by_stop.get(stop_id)
+        if not arrivals:
+            return []
+        if now is None:
+            now = time.time()
+        start = bisect.bisect_left(arrivals, now, key=_arrival_time)
+        if direction is None and routes is None:
+            return arrivals[start:start + limit] if limit is not None else arrivals[start:]
+        routes = set(routes) if routes is not None else None
+        board = []
+        for arrival in arrivals[start:]:
+            if direction is not None and arrival.direction_char != direction:
+                continue
+            if routes is not None and arrival.route_id not in routes:
+                continue
+            board.append(arrival)
+            if limit is not None and len(board) >= limit:
+                break
+        return board
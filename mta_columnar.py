@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from google.transit import gtfs_realtime_pb2
+
+from mta_rail import Train, TrainGetter, bucket_feed, route_ids, vehicle_status_names
+
+# Small integer codes so every column is a plain NumPy array
+route_codes = {route: i for i, route in enumerate(route_ids)}
+DIRECTION_NORTH = 0
+DIRECTION_SOUTH = 1
+DIRECTION_UNKNOWN = -1
+NO_STATUS = -1
+
+@dataclass
+class FeedSnapshot:
+    # One row per trip across every route in the snapshot
+    trip_ids: List[str]
+    next_stop_ids: List[str]
+    start_dates: List[str]
+    vehicle_stop_ids: List[Optional[str]]
+    stop_table: List[str]
+    section_tables: Dict[str, List[str]]
+    trip_index: np.ndarray
+    route: np.ndarray
+    station: np.ndarray
+    section: np.ndarray
+    direction: np.ndarray
+    direction_id: np.ndarray
+    arrival: np.ndarray
+    status: np.ndarray
+    stop: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.trip_ids)
+
+    def etas(self, now: Optional[float] = None) -> np.ndarray:
+        # Seconds until each train's next stop against a single `now`; 0 when unknown or past
+        if now is None:
+            now = time.time()
+        secs = self.arrival - now
+        secs[(self.arrival == 0) | (secs < 0)] = 0.0
+        return secs
+
+    def order(self, now: Optional[float] = None, etas: Optional[np.ndarray] = None) -> np.ndarray:
+        # Same ordering as TrainGetter.build_trains, per route: station index first
+        # (shifted by one towards the endpoint for northbound trains), then ETA
+        # inverted by direction to keep order within a block
+        if etas is None:
+            etas = self.etas(now)
+        north = self.direction == DIRECTION_NORTH
+        primary = np.where(north, 1 - self.station, -self.station)
+        secondary = np.where(north, etas, -etas)
+        return np.lexsort((secondary, primary, self.route))
+
+    def route_rows(self, route: str, order: Optional[np.ndarray] = None) -> np.ndarray:
+        if order is None:
+            order = self.order()
+        return order[self.route[order] == route_codes[route]]
+
+    def sections(self, route: str, order: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        # Section name -> ordered row indices; sections keep their route_data order
+        rows = self.route_rows(route, order)
+        rows = rows[self.section[rows] >= 0]
+        codes = self.section[rows]
+        by_section = np.argsort(codes, kind="stable")
+        rows, codes = rows[by_section], codes[by_section]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        names = self.section_tables.get(route, [])
+        grouped = OrderedDict((name, rows[:0]) for name in names)
+        for chunk in np.split(rows, bounds):
+            if chunk.size:
+                grouped[names[self.section[chunk[0]]]] = chunk
+        return grouped
+
+    def station_board(self, stop_id: str, now: Optional[float] = None, etas: Optional[np.ndarray] = None) -> np.ndarray:
+        # Rows whose next stop is `stop_id` (base ID, any direction), soonest first
+        try:
+            code = self.stop_table.index(stop_id)
+        except ValueError:
+            return np.empty(0, dtype=np.int64)
+        if etas is None:
+            etas = self.etas(now)
+        rows = np.flatnonzero(self.stop == code)
+        return rows[np.argsort(etas[rows], kind="stable")]
+
+    def to_trains(self, rows: np.ndarray, traingetters: Dict[str, TrainGetter], etas: np.ndarray) -> List[Train]:
+        # Materialise Train objects only for the rows that are going to be rendered
+        status_names = vehicle_status_names()
+        trains = []
+        for row in rows.tolist():
+            route = route_ids[self.route[row]]
+            traingetter = traingetters[route]
+            station_index = int(self.station[row])
+            direction = self.direction[row]
+            status = int(self.status[row])
+            section = int(self.section[row])
+            arrival = int(self.arrival[row])
+            trains.append(Train(
+                self.trip_ids[row], route, self.start_dates[row], self.next_stop_ids[row], float(etas[row]),
+                int(self.direction_id[row]), station_index,
+                'N' if direction == DIRECTION_NORTH else 'S' if direction == DIRECTION_SOUTH else None,
+                self.vehicle_stop_ids[row],
+                status_names.get(status, str(status)) if status != NO_STATUS else None,
+                self.section_tables[route][section] if section >= 0 else None,
+                traingetter.station_names[station_index] if station_index >= 0 else None,
+                arrival or None,
+            ))
+        return trains
+
+def build_snapshot(feeds: Iterable[Tuple[gtfs_realtime_pb2.FeedMessage, List[str]]], traingetters: Dict[str, TrainGetter]) -> FeedSnapshot:
+    # `feeds` pairs each decoded feed with the routes it should serve
+    trip_ids, next_stop_ids, start_dates, vehicle_stop_ids = [], [], [], []
+    route_col, station_col, section_col, direction_col, direction_id_col = [], [], [], [], []
+    arrival_col, status_col, stop_col = [], [], []
+    stop_codes: Dict[str, int] = {}
+    section_tables = {route: list(tg.route_data.keys()) for route, tg in traingetters.items()}
+    section_codes = {route: {name: i for i, name in enumerate(names)} for route, names in section_tables.items()}
+
+    for feed, feed_routes in feeds:
+        trip_updates, vehicles = bucket_feed(feed, feed_routes)
+        for route, bucket in trip_updates.items():
+            traingetter = traingetters[route]
+            stop_lookup = traingetter._stop_lookup
+            sections = section_codes[route]
+            code = route_codes[route]
+            for trip_id, tu in bucket.items():
+                next_stop_id = "(no stop)"
+                arrival_ts = 0
+                for stu in tu.stop_time_update:
+                    ts = stu.arrival.time or stu.departure.time
+                    if ts:
+                        arrival_ts = ts
+                        next_stop_id = stu.stop_id
+                        break
+
+                direction_char = next_stop_id[-1] if len(next_stop_id) > 1 and next_stop_id[-1] in ('N', 'S') else None
+                base_stop_id = next_stop_id[:-1] if direction_char else next_stop_id
+                _, station_index, section_name = stop_lookup.get(base_stop_id, (None, -1, None))
+                veh = vehicles.get(trip_id)
+
+                trip_ids.append(trip_id)
+                next_stop_ids.append(next_stop_id)
+                start_dates.append(tu.trip.start_date)
+                vehicle_stop_ids.append(veh.stop_id if veh is not None else None)
+                route_col.append(code)
+                station_col.append(station_index)
+                section_col.append(sections.get(section_name, -1))
+                direction_col.append(DIRECTION_NORTH if direction_char == 'N' else DIRECTION_SOUTH if direction_char == 'S' else DIRECTION_UNKNOWN)
+                direction_id_col.append(tu.trip.direction_id)
+                arrival_col.append(arrival_ts)
+                status_col.append(veh.current_status if veh is not None else NO_STATUS)
+                stop_col.append(stop_codes.setdefault(base_stop_id, len(stop_codes)))
+
+    return FeedSnapshot(
+        trip_ids=trip_ids,
+        next_stop_ids=next_stop_ids,
+        start_dates=start_dates,
+        vehicle_stop_ids=vehicle_stop_ids,
+        stop_table=list(stop_codes),
+        section_tables=section_tables,
+        trip_index=np.arange(len(trip_ids), dtype=np.int32),
+        route=np.array(route_col, dtype=np.int16),
+        station=np.array(station_col, dtype=np.int32),
+        section=np.array(section_col, dtype=np.int16),
+        direction=np.array(direction_col, dtype=np.int8),
+        direction_id=np.array(direction_id_col, dtype=np.int8),
+        arrival=np.array(arrival_col, dtype=np.int64),
+        status=np.array(status_col, dtype=np.int8),
+        stop=np.array(stop_col, dtype=np.int32),
+    )
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import mta_metrics
+from mta_rail import Train, TrainGetter, bucket_feed
+
+# A worker's result is written into the feed's shared block right after the payload,
+# column by column so encoding is a join or an array copy per field:
+#   RESULT header (magic, row count)
+#   per string column: uint32 byte length, then utf-8 values separated by NUL (None as NONE)
+#   per numeric column: the packed array
+# Rows are routes in request order and, within a route, trains in display order.
+RESULT = struct.Struct("<4sI")
+LENGTH = struct.Struct("<I")
+MAGIC = b"MTAT"
+NONE = "\x1f"
+STRING_FIELDS = ("route_id", "trip_id", "start_date", "next_stop_id", "direction_char", "vehicle_stop_id",
+                 "current_status", "section_name", "next_station_name")
+# Fields that are never None are written as is
+REQUIRED_FIELDS = {"route_id", "trip_id", "start_date", "next_stop_id"}
+# time_until, arrival_time (0 = none), next_station_index, direction (-1 = none)
+NUMERIC_TYPECODES = ("d", "q", "i", "b")
+# Room reserved for the result, relative to the payload (records are far smaller than
+# the protobuf, which carries every stop_time_update)
+RESULT_SPACE = 0.5
+MIN_RESULT_SPACE = 1 << 16
+
+def encode_trains(routes: Iterable[Tuple[str, List[Train]]]) -> bytes:
+    trains = [t for _, route_trains in routes for t in route_trains]
+    parts = [RESULT.pack(MAGIC, len(trains))]
+    for name in STRING_FIELDS:
+        getter = attrgetter(name)
+        if name in REQUIRED_FIELDS:
+            column = "\0".join(map(getter, trains)).encode("utf-8")
+        else:
+            column = "\0".join([NONE if value is None else value for value in map(getter, trains)]).encode("utf-8")
+        parts.append(LENGTH.pack(len(column)))
+        parts.append(column)
+    parts.append(array("d", [t.time_until for t in trains]).tobytes())
+    parts.append(array("q", [t.arrival_time or 0 for t in trains]).tobytes())
+    parts.append(array("i", [-1 if t.next_station_index is None else t.next_station_index for t in trains]).tobytes())
+    parts.append(array("b", [-1 if t.direction is None else t.direction for t in trains]).tobytes())
+    return b"".join(parts)
+
+def decode_trains(data, routes: Sequence[str] = ()) -> Dict[str, List[Train]]:
+    # route -> trains, in display order; every route in `routes` gets an entry
+    magic, count = RESULT.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a train record block")
+    pos = RESULT.size
+    columns = []
+    for name in STRING_FIELDS:
+        (size,) = LENGTH.unpack_from(data, pos)
+        pos += LENGTH.size
+        values = bytes(data[pos:pos + size]).decode("utf-8").split("\0") if count else []
+        pos += size
+        if name not in REQUIRED_FIELDS:
+            values = [None if value == NONE else value for value in values]
+        columns.append(values)
+    numbers = []
+    for typecode in NUMERIC_TYPECODES:
+        values = array(typecode)
+        values.frombytes(data[pos:pos + count * values.itemsize])
+        pos += count * values.itemsize
+        numbers.append(values)
+    route_ids, trip_ids, start_dates, next_stops, direction_chars, vehicle_stops, statuses, sections, station_names = columns
+    times, arrivals, station_indexes, directions = numbers
+
+    results: Dict[str, List[Train]] = {route: [] for route in routes}
+    for i in range(count):
+        route_id = route_ids[i]
+        trains = results.get(route_id)
+        if trains is None:
+            trains = results[route_id] = []
+        direction = directions[i]
+        trains.append(Train(trip_ids[i], route_id, start_dates[i], next_stops[i], times[i],
+                            direction if direction >= 0 else None, station_indexes[i], direction_chars[i],
+                            vehicle_stops[i], statuses[i], sections[i], station_names[i], arrivals[i] or None))
+    return results
+
+# Per worker process
+_traingetters: Dict[str, TrainGetter] = {}
+_blocks: Dict[str, shared_memory.SharedMemory] = {}
+
+def _init_worker(metrics_enabled: bool) -> None:
+    # Workers record parse/extract/sort timings and dropped entities like the serial
+    # path and hand them back with each result (see _decode_task); values inherited
+    # from a forked parent are dropped so they aren't counted twice
+    mta_metrics.enabled = metrics_enabled
+    mta_metrics.REGISTRY.take()
+
+def _attach(url: str, name: str) -> shared_memory.SharedMemory:
+    # Blocks are reused across polls; a feed's block only changes when it has to grow
+    block = _blocks.get(url)
+    if block is None or block.name != name:
+        if block is not None:
+            block.close()
+        block = _blocks[url] = shared_memory.SharedMemory(name=name)
+    return block
+
+def extract_payload(payload, routes: Sequence[str], now: Optional[float] = None, url: Optional[str] = None) -> List[Tuple[str, List[Train]]]:
+    # ParseFromString + bucket_feed + build_trains for one feed, as the serial path does it
+    from google.transit import gtfs_realtime_pb2
+    feed = gtfs_realtime_pb2.FeedMessage()
+    started = time.perf_counter()
+    feed.ParseFromString(payload)
+    if mta_metrics.enabled and url is not None:
+        mta_metrics.PARSE_SECONDS.observe((mta_metrics.feed_label(url),), time.perf_counter() - started)
+    trip_updates, vehicles = bucket_feed(feed, routes)
+    results = []
+    for route in routes:
+        traingetter = _traingetters.get(route)
+        if traingetter is None:
+            traingetter = _traingetters[route] = TrainGetter(route)
+        results.append((route, traingetter.build_trains(trip_updates[route], vehicles, now)))
+    return results
+
+def _decode_task(url: str, name: str, size: int, capacity: int, routes: Sequence[str], now: float) -> Tuple[Union[int, bytes], Dict[str, list]]:
+    # (result size when it was written into the block, or the bytes themselves when
+    # they did not fit; metrics recorded by this task)
+    block = _attach(url, name)
+    with block.buf[:size] as payload:
+        results = extract_payload(payload, routes, now, url)
+    data = encode_trains(results)
+    taken = mta_metrics.REGISTRY.take() if mta_metrics.enabled else {}
+    if len(data) > capacity:
+        return data, taken
+    block.buf[size:size + len(data)] = data
+    return len(data), taken
+
+class DecodePool():
+    # Decodes raw feed payloads and extracts trains in worker processes, so a
+    # whole-system refresh is not serialized on the GIL. Payloads go to the workers
+    # through one shared memory block per feed and the trains come back as packed
+    # records in the same block; only names, sizes and the metrics each task
+    # recorded cross the pipe.
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        # Workers are never forked from this process: by now the FeedFetcher's threads
+        # are running, and a fork could copy a lock one of them holds
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                             initargs=(mta_metrics.enabled,))
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+
+    def _block(self, url: str, size: int) -> Tuple[shared_memory.SharedMemory, int]:
+        # (block, result capacity) holding at least `size` payload bytes plus result space
+        capacity = max(MIN_RESULT_SPACE, int(size * RESULT_SPACE))
+        block = self._blocks.get(url)
+        if block is None or block.size < size + capacity:
+            if block is not None:
+                block.close()
+                block.unlink()
+            # Grow with headroom so a slightly bigger feed next poll doesn't reallocate
+            block = self._blocks[url] = shared_memory.SharedMemory(create=True, size=int((size + capacity) * 1.25))
+        return block, block.size - size
+
+    def decode_all(self, payloads: Dict[str, Tuple[bytes, Sequence[str]]], now: Optional[float] = None) -> Dict[str, List[Train]]:
+        # {url: (payload, routes)} -> {route: trains}, one task per feed, all against one `now`
+        if now is None:
+            now = time.time()
+        with mta_metrics.timed("decode", "pool"):
+            pending = []
+            for url, (payload, routes) in payloads.items():
+                size = len(payload)
+                block, capacity = self._block(url, size)
+                block.buf[:size] = payload
+                future = self._executor.submit(_decode_task, url, block.name, size, capacity, list(routes), now)
+                pending.append((future, block, size, routes))
+
+            results: Dict[str, List[Train]] = {}
+            for future, block, size, routes in pending:
+                written, taken = future.result()
+                if taken:
+                    mta_metrics.REGISTRY.merge(taken)
+                if isinstance(written, bytes):
+                    results.update(decode_trains(written, routes))
+                else:
+                    with block.buf[size:size + written] as data:
+                        results.update(decode_trains(data, routes))
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self) -> "DecodePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
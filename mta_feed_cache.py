@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process coalescing, every process fetches for itself
+    fcntl = None
+
+# One file per feed URL, replaced atomically as a whole (a 304 only rewrites fetched-at
+# in place, see touch()):
+#   magic, feed header timestamp, fetched-at (unix), ETag length, Last-Modified length
+#   ETag, Last-Modified (utf-8), then the raw protobuf payload
+ENTRY = struct.Struct("<8sqdHH")
+MAGIC = b"MTAFEED1"
+FETCHED_AT = struct.Struct("<d")
+FETCHED_AT_OFFSET = struct.calcsize("<8sq")
+
+def default_cache_dir() -> str:
+    uid = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"mta-rail-feeds-{uid}")
+
+@dataclass
+class CacheEntry:
+    header_timestamp: int
+    fetched_at: float
+    etag: str
+    last_modified: str
+    payload: bytes
+
+    @property
+    def validators(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class FeedCache():
+    # Shared on-disk cache of raw feed payloads for every process on the machine.
+    # An entry is fresh until `ttl` seconds past the feed's own header timestamp (the
+    # MTA publishes roughly every 30s), but never for less than `min_ttl` after it was
+    # fetched, so a feed whose timestamp stops moving is not re-fetched in a tight loop.
+    # Refreshes happen under an exclusive per-URL lock; processes that queue on the lock
+    # find the entry fresh when they get it and skip the network.
+    def __init__(self, directory: Optional[str] = None, ttl: float = 30.0, min_ttl: float = 5.0) -> None:
+        self.directory = directory or default_cache_dir()
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".feed")
+
+    def fresh(self, entry: CacheEntry, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.time()
+        expires = max(entry.header_timestamp + self.ttl, entry.fetched_at + self.min_ttl)
+        return now < expires
+
+    def stamp(self, url: str) -> Optional[int]:
+        # Cheap change detector for in-process memoization (mtime_ns of the entry)
+        try:
+            return os.stat(self.path(url)).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, url: str, parse=None):
+        # (CacheEntry, parse(payload view) or None); the payload is read through mmap and
+        # only copied into the entry when no parser is given
+        try:
+            f = open(self.path(url), "rb")
+        except OSError:
+            return None, None
+        with f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return None, None
+        try:
+            if len(mm) < ENTRY.size:
+                return None, None
+            magic, header_timestamp, fetched_at, etag_len, lm_len = ENTRY.unpack_from(mm, 0)
+            if magic != MAGIC:
+                return None, None
+            start = ENTRY.size + etag_len + lm_len
+            etag = mm[ENTRY.size:ENTRY.size + etag_len].decode("utf-8")
+            last_modified = mm[ENTRY.size + etag_len:start].decode("utf-8")
+            parsed = None
+            if parse is not None:
+                with memoryview(mm) as view, view[start:] as payload:
+                    parsed = parse(payload)
+                body = b""
+            else:
+                body = mm[start:]
+            return CacheEntry(header_timestamp, fetched_at, etag, last_modified, body), parsed
+        finally:
+            mm.close()
+
+    def store(self, url: str, payload: bytes, header_timestamp: int, etag: str = "", last_modified: str = "",
+              fetched_at: Optional[float] = None) -> None:
+        path = self.path(url)
+        etag_bytes = (etag or "").encode("utf-8")
+        lm_bytes = (last_modified or "").encode("utf-8")
+        header = ENTRY.pack(MAGIC, header_timestamp, fetched_at if fetched_at is not None else time.time(), len(etag_bytes), len(lm_bytes))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(etag_bytes)
+            f.write(lm_bytes)
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def touch(self, url: str, header_timestamp: int, fetched_at: Optional[float] = None) -> bool:
+        # Restart an entry's min_ttl (after a 304) by rewriting only its fetched-at field.
+        # False when the file no longer holds an entry for that header timestamp
+        path = self.path(url)
+        try:
+            with open(path, "r+b") as f:
+                header = f.read(ENTRY.size)
+                if len(header) < ENTRY.size:
+                    return False
+                magic, timestamp, _, _, _ = ENTRY.unpack(header)
+                if magic != MAGIC or timestamp != header_timestamp:
+                    return False
+                f.seek(FETCHED_AT_OFFSET)
+                f.write(FETCHED_AT.pack(fetched_at if fetched_at is not None else time.time()))
+                f.flush()
+                mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            # stamp() has to move for other processes' memos, even within one mtime tick
+            os.utime(path, ns=(time.time_ns(), max(time.time_ns(), mtime_ns + 1)))
+        except OSError:
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def lock(self, url: str) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self.path(url) + ".lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.transit import gtfs_realtime_pb2
+
+import mta_metrics
+from mta_feed_cache import CacheEntry, FeedCache
+
+MTA_FEED_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/"
+
+@dataclass
+class FeedResult:
+    url: str
+    feed: Optional[gtfs_realtime_pb2.FeedMessage] = None
+    # Raw protobuf instead of `feed` when the fetcher was made with decode=False
+    payload: Optional[bytes] = None
+    status: Optional[int] = None
+    not_modified: bool = False
+    error: Optional[Exception] = None
+    elapsed: float = 0.0
+    size: int = 0
+    # Served from the shared on-disk cache without touching the network
+    cached: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return (self.feed is not None or self.payload is not None) and self.error is None
+
+class FeedFetcher():
+    # Fetches GTFS-RT feeds concurrently over one pooled keep-alive session.
+    # Validators (ETag / Last-Modified) are remembered per URL; a 304 returns the
+    # previously decoded FeedMessage without re-parsing. With a FeedCache, fresh
+    # payloads written by any process are used instead of the network. With
+    # decode=False, results carry the raw payload (e.g. for a DecodePool) unparsed.
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 10.0, connect_timeout: float = 3.05,
+                 retries: int = 3, backoff: float = 0.5, max_workers: int = 8, cache: Optional[FeedCache] = None,
+                 decode: bool = True) -> None:
+        self.base_url = base_url
+        self.cache = cache
+        self.decode = decode
+        self.timeout = (connect_timeout, timeout)
+        self.max_workers = max_workers
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feed-fetch")
+        self._lock = threading.Lock()
+        self._validators: Dict[str, Dict[str, str]] = {}
+        # url -> decoded feed, or raw payload when decode=False
+        self._feeds: Dict[str, Union[gtfs_realtime_pb2.FeedMessage, bytes]] = {}
+        # url -> (cache file stamp, entry, feed or payload), so an unchanged entry is parsed once
+        self._shared: Dict[str, Tuple[int, CacheEntry, Union[gtfs_realtime_pb2.FeedMessage, bytes]]] = {}
+
+    def resolve(self, url: str) -> str:
+        # Point MTA feed URLs at another host (e.g. a local fixture server)
+        if self.base_url and url.startswith(MTA_FEED_BASE_URL):
+            return self.base_url.rstrip("/") + "/" + url[len(MTA_FEED_BASE_URL):]
+        return url
+
+    def fetch(self, url: str) -> FeedResult:
+        if self.cache is not None:
+            return self._fetch_shared(url)
+        result = FeedResult(url=url)
+        with self._lock:
+            headers = dict(self._validators.get(url, {}))
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.resolve(url), headers=headers, timeout=self.timeout)
+            result.status = response.status_code
+            if response.status_code == 304:
+                with self._lock:
+                    value = self._feeds.get(url)
+                if value is None:
+                    raise requests.exceptions.HTTPError(f"304 Not Modified without a cached feed for {url}", response=response)
+                self._assign(result, value)
+                result.not_modified = True
+            else:
+                response.raise_for_status()
+                value = _parse_feed(response.content, url) if self.decode else response.content
+                self._assign(result, value)
+                result.size = len(response.content)
+
+                validators = {}
+                if response.headers.get("ETag"):
+                    validators["If-None-Match"] = response.headers["ETag"]
+                if response.headers.get("Last-Modified"):
+                    validators["If-Modified-Since"] = response.headers["Last-Modified"]
+                with self._lock:
+                    self._validators[url] = validators
+                    self._feeds[url] = value
+        except Exception as e:
+            result.feed = result.payload = None
+            result.error = e
+        result.elapsed = time.perf_counter() - started
+        if mta_metrics.enabled:
+            self._record(result)
+        return result
+
+    def _assign(self, result: FeedResult, value: Union[gtfs_realtime_pb2.FeedMessage, bytes]) -> None:
+        if self.decode:
+            result.feed = value
+        else:
+            result.payload = value
+
+    def _load_shared(self, url: str, target: str) -> Tuple[Optional[Union[gtfs_realtime_pb2.FeedMessage, bytes]], Optional[CacheEntry], bool, bool]:
+        # (feed or payload, entry, fresh, same entry as last time) from the on-disk cache
+        stamp = self.cache.stamp(target)
+        if stamp is None:
+            return None, None, False, False
+        with self._lock:
+            memo = self._shared.get(url)
+        if memo is not None and memo[0] == stamp:
+            _, entry, value = memo
+            return value, entry, self.cache.fresh(entry), True
+        if self.decode:
+            entry, value = self.cache.load(target, parse=lambda payload: _parse_feed(payload, url))
+        else:
+            entry, _ = self.cache.load(target)
+            value = entry.payload if entry is not None else None
+        if entry is None:
+            return None, None, False, False
+        with self._lock:
+            self._shared[url] = (stamp, entry, value)
+        return value, entry, self.cache.fresh(entry), False
+
+    def _fetch_shared(self, url: str) -> FeedResult:
+        result = FeedResult(url=url, cached=True)
+        target = self.resolve(url)
+        started = time.perf_counter()
+        try:
+            value, entry, fresh, same = self._load_shared(url, target)
+            if not fresh:
+                # One process refreshes; the others wait here and then find it fresh
+                with self.cache.lock(target):
+                    value, entry, fresh, unchanged = self._load_shared(url, target)
+                    if not fresh:
+                        result.cached = False
+                        value, refreshed_same = self._refresh_shared(url, target, entry, result)
+                        unchanged = unchanged and refreshed_same
+                    same = same and unchanged
+            self._assign(result, value)
+            result.not_modified = same
+        except Exception as e:
+            result.feed = result.payload = None
+            result.error = e
+        result.elapsed = time.perf_counter() - started
+        if mta_metrics.enabled:
+            self._record(result)
+        return result
+
+    def _refresh_shared(self, url: str, target: str, entry: Optional[CacheEntry], result: FeedResult) -> Tuple[Union[gtfs_realtime_pb2.FeedMessage, bytes], bool]:
+        response = self.session.get(target, headers=entry.validators if entry else {}, timeout=self.timeout)
+        result.status = response.status_code
+        if response.status_code == 304:
+            # Unchanged upstream: restart the entry's min_ttl without re-parsing, and
+            # without rewriting the payload (only the entry's fetched-at changes)
+            with self._lock:
+                memo = self._shared.get(url)
+            fetched_at = time.time()
+            if entry is not None and memo is not None and self.cache.touch(target, entry.header_timestamp, fetched_at):
+                kept = replace(entry, fetched_at=fetched_at)
+                with self._lock:
+                    self._shared[url] = (self.cache.stamp(target), kept, memo[2])
+                return memo[2], True
+            # The entry was evicted (e.g. by another process) since it was read: nothing
+            # to serve the 304 from, so fetch the body unconditionally
+            response = self.session.get(target, timeout=self.timeout)
+            result.status = response.status_code
+        response.raise_for_status()
+        payload = response.content
+        if self.decode:
+            value = _parse_feed(payload, url)
+            timestamp = value.header.timestamp
+        else:
+            value = payload
+            timestamp = header_timestamp(payload)
+        result.size = len(payload)
+        entry = CacheEntry(timestamp, time.time(), response.headers.get("ETag", ""),
+                           response.headers.get("Last-Modified", ""), b"")
+        self.cache.store(target, payload, entry.header_timestamp, entry.etag, entry.last_modified, entry.fetched_at)
+        with self._lock:
+            self._shared[url] = (self.cache.stamp(target), entry, value)
+        return value, False
+
+    def _record(self, result: FeedResult) -> None:
+        label = (mta_metrics.feed_label(result.url),)
+        mta_metrics.FETCH_SECONDS.observe(label, result.elapsed)
+        mta_metrics.FETCH_BYTES.inc(label, result.size)
+        status = str(result.status) if result.status is not None else ("cache" if result.cached and result.ok else "error")
+        mta_metrics.FETCH_RESPONSES.inc(label + (status,))
+        if result.feed is not None and not result.not_modified:
+            mta_metrics.record_feed(result.url, result.feed)
+
+    def fetch_all(self, urls: Iterable[str]) -> Dict[str, FeedResult]:
+        urls = list(dict.fromkeys(urls))
+        if len(urls) == 1:
+            return {urls[0]: self.fetch(urls[0])}
+        futures = {url: self._executor.submit(self.fetch, url) for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self) -> "FeedFetcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _parse_feed(payload, url: Optional[str] = None) -> gtfs_realtime_pb2.FeedMessage:
+    feed = gtfs_realtime_pb2.FeedMessage()
+    started = time.perf_counter()
+    feed.ParseFromString(payload)
+    if mta_metrics.enabled and url is not None:
+        mta_metrics.PARSE_SECONDS.observe((mta_metrics.feed_label(url),), time.perf_counter() - started)
+    return feed
+
+def _varint(data, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def header_timestamp(payload) -> int:
+    # FeedMessage.header.timestamp without decoding any entities: walk the top-level
+    # fields and parse only the header (field 1), which feeds put first
+    pos, end = 0, len(payload)
+    while pos < end:
+        key, pos = _varint(payload, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            _, pos = _varint(payload, pos)
+        elif wire_type == 2:
+            length, pos = _varint(payload, pos)
+            if key >> 3 == 1:
+                header = gtfs_realtime_pb2.FeedHeader()
+                header.ParseFromString(bytes(payload[pos:pos + length]))
+                return header.timestamp
+            pos += length
+        else:
+            break
+    return 0
+
+def load_feed_payload(path: str) -> bytes:
+    # Serialized protobuf for a recorded feed (raw binary or text dump like feed_debug.txt)
+    from mta_replay import parse_feed_bytes
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:1] == b"\x0a":
+        return data
+    return parse_feed_bytes(data).SerializeToString()
+
+def make_fixture_server(payload: bytes, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    # Local stand-in for api-endpoint.mta.info: serves the same payload for every feed path
+    etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+    last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == last_modified:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), FixtureHandler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a recorded GTFS-RT feed as a local stand-in for the MTA API")
+    parser.add_argument('feed', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "feed_debug.txt"), help='Recorded feed (text or binary protobuf)')
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = make_fixture_server(load_feed_payload(args.feed), args.host, args.port)
+    print(f"Serving {args.feed} at http://{args.host}:{server.server_port}/ (use --feed-base-url)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import csv
+import datetime
+import io
+import mmap
+import os
+import re
+import struct
+import time
+import zipfile
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Compiled form of a static GTFS zip (stops, trips, stop_times, calendar, calendar_dates).
+# stop_times.txt is streamed row by row into packed columns, never held as text.
+#
+# Layout (native byte order, every table 4-byte aligned; a local build artifact like
+# mta_station_index's):
+#   header    magic, version, zip size, zip mtime_ns, string count, blob length, stop count,
+#             route count, service count, exception count, trip count, stop time count
+#   uint32    string offsets [strings + 1]   (strings are interned and sorted)
+#   bytes     utf-8 string blob
+#   uint32    stops      [stop_id string, name string]
+#   uint32    routes     [route string, first by_route slot, trip count]
+#   uint32    services   [service string, weekday mask (Monday = bit 0), start date, end date]
+#   uint32    exceptions [date, service, added (1) / removed (2)], sorted by date
+#   uint32    trips      [trip_id string, realtime key string, route, service, direction, first stop time, stop count]
+#   uint32    stop time stop                  } one row per stop_times.txt row, grouped by
+#   int32     stop time arrival, departure    } trip in stop_sequence order; seconds after
+#                                             } the service day's noon minus 12h, -1 if untimed
+#   uint32    by_route   trip indexes, by route then first departure
+#   uint32    stop_first [stops + 1] into by_stop
+#   uint32    by_stop    stop time rows, by stop then departure
+#   uint32    stop_slots [power of two >= 2 x stop times] open-addressing table of
+#             (trip, stop) -> stop time row + 1 (0 = empty), linear probing from _slot()
+#   uint32    strings    agency timezone string id
+MAGIC = b"MTAGTFS1"
+VERSION = 2
+HEADER = struct.Struct("=8sIQqIIIIIIII")
+SERVICE = 4
+EXCEPTION = 3
+TRIP = 7
+EXCEPTION_ADDED = 1
+EXCEPTION_REMOVED = 2
+UNTIMED = -1
+
+# NYCT trip ids end in the realtime form: origin time in hundredths of a minute past
+# midnight, route, direction and path, e.g. AFA23GEN-1038-Weekday-00_014600_1..S03R
+TRIP_KEY = re.compile(r"(\d{6})_([^.]*)\.+([NS])(\w*)$")
+
+def default_index_path(zip_path: str) -> str:
+    return os.path.splitext(zip_path)[0] + ".gtfsidx"
+
+def trip_key(trip_id: str) -> Optional[str]:
+    # Realtime-comparable part of a static or realtime trip id ("014600_1..S03R")
+    m = TRIP_KEY.search(trip_id)
+    if m is None:
+        return None
+    return f"{m.group(1)}_{m.group(2)}..{m.group(3)}{m.group(4)}"
+
+def short_trip_key(key: str) -> str:
+    # Without the path suffix ("014600_1..S"), for realtime ids that omit or vary it
+    m = TRIP_KEY.search(key)
+    return f"{m.group(1)}_{m.group(2)}..{m.group(3)}" if m else key
+
+def origin_seconds(trip_id: str) -> Optional[int]:
+    # Scheduled origin time encoded in the trip id, in seconds past midnight
+    m = TRIP_KEY.search(trip_id)
+    return int(m.group(1)) * 60 // 100 if m else None
+
+def _seconds(value: str) -> int:
+    # "H:MM:SS" / "HH:MM:SS" (hours may pass 24) -> seconds; blank -> UNTIMED
+    value = value.strip()
+    if not value:
+        return UNTIMED
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _date(value: str) -> int:
+    # "YYYYMMDD" or "YYYY-MM-DD" -> YYYYMMDD as an int
+    return int(value.strip().replace("-", ""))
+
+def _rows(archive: zipfile.ZipFile, name: str) -> Iterator[Dict[str, str]]:
+    # Streams one member as dicts of the columns; nothing if the member is missing
+    try:
+        member = archive.open(name)
+    except KeyError:
+        return
+    with member, io.TextIOWrapper(member, encoding="utf-8-sig", newline="") as text:
+        yield from csv.DictReader(text)
+
+def _columns(archive: zipfile.ZipFile, name: str, wanted: Tuple[str, ...]) -> Iterator[List[str]]:
+    # Like _rows, but plain lists in `wanted` order (cheaper for stop_times.txt)
+    try:
+        member = archive.open(name)
+    except KeyError:
+        return
+    with member, io.TextIOWrapper(member, encoding="utf-8-sig", newline="") as text:
+        reader = csv.reader(text)
+        header = [column.strip() for column in next(reader, [])]
+        positions = [header.index(column) for column in wanted]
+        for row in reader:
+            if row:
+                yield [row[i] for i in positions]
+
+def _pad(n: int) -> int:
+    return (n + 3) & ~3
+
+def _slot_count(n: int) -> int:
+    # Keeps the (trip, stop) table at most half full
+    size = 1
+    while size < 2 * n:
+        size <<= 1
+    return size
+
+def _slot(trip: int, stop: int) -> int:
+    return ((trip * 0x9E3779B1) ^ (stop * 0x85EBCA77)) >> 7
+
+def _bucket_sort(buckets: array, n_buckets: int, key) -> Tuple[array, array]:
+    # Row order grouped by bucket, then by key(row) within each bucket, plus where each
+    # bucket starts ([n_buckets + 1]). Grouping is a counting sort into packed arrays,
+    # so only one bucket's rows (a trip's or a stop's) are ever sorted as Python objects
+    first = array("I", bytes(4 * (n_buckets + 1)))
+    for bucket in buckets:
+        first[bucket + 1] += 1
+    for bucket in range(n_buckets):
+        first[bucket + 1] += first[bucket]
+    fill = array("I", first)
+    order = array("I", bytes(4 * len(buckets)))
+    for row, bucket in enumerate(buckets):
+        order[fill[bucket]] = row
+        fill[bucket] += 1
+    del fill
+    for bucket in range(n_buckets):
+        lo, hi = first[bucket], first[bucket + 1]
+        if hi - lo > 1:
+            order[lo:hi] = array("I", sorted(order[lo:hi], key=key))
+    return order, first
+
+def compile_schedule(zip_path: str, zip_size: int = 0, zip_mtime_ns: int = 0) -> bytes:
+    with zipfile.ZipFile(zip_path) as archive:
+        timezone = next((row.get("agency_timezone", "") for row in _rows(archive, "agency.txt")), "") or "America/New_York"
+
+        stops: List[Tuple[str, str]] = []
+        stop_ids: Dict[str, int] = {}
+        for row in _rows(archive, "stops.txt"):
+            stop_ids[row["stop_id"]] = len(stops)
+            stops.append((row["stop_id"], row.get("stop_name", "")))
+
+        services: List[List] = []
+        service_ids: Dict[str, int] = {}
+        weekdays = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+        for row in _rows(archive, "calendar.txt"):
+            mask = sum(1 << i for i, day in enumerate(weekdays) if row.get(day, "0").strip() == "1")
+            service_ids[row["service_id"]] = len(services)
+            services.append([row["service_id"], mask, _date(row["start_date"]), _date(row["end_date"])])
+        exceptions = []
+        for row in _rows(archive, "calendar_dates.txt"):
+            service = service_ids.get(row["service_id"])
+            if service is None:
+                # Services defined only by calendar_dates.txt
+                service = service_ids[row["service_id"]] = len(services)
+                services.append([row["service_id"], 0, 0, 0])
+            exceptions.append((_date(row["date"]), service, int(row["exception_type"])))
+        exceptions.sort()
+
+        routes: Dict[str, int] = {}
+        trips: List[List] = []
+        trip_ids: Dict[str, int] = {}
+        for row in _rows(archive, "trips.txt"):
+            service = service_ids.get(row["service_id"])
+            if service is None:
+                service = service_ids[row["service_id"]] = len(services)
+                services.append([row["service_id"], 0, 0, 0])
+            route = routes.setdefault(row["route_id"], len(routes))
+            direction = row.get("direction_id", "").strip()
+            trip_ids[row["trip_id"]] = len(trips)
+            trips.append([row["trip_id"], trip_key(row["trip_id"]) or row["trip_id"], route, service,
+                          int(direction) if direction else 0, 0, 0])
+
+        # Stream stop_times.txt into packed columns. Clock strings repeat heavily (a day
+        # has at most ~100k distinct ones), so each is parsed once
+        clock: Dict[str, int] = {}
+        st_trip, st_seq, st_stop = array("I"), array("I"), array("I")
+        st_arrival, st_departure = array("i"), array("i")
+        grouped = True
+        last_trip, last_seq, seen = -1, -1, set()
+        for trip_id, arrival, departure, stop_id, sequence in _columns(
+                archive, "stop_times.txt", ("trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence")):
+            trip = trip_ids.get(trip_id)
+            stop = stop_ids.get(stop_id)
+            if trip is None or stop is None:
+                continue
+            sequence = int(sequence)
+            if trip != last_trip:
+                if trip in seen:
+                    grouped = False
+                seen.add(trip)
+                last_trip, last_seq = trip, -1
+            elif sequence <= last_seq:
+                grouped = False
+            last_seq = sequence
+            seconds = clock.get(arrival)
+            if seconds is None:
+                seconds = clock[arrival] = _seconds(arrival)
+            arrival = seconds
+            seconds = clock.get(departure)
+            if seconds is None:
+                seconds = clock[departure] = _seconds(departure)
+            departure = seconds
+            st_trip.append(trip)
+            st_seq.append(sequence)
+            st_stop.append(stop)
+            st_arrival.append(arrival if arrival != UNTIMED else departure)
+            st_departure.append(departure if departure != UNTIMED else arrival)
+        del seen, clock
+
+    n_stop_times = len(st_trip)
+    if not grouped:
+        # Rare: rows not grouped by trip in stop_sequence order
+        order, _ = _bucket_sort(st_trip, len(trips), st_seq.__getitem__)
+        st_trip = array("I", map(st_trip.__getitem__, order))
+        st_stop = array("I", map(st_stop.__getitem__, order))
+        st_arrival = array("i", map(st_arrival.__getitem__, order))
+        st_departure = array("i", map(st_departure.__getitem__, order))
+        del order
+    del st_seq
+    for row in range(n_stop_times):
+        trip = trips[st_trip[row]]
+        if not trip[6]:
+            trip[5] = row
+        trip[6] += 1
+    del st_trip
+
+    def route_departure(t: int) -> int:
+        # Packed (route, first departure) sort key
+        trip = trips[t]
+        return trip[2] << 32 | (max(0, st_departure[trip[5]]) if trip[6] else 0)
+
+    by_route = array("I", sorted(range(len(trips)), key=route_departure))
+    route_first: Dict[int, int] = {}
+    for slot, t in enumerate(by_route):
+        route_first.setdefault(trips[t][2], slot)
+    route_count = [0] * len(routes)
+    for trip in trips:
+        route_count[trip[2]] += 1
+
+    by_stop, stop_first = _bucket_sort(st_stop, len(stops), st_departure.__getitem__)
+
+    # (trip, stop) -> row; a stop a trip visits twice keeps its first visit
+    stop_slots = array("I", bytes(4 * _slot_count(n_stop_times)))
+    mask = len(stop_slots) - 1
+    for t, trip in enumerate(trips):
+        first, end = trip[5], trip[5] + trip[6]
+        for row in range(first, end):
+            stop = st_stop[row]
+            slot = _slot(t, stop) & mask
+            while True:
+                held = stop_slots[slot]
+                if not held:
+                    stop_slots[slot] = row + 1
+                    break
+                if first <= held - 1 < end and st_stop[held - 1] == stop:
+                    break
+                slot = (slot + 1) & mask
+
+    strings = {timezone}
+    strings.update(routes)
+    for stop_id, name in stops:
+        strings.add(stop_id)
+        strings.add(name)
+    for service in services:
+        strings.add(service[0])
+    for trip in trips:
+        strings.add(trip[0])
+        strings.add(trip[1])
+    strings = sorted(strings)
+    string_ids = {s: i for i, s in enumerate(strings)}
+    blob = bytearray()
+    offsets = array("I", [0])
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    blob += b"\0" * (_pad(len(blob)) - len(blob))
+
+    stop_table = array("I")
+    for stop_id, name in stops:
+        stop_table.extend((string_ids[stop_id], string_ids[name]))
+    route_table = array("I")
+    for route, r in routes.items():
+        route_table.extend((string_ids[route], route_first.get(r, 0), route_count[r]))
+    service_table = array("I")
+    for service in services:
+        service_table.extend((string_ids[service[0]], service[1], service[2], service[3]))
+    exception_table = array("I")
+    for exception in exceptions:
+        exception_table.extend(exception)
+    trip_table = array("I")
+    for trip in trips:
+        trip_table.extend((string_ids[trip[0]], string_ids[trip[1]], trip[2], trip[3], trip[4], trip[5], trip[6]))
+
+    header = HEADER.pack(MAGIC, VERSION, zip_size, zip_mtime_ns, len(strings), len(blob), len(stops), len(routes),
+                         len(services), len(exceptions), len(trips), n_stop_times)
+    return b"".join((header, offsets.tobytes(), bytes(blob), stop_table.tobytes(), route_table.tobytes(),
+                     service_table.tobytes(), exception_table.tobytes(), trip_table.tobytes(), st_stop.tobytes(),
+                     st_arrival.tobytes(), st_departure.tobytes(), by_route.tobytes(), stop_first.tobytes(),
+                     by_stop.tobytes(), stop_slots.tobytes(), array("I", [string_ids[timezone]]).tobytes()))
+
+def build_schedule(zip_path: str, index_path: Optional[str] = None) -> bytes:
+    # Compile the GTFS zip and write the index next to it (atomically); returns the bytes
+    index_path = index_path or default_index_path(zip_path)
+    st = os.stat(zip_path)
+    data = compile_schedule(zip_path, st.st_size, st.st_mtime_ns)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # Read-only location: fall back to the in-memory index
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return data
+
+class StaticSchedule():
+    # Read side of a compiled GTFS schedule. Tables are views over the (memory-mapped)
+    # index; the only per-process structures are the stop_id / trip key dictionaries,
+    # built on first use, which make a realtime match O(1); the scheduled time at a
+    # stop is then one probe into the persisted (trip, stop) table.
+    def __init__(self, buffer) -> None:
+        self._buffer = buffer
+        view = memoryview(buffer)
+        (magic, version, self.zip_size, self.zip_mtime_ns, n_strings, blob_len, n_stops, n_routes,
+         n_services, n_exceptions, n_trips, n_stop_times) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a GTFS schedule index (or built by another version)")
+        words = (n_strings + 1 + n_stops * 2 + n_routes * 3 + n_services * SERVICE + n_exceptions * EXCEPTION
+                 + n_trips * (TRIP + 1) + n_stop_times * 4 + n_stops + 1 + _slot_count(n_stop_times) + 1)
+        size = HEADER.size + blob_len + words * 4
+        if view.nbytes != size:
+            raise ValueError(f"GTFS schedule index is {view.nbytes} bytes, its header describes {size}")
+
+        def table(offset: int, count: int, fmt: str = "I"):
+            return view[offset:offset + count * 4].cast(fmt), offset + count * 4
+
+        offset = HEADER.size
+        self._offsets, offset = table(offset, n_strings + 1)
+        self._blob = view[offset:offset + blob_len]
+        offset += blob_len
+        self._stops, offset = table(offset, n_stops * 2)
+        self._routes, offset = table(offset, n_routes * 3)
+        self._services, offset = table(offset, n_services * SERVICE)
+        self._exceptions, offset = table(offset, n_exceptions * EXCEPTION)
+        self._trips, offset = table(offset, n_trips * TRIP)
+        self.stop_time_stop, offset = table(offset, n_stop_times)
+        self.stop_time_arrival, offset = table(offset, n_stop_times, "i")
+        self.stop_time_departure, offset = table(offset, n_stop_times, "i")
+        self._by_route, offset = table(offset, n_trips)
+        self._stop_first, offset = table(offset, n_stops + 1)
+        self._by_stop, offset = table(offset, n_stop_times)
+        self._stop_slots, offset = table(offset, _slot_count(n_stop_times))
+        (timezone,), offset = table(offset, 1)
+        self.timezone = self.string(timezone)
+        self.n_trips = n_trips
+        self.n_stop_times = n_stop_times
+        self._exception_dates = self._exceptions[0::EXCEPTION]
+        self._stop_index: Optional[Dict[str, int]] = None
+        self._route_index: Optional[Dict[str, int]] = None
+        self._trip_keys: Optional[Dict[str, List[int]]] = None
+        self._day_starts: Dict[int, int] = {}
+        self._active: Dict[int, frozenset] = {}
+        self._stop_time_owners: Optional[array] = None
+
+    @classmethod
+    def open(cls, zip_path: str, index_path: Optional[str] = None, rebuild: bool = False) -> "StaticSchedule":
+        # Memory-map the compiled index, rebuilding it first if the zip has changed since
+        index_path = index_path or default_index_path(zip_path)
+        st = os.stat(zip_path)
+        if not rebuild:
+            mm = None
+            try:
+                with open(index_path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # Freshness is read straight off the header so a stale map has no views to release
+                zip_size, zip_mtime_ns = HEADER.unpack_from(mm, 0)[2:4]
+                if zip_size == st.st_size and zip_mtime_ns == st.st_mtime_ns:
+                    return cls(mm)
+            except (OSError, ValueError, struct.error):
+                pass
+            # Out here the views of a failed cls(mm) are gone with the traceback
+            if mm is not None:
+                mm.close()
+        return cls(build_schedule(zip_path, index_path))
+
+    def string(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    # -- lookups --
+
+    def stop_index(self, stop_id: str) -> Optional[int]:
+        if self._stop_index is None:
+            self._stop_index = {self.string(self._stops[s * 2]): s for s in range(len(self._stops) // 2)}
+        return self._stop_index.get(stop_id)
+
+    def stop_id(self, stop: int) -> str:
+        return self.string(self._stops[stop * 2])
+
+    def stop_name(self, stop: int) -> str:
+        return self.string(self._stops[stop * 2 + 1])
+
+    def routes(self) -> List[str]:
+        return [self.string(self._routes[r * 3]) for r in range(len(self._routes) // 3)]
+
+    def trip_id(self, trip: int) -> str:
+        return self.string(self._trips[trip * TRIP])
+
+    def trip_route(self, trip: int) -> str:
+        return self.string(self._routes[self._trips[trip * TRIP + 2] * 3])
+
+    def trip_service(self, trip: int) -> str:
+        return self.string(self._services[self._trips[trip * TRIP + 3] * SERVICE])
+
+    def trip_stop_times(self, trip: int) -> range:
+        # Stop time rows of a trip, in stop_sequence order
+        first, count = self._trips[trip * TRIP + 5], self._trips[trip * TRIP + 6]
+        return range(first, first + count)
+
+    # -- service days --
+
+    def active_services(self, date: int) -> frozenset:
+        # Service indexes running on YYYYMMDD `date` (calendar.txt plus calendar_dates.txt)
+        cached = self._active.get(date)
+        if cached is not None:
+            return cached
+        day = datetime.date(date // 10000, date // 100 % 100, date % 100)
+        bit = 1 << day.weekday()
+        services = self._services
+        active = {s for s in range(len(services) // SERVICE)
+                  if services[s * SERVICE + 1] & bit and services[s * SERVICE + 2] <= date <= services[s * SERVICE + 3]}
+        lo = bisect.bisect_left(self._exception_dates, date)
+        hi = bisect.bisect_right(self._exception_dates, date)
+        for e in range(lo, hi):
+            service, kind = self._exceptions[e * EXCEPTION + 1], self._exceptions[e * EXCEPTION + 2]
+            if kind == EXCEPTION_ADDED:
+                active.add(service)
+            elif kind == EXCEPTION_REMOVED:
+                active.discard(service)
+        cached = self._active[date] = frozenset(active)
+        return cached
+
+    def day_start(self, date: int) -> int:
+        # Unix time that stop time offsets count from: noon minus 12h on `date`, local time
+        start = self._day_starts.get(date)
+        if start is None:
+            from zoneinfo import ZoneInfo
+            noon = datetime.datetime(date // 10000, date // 100 % 100, date % 100, 12, tzinfo=ZoneInfo(self.timezone))
+            start = self._day_starts[date] = int(noon.timestamp()) - 12 * 3600
+        return start
+
+    def route_trips(self, route: str, date: Optional[int] = None) -> List[int]:
+        # Trips of a route by first departure, optionally only those running on `date`
+        if self._route_index is None:
+            self._route_index = {self.string(self._routes[r * 3]): r for r in range(len(self._routes) // 3)}
+        r = self._route_index.get(route)
+        if r is None:
+            return []
+        first, count = self._routes[r * 3 + 1], self._routes[r * 3 + 2]
+        trips = self._by_route[first:first + count].tolist()
+        if date is None:
+            return trips
+        active = self.active_services(date)
+        return [t for t in trips if self._trips[t * TRIP + 3] in active]
+
+    def departures(self, stop_id: str, date: int, after: int = 0, limit: int = 20) -> List[Tuple[int, int]]:
+        # Scheduled (trip, stop time row) pairs leaving `stop_id` on `date` from `after`
+        # seconds into the service day, soonest first
+        stop = self.stop_index(stop_id)
+        if stop is None:
+            return []
+        first, end = self._stop_first[stop], self._stop_first[stop + 1]
+        departures = self.stop_time_departure
+        lo, hi = first, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if departures[self._by_stop[mid]] < after:
+                lo = mid + 1
+            else:
+                hi = mid
+        active = self.active_services(date)
+        owners = self._stop_time_trips()
+        results = []
+        for slot in range(lo, end):
+            row = self._by_stop[slot]
+            trip = owners[row]
+            if self._trips[trip * TRIP + 3] in active:
+                results.append((trip, row))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def _stop_time_trips(self) -> array:
+        # Stop time row -> trip, expanded from the per-trip ranges on first use
+        if self._stop_time_owners is None:
+            owners = array("I", bytes(4 * self.n_stop_times))
+            for trip in range(self.n_trips):
+                for row in self.trip_stop_times(trip):
+                    owners[row] = trip
+            self._stop_time_owners = owners
+        return self._stop_time_owners
+
+    # -- realtime matching --
+
+    def _keys(self) -> Dict[str, List[int]]:
+        if self._trip_keys is None:
+            keys: Dict[str, List[int]] = {}
+            for trip in range(self.n_trips):
+                key = self.string(self._trips[trip * TRIP + 1])
+                keys.setdefault(key, []).append(trip)
+                keys.setdefault(short_trip_key(key), []).append(trip)
+            self._trip_keys = keys
+        return self._trip_keys
+
+    def match(self, trip_id: str, start_date: str) -> Optional[int]:
+        # Scheduled trip for a realtime trip_id on its start date (YYYYMMDD), or None.
+        # Candidates share the realtime key (one per service: weekday, Saturday, ...),
+        # so this is a dict lookup plus a scan over a handful of trips.
+        key = trip_key(trip_id)
+        if key is None or not start_date:
+            return None
+        keys = self._keys()
+        active = self.active_services(_date(start_date))
+        for candidates in (keys.get(key), keys.get(short_trip_key(key))):
+            for trip in candidates or ():
+                if self._trips[trip * TRIP + 3] in active:
+                    return trip
+        return None
+
+    def scheduled_arrival(self, trip: int, stop_id: str, date: int) -> Optional[int]:
+        # Unix time `trip` is scheduled at `stop_id` (e.g. 127S) on `date`
+        row = self.stop_time_row(trip, stop_id)
+        if row is None:
+            return None
+        arrival = self.stop_time_arrival[row]
+        return self.day_start(date) + arrival if arrival != UNTIMED else None
+
+    def stop_time_row(self, trip: int, stop_id: str) -> Optional[int]:
+        # Row of `trip`'s (first) visit to `stop_id`, one probe into the (trip, stop) table
+        stop = self.stop_index(stop_id)
+        if stop is None:
+            return None
+        slots, stop_times = self._stop_slots, self.stop_time_stop
+        first, end = self._trips[trip * TRIP + 5], self._trips[trip * TRIP + 5] + self._trips[trip * TRIP + 6]
+        mask = len(slots) - 1
+        slot = _slot(trip, stop) & mask
+        while True:
+            held = slots[slot]
+            if not held:
+                return None
+            if first <= held - 1 < end and stop_times[held - 1] == stop:
+                return held - 1
+            slot = (slot + 1) & mask
+
+    def delay(self, train) -> Optional[int]:
+        # Seconds a realtime Train runs behind schedule at its next stop (negative if
+        # early), or None when it can't be matched
+        if not train.arrival_time:
+            return None
+        trip = self.match(train.trip_id, train.start_date)
+        if trip is None:
+            return None
+        scheduled = self.scheduled_arrival(trip, train.next_stop_id, _date(train.start_date))
+        return train.arrival_time - scheduled if scheduled is not None else None
+
+def _clock(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a static GTFS zip into a compact schedule index and query it")
+    parser.add_argument('zip', help='Static GTFS zip (e.g. the MTA subway google_transit.zip)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompile even if the index is up to date')
+    parser.add_argument('-s', '--stop', type=str, default=None, metavar='STOP_ID', help='Scheduled departures from this stop (e.g. 127S)')
+    parser.add_argument('--date', type=str, default=None, help='Service date (YYYYMMDD or YYYY-MM-DD, default today)')
+    parser.add_argument('--after', type=str, default=None, metavar='HH:MM', help='With --stop, departures from this time (default now)')
+    parser.add_argument('--delays', type=str, default=None, metavar='ROUTES', help="Match live trains on these routes (comma-separated or 'all') to the schedule and print their delays")
+    parser.add_argument('--feed', type=str, default=None, help='With --delays, use this recorded feed instead of the live feeds')
+    parser.add_argument('--feed-base-url', type=str, default=None, help='With --delays, fetch feeds from this base URL instead of the MTA API')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    schedule = StaticSchedule.open(args.zip, rebuild=args.rebuild)
+    print(f"{schedule.n_trips} trips, {schedule.n_stop_times} stop times, {len(schedule.routes())} routes "
+          f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+    if args.stop:
+        date = _date(args.date) if args.date else int(time.strftime("%Y%m%d"))
+        if args.after:
+            hours, minutes = args.after.split(":")
+            after = int(hours) * 3600 + int(minutes) * 60
+        else:
+            after = int(time.time()) - schedule.day_start(date)
+        print(f"\nScheduled departures from {args.stop}:")
+        for trip, row in schedule.departures(args.stop, date, after):
+            print(f"  {_clock(schedule.stop_time_departure[row])}  {schedule.trip_route(trip):<3s} {schedule.trip_id(trip)}")
+
+    if args.delays:
+        from mta_rail import TrainGetter, bucket_feed, get_trains_multi, parse_routes
+        routes = parse_routes(args.delays)
+        if args.feed:
+            from mta_replay import load_feed
+            feed = load_feed(args.feed)
+            trip_updates, vehicles = bucket_feed(feed, routes)
+            results = {}
+            for route in routes:
+                traingetter = TrainGetter(route)
+                results[route] = (traingetter, traingetter.build_trains(trip_updates[route], vehicles, now=feed.header.timestamp))
+        else:
+            from mta_feed_fetcher import FeedFetcher
+            with FeedFetcher(base_url=args.feed_base_url) as fetcher:
+                results = get_trains_multi(fetcher, routes)
+        matched = total = 0
+        started = time.perf_counter()
+        rows = []
+        for route, (_, trains) in results.items():
+            for train in trains:
+                total += 1
+                delay = schedule.delay(train)
+                if delay is not None:
+                    matched += 1
+                rows.append((route, train, delay))
+        elapsed = time.perf_counter() - started
+        print(f"\n{matched}/{total} trains matched to the schedule ({elapsed * 1000:.2f} ms)")
+        for route, train, delay in rows:
+            late = f"{delay:+5d}s" if delay is not None else "     -"
+            print(f"  {route:<3s} {train.trip_id:<24s} {train.next_stop_id:<6s} {late}")
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from mta_history import HistoryRecord
+    from mta_rail import Train
+
+@dataclass(slots=True)
+class StopEvent:
+    # One inferred visit of a trip to a stop (stop_id keeps its N/S suffix)
+    route_id: str
+    trip_id: str
+    stop_id: str
+    station_index: int
+    arrival: int
+    departure: int
+    dwell: Optional[int]
+    headway: Optional[int]
+    bunched: bool
+
+class RollingStats():
+    # Mean / standard deviation over the last `window` values, O(1) per sample
+    __slots__ = ("window", "_values", "_sum", "_sumsq", "total")
+
+    def __init__(self, window: int = 20) -> None:
+        self.window = window
+        self._values: deque = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.total = 0
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self._sum += value
+        self._sumsq += value * value
+        self.total += 1
+        if len(self._values) > self.window:
+            old = self._values.popleft()
+            self._sum -= old
+            self._sumsq -= old * old
+
+    @property
+    def count(self) -> int:
+        return len(self._values)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self._values) if self._values else None
+
+    @property
+    def stdev(self) -> Optional[float]:
+        n = len(self._values)
+        if n < 2:
+            return None
+        return math.sqrt(max(0.0, (self._sumsq - self._sum * self._sum / n) / (n - 1)))
+
+@dataclass(slots=True)
+class StopStats:
+    station_index: int
+    headway: RollingStats
+    dwell: RollingStats
+    last_arrival: Optional[int] = None
+    visits: int = 0
+    bunches: int = 0
+
+@dataclass(slots=True)
+class _TripState:
+    stop_id: str
+    station_index: int
+    predicted: Optional[int]
+    last_seen: int
+    # Last observation before the trip was seen STOPPED_AT stop_id, and the first/last
+    # observations while it was
+    approach: Optional[int] = None
+    stopped_first: Optional[int] = None
+    stopped_last: Optional[int] = None
+    last_departure: Optional[Tuple[str, int]] = None
+
+def _clamp(value: Optional[int], low: int, high: int) -> int:
+    if value is None:
+        return (low + high) // 2
+    return min(max(value, low), high)
+
+class HeadwayTracker():
+    # Follows each trip's next stop across successive snapshots. When a trip's next stop
+    # moves on from X, it has visited X: arrival is the feed's predicted arrival clamped to
+    # the observations around it (or the moment it was first seen STOPPED_AT X), departure
+    # is between the last STOPPED_AT observation and the one where it moved on. Each visit
+    # updates that stop's rolling headway and dwell, and the run time from the previous
+    # stop, in O(1). Timing resolution is bounded by the snapshot interval, and a stop
+    # passed entirely between two snapshots is not seen.
+    def __init__(self, window: int = 20, bunch_ratio: float = 0.25, min_samples: int = 3, trip_timeout: int = 900) -> None:
+        self.window = window
+        self.bunch_ratio = bunch_ratio
+        self.min_samples = min_samples
+        self.trip_timeout = trip_timeout
+        self.trips: Dict[Tuple[str, str], _TripState] = {}
+        self.stops: Dict[Tuple[str, str], StopStats] = {}
+        self.runs: Dict[Tuple[str, str, str], RollingStats] = {}
+        self._swept = 0
+
+    def observe(self, route: str, trains: Iterable[Train], observed: int) -> List[StopEvent]:
+        events: List[StopEvent] = []
+        for t in trains:
+            self._advance(route, t.trip_id, t.next_stop_id, t.current_status, t.arrival_time, t.next_station_index, observed, events)
+        self._sweep(observed)
+        return events
+
+    def observe_records(self, records: Iterable[HistoryRecord]) -> Iterator[StopEvent]:
+        # Replays a HistoryReader query; records must be in time order within each route
+        events: List[StopEvent] = []
+        advance = self._advance
+        for r in records:
+            advance(r.route_id, r.trip_id, r.stop_id, r.current_status, r.arrival_time, r.station_index, r.observed, events)
+            if events:
+                yield from events
+                events.clear()
+            if r.observed - self._swept >= 60:
+                self._sweep(r.observed)
+
+    def _advance(self, route: str, trip_id: str, stop_id: Optional[str], status: Optional[str], predicted: Optional[int],
+                 station_index: int, observed: int, events: List[StopEvent]) -> None:
+        # Only real platform stops (e.g. 127S); extraction's "(no stop)" placeholder and
+        # ids without a direction suffix are not places a train can visit
+        if not stop_id or stop_id[-1] not in ('N', 'S'):
+            return
+        key = (route, trip_id)
+        s = self.trips.get(key)
+        if s is None:
+            s = self.trips[key] = _TripState(stop_id, station_index, predicted, observed)
+            if status == 'STOPPED_AT':
+                s.stopped_first = s.stopped_last = observed
+            return
+        if observed <= s.last_seen:
+            return
+
+        if stop_id == s.stop_id:
+            if status == 'STOPPED_AT':
+                if s.stopped_first is None:
+                    s.approach = s.last_seen
+                    s.stopped_first = observed
+                s.stopped_last = observed
+            if predicted:
+                s.predicted = predicted
+            s.last_seen = observed
+            return
+
+        # Next stop moved on: the trip has visited s.stop_id
+        if s.stopped_first is not None:
+            arrival = _clamp(s.predicted, s.approach if s.approach is not None else s.stopped_first, s.stopped_first)
+            departure = (s.stopped_last + observed) // 2
+            dwell = departure - arrival
+        else:
+            arrival = departure = _clamp(s.predicted, s.last_seen, observed)
+            dwell = None
+        events.append(self._record(route, trip_id, s, arrival, departure, dwell))
+
+        last_departure = (s.stop_id, departure)
+        s.stop_id = stop_id
+        s.station_index = station_index
+        s.predicted = predicted
+        s.approach = None
+        s.stopped_first = s.stopped_last = observed if status == 'STOPPED_AT' else None
+        if s.stopped_first is not None:
+            s.approach = s.last_seen
+        s.last_seen = observed
+        s.last_departure = last_departure
+
+    def _record(self, route: str, trip_id: str, s: _TripState, arrival: int, departure: int, dwell: Optional[int]) -> StopEvent:
+        stats = self.stops.get((route, s.stop_id))
+        if stats is None:
+            stats = self.stops[(route, s.stop_id)] = StopStats(s.station_index, RollingStats(self.window), RollingStats(self.window))
+        stats.visits += 1
+
+        headway = None
+        bunched = False
+        if stats.last_arrival is not None and arrival > stats.last_arrival:
+            headway = arrival - stats.last_arrival
+            mean = stats.headway.mean
+            bunched = stats.headway.count >= self.min_samples and headway < self.bunch_ratio * mean
+            stats.headway.add(headway)
+            stats.bunches += bunched
+        if stats.last_arrival is None or arrival > stats.last_arrival:
+            stats.last_arrival = arrival
+        if dwell is not None and dwell >= 0:
+            stats.dwell.add(dwell)
+
+        if s.last_departure is not None:
+            from_stop, departed = s.last_departure
+            if arrival > departed:
+                run = self.runs.get((route, from_stop, s.stop_id))
+                if run is None:
+                    run = self.runs[(route, from_stop, s.stop_id)] = RollingStats(self.window)
+                run.add(arrival - departed)
+
+        return StopEvent(route, trip_id, s.stop_id, s.station_index, arrival, departure, dwell, headway, bunched)
+
+    def _sweep(self, observed: int) -> None:
+        # Forget trips that have left the feed (terminated or cancelled)
+        if observed - self._swept < 60:
+            return
+        self._swept = observed
+        cutoff = observed - self.trip_timeout
+        for key in [key for key, s in self.trips.items() if s.last_seen < cutoff]:
+            del self.trips[key]
+
+    def route_stops(self, route: str) -> List[Tuple[str, StopStats]]:
+        # (stop_id, stats) along the route, northbound then southbound
+        rows = [(stop_id, stats) for (r, stop_id), stats in self.stops.items() if r == route]
+        return sorted(rows, key=lambda row: (row[0][-1:], row[1].station_index, row[0]))
+
+def analyze_feeds(path: str, routes: List[str], tracker: HeadwayTracker) -> Iterator[StopEvent]:
+    # Recorded feed snapshots (see mta_replay), in order
+    from mta_rail import TrainGetter, bucket_feed
+    from mta_replay import FeedReplay
+
+    traingetters = {route: TrainGetter(route) for route in routes}
+    for frame in FeedReplay(path):
+        trip_updates, vehicles = bucket_feed(frame.feed, routes)
+        for route, traingetter in traingetters.items():
+            trains = traingetter.build_trains(trip_updates[route], vehicles, now=frame.now)
+            yield from tracker.observe(route, trains, int(frame.now))
+
+def analyze_history(root: str, routes: Optional[List[str]], tracker: HeadwayTracker,
+                    start: Optional[int] = None, end: Optional[int] = None) -> Iterator[StopEvent]:
+    # A history store written by mta_rail.py --history
+    from mta_history import HistoryReader
+    return tracker.observe_records(HistoryReader(root).query(start, end, routes))
+
+def live(fetcher, routes: List[str], interval: float, tracker: HeadwayTracker) -> Iterator[StopEvent]:
+    from mta_rail import FeedWatcher
+
+    watcher = FeedWatcher(fetcher, routes)
+    url_of = {route: url for url, url_routes in watcher.groups.items() for route in url_routes}
+    for updates in watcher.run(interval):
+        for route, (trains, _) in updates.items():
+            observed = watcher.feed_timestamps.get(url_of[route]) or int(time.time())
+            yield from tracker.observe(route, trains, observed)
+
+def print_event(event: StopEvent) -> None:
+    from mta_rail import colors, load_station_index
+
+    color = colors.get(event.route_id, "\033[0m")
+    name = load_station_index().station_name(event.stop_id[:-1]) or event.stop_id
+    stamp = time.strftime("%H:%M:%S", time.localtime(event.arrival))
+    headway = f"headway {event.headway // 60}m{event.headway % 60:02d}s" if event.headway is not None else "headway -"
+    dwell = f"dwell {event.dwell}s" if event.dwell is not None else "dwell -"
+    flag = " \033[1;31mBUNCHED\033[0m" if event.bunched else ""
+    print(f"[{stamp}] " + color + f" {event.route_id} " + "\033[0m" + f" {event.trip_id} {name} ({event.stop_id}) {headway} {dwell}{flag}")
+
+def _fmt(seconds: Optional[float]) -> str:
+    return f"{seconds / 60:6.1f}m" if seconds is not None else "      -"
+
+def print_summary(tracker: HeadwayTracker, routes: Iterable[str]) -> None:
+    from mta_rail import colors, line_to_long_name, load_station_index
+
+    index = load_station_index()
+    for route in routes:
+        rows = tracker.route_stops(route)
+        if not rows:
+            continue
+        color = colors.get(route, "\033[0m")
+        print(color + f" {route}: {line_to_long_name.get(route, '')} " + "\033[0m")
+        print(f"  {'stop':<6s} {'station':<32s} {'visits':>6s} {'headway':>8s} {'stdev':>8s} {'dwell':>8s} {'bunched':>7s}")
+        for stop_id, stats in rows:
+            name = index.station_name(stop_id[:-1]) or ""
+            dwell = stats.dwell.mean
+            print(f"  {stop_id:<6s} {name[:32]:<32s} {stats.visits:6d} {_fmt(stats.headway.mean)}  {_fmt(stats.headway.stdev)} "
+                  f"{(f'{dwell:6.0f}s' if dwell is not None else '      -'):>8s} {stats.bunches:7d}")
+        print()
+
+if __name__ == "__main__":
+    from mta_history import HistoryReader, _parse_time
+    from mta_rail import parse_routes
+
+    parser = argparse.ArgumentParser(description="Headway, dwell and bunching analytics from recorded or live train positions")
+    parser.add_argument('path', nargs='?', default=None, help='History directory (mta_rail.py --history) or recorded feed / directory of snapshots')
+    parser.add_argument('-R', '--routes', type=str, default='all', help="Comma-separated routes, or 'all'")
+    parser.add_argument('--start', type=_parse_time, default=None, help='History start time (unix seconds or UTC ISO date/time)')
+    parser.add_argument('--end', type=_parse_time, default=None, help='History end time (unix seconds or UTC ISO date/time)')
+    parser.add_argument('--live', type=float, default=None, metavar='INTERVAL', help='Poll the live feeds every INTERVAL seconds instead of reading PATH')
+    parser.add_argument('--feed-base-url', type=str, default=None, help='With --live, fetch feeds from this base URL instead of the MTA API')
+    parser.add_argument('--window', type=int, default=20, help='Rolling window (visits) for headway and dwell statistics')
+    parser.add_argument('--bunch-ratio', type=float, default=0.25, help='Flag a headway shorter than this fraction of the rolling mean as bunched')
+    parser.add_argument('--events', action='store_true', help='Print every inferred stop visit, not just bunching')
+    args = parser.parse_args()
+
+    try:
+        routes = parse_routes(args.routes)
+    except ValueError as e:
+        parser.error(str(e))
+    if (args.path is None) == (args.live is None):
+        parser.error("give either PATH or --live INTERVAL")
+
+    tracker = HeadwayTracker(window=args.window, bunch_ratio=args.bunch_ratio)
+    if args.live is not None:
+        from mta_feed_fetcher import FeedFetcher
+        try:
+            with FeedFetcher(base_url=args.feed_base_url) as fetcher:
+                for event in live(fetcher, routes, args.live, tracker):
+                    if args.events or event.bunched:
+                        print_event(event)
+                        sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+    else:
+        started = time.perf_counter()
+        if os.path.isdir(args.path) and HistoryReader(args.path).routes():
+            events = analyze_history(args.path, routes, tracker, args.start, args.end)
+        else:
+            events = analyze_feeds(args.path, routes, tracker)
+        count = 0
+        for event in events:
+            count += 1
+            if args.events or event.bunched:
+                print_event(event)
+        elapsed = time.perf_counter() - started
+        print(f"\n{count} stop visits inferred in {elapsed:.2f}s\n")
+    print_summary(tracker, routes)
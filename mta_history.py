@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from mta_rail import Train
+
+# Store layout: <root>/<route>/<YYYY-MM-DD>.mth (UTC day of the observation), one
+# append-only file per route and day made of self-contained chunks:
+#
+#   header   magic, rows, first/last observed time, trip dict size, stop dict size,
+#            raw payload length, compressed payload length
+#   zlib     trip_id dictionary and stop_id dictionary ('\n'-joined), then columns:
+#              observed     int32 deltas (first value is the header's first time)
+#              trip         uint16 code into the chunk's trip dictionary
+#              stop         uint16 code into the chunk's stop dictionary
+#              arrival      int32 offset from observed (ARRIVAL_NONE when unknown)
+#              status       int8 VehicleStopStatus (-1 when there is no vehicle)
+#              station      int16 station index along the route (-1 when unknown)
+#
+# Queries read only chunk headers until a chunk's time range overlaps the request.
+# A torn chunk (crash mid-append) is cut off by the next writer to open the file, and
+# skipped on read by resyncing on the next chunk magic.
+CHUNK = struct.Struct("<4sIqqIIII")
+CHUNK_MAGIC = b"MTHC"
+ARRIVAL_NONE = -(2 ** 31)
+# GTFS-RT VehiclePosition.VehicleStopStatus values, kept here so reading needs no protobuf
+STATUS_NAMES = ('INCOMING_AT', 'STOPPED_AT', 'IN_TRANSIT_TO')
+STATUS_CODES = {name: i for i, name in enumerate(STATUS_NAMES)}
+
+@dataclass(slots=True)
+class HistoryRecord:
+    observed: int
+    route_id: str
+    trip_id: str
+    stop_id: str
+    arrival_time: Optional[int]
+    current_status: Optional[str]
+    station_index: int
+
+def partition_day(observed: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(observed))
+
+class _ChunkBuffer():
+    def __init__(self) -> None:
+        self.trips: Dict[str, int] = {}
+        self.stops: Dict[str, int] = {}
+        self.observed: List[int] = []
+        self.trip = array("H")
+        self.stop = array("H")
+        self.arrival = array("i")
+        self.status = array("b")
+        self.station = array("h")
+        self.started = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.observed)
+
+    def full(self) -> bool:
+        # Codes are uint16
+        return len(self.trips) >= 0xFFFF or len(self.stops) >= 0xFFFF
+
+    def add(self, observed: int, train: Train) -> None:
+        self.observed.append(observed)
+        self.trip.append(self.trips.setdefault(train.trip_id, len(self.trips)))
+        self.stop.append(self.stops.setdefault(train.next_stop_id, len(self.stops)))
+        self.arrival.append(train.arrival_time - observed if train.arrival_time else ARRIVAL_NONE)
+        self.status.append(STATUS_CODES.get(train.current_status, -1))
+        self.station.append(train.next_station_index if train.next_station_index is not None else -1)
+
+    def encode(self) -> bytes:
+        first = self.observed[0]
+        deltas = array("i", [0])
+        deltas.extend(b - a for a, b in zip(self.observed, self.observed[1:]))
+        trips = "\n".join(self.trips).encode("utf-8")
+        stops = "\n".join(self.stops).encode("utf-8")
+        raw = b"".join((trips, stops, deltas.tobytes(), self.trip.tobytes(), self.stop.tobytes(),
+                        self.arrival.tobytes(), self.status.tobytes(), self.station.tobytes()))
+        payload = zlib.compress(raw, 6)
+        header = CHUNK.pack(CHUNK_MAGIC, len(self), first, max(self.observed), len(trips), len(stops), len(raw), len(payload))
+        return header + payload
+
+class HistoryWriter():
+    # Buffers train observations per (route, day) and appends them as compressed chunks
+    # once a buffer reaches `chunk_rows` rows or `flush_interval` seconds of age. Every
+    # append checks all buffers, so routes that went quiet and days that have ended
+    # are written out too, not only the buffer being appended to
+    def __init__(self, root: str, chunk_rows: int = 4096, flush_interval: float = 300.0) -> None:
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self._buffers: Dict[Tuple[str, str], _ChunkBuffer] = {}
+        # Day files already checked for a torn tail by this writer
+        self._recovered: Set[str] = set()
+
+    def append(self, route: str, trains: Iterable[Train], observed: Optional[int] = None) -> None:
+        observed = int(observed if observed is not None else time.time())
+        key = (route, partition_day(observed))
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = _ChunkBuffer()
+        for train in trains:
+            buffer.add(observed, train)
+            if buffer.full():
+                self._write(key, buffer)
+                buffer = self._buffers[key] = _ChunkBuffer()
+        now = time.monotonic()
+        day = key[1]
+        for other, other_buffer in list(self._buffers.items()):
+            if (len(other_buffer) >= self.chunk_rows or now - other_buffer.started >= self.flush_interval
+                    or other[1] < day):
+                self._write(other, self._buffers.pop(other))
+
+    def _write(self, key: Tuple[str, str], buffer: _ChunkBuffer) -> None:
+        if not len(buffer):
+            return
+        route, day = key
+        directory = os.path.join(self.root, route)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{day}.mth")
+        if path not in self._recovered:
+            _truncate_torn(path)
+            self._recovered.add(path)
+        with open(path, "ab") as f:
+            f.write(buffer.encode())
+
+    def flush(self) -> None:
+        for key, buffer in list(self._buffers.items()):
+            self._write(key, buffer)
+        self._buffers.clear()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "HistoryWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _chunk_spans(mm) -> Iterator[Tuple[int, tuple, int]]:
+    # (offset, header fields, end) of every structurally complete chunk: its payload fits
+    # in the file and is followed by another chunk (or the start of a torn one) or the
+    # end of the file. Anything else (a torn append, possibly followed by chunks from a
+    # restarted writer) is skipped by searching for the next CHUNK_MAGIC.
+    size = len(mm)
+    pos = 0
+    while 0 <= pos and pos + CHUNK.size <= size:
+        fields = CHUNK.unpack_from(mm, pos)
+        end = pos + CHUNK.size + fields[7]
+        if fields[0] != CHUNK_MAGIC or end > size or not CHUNK_MAGIC.startswith(mm[end:end + 4]):
+            pos = mm.find(CHUNK_MAGIC, pos + 1)
+            continue
+        yield pos, fields, end
+        pos = end
+
+def _open_chunks(path: str):
+    # Memory-mapped day file, or None when it is empty
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return None
+
+def _truncate_torn(path: str) -> None:
+    # Cut a torn final chunk off a day file before appending to it, so new chunks
+    # follow the last complete one
+    try:
+        mm = _open_chunks(path)
+    except FileNotFoundError:
+        return
+    if mm is None:
+        return
+    with mm:
+        size = len(mm)
+        valid = 0
+        for _, _, valid in _chunk_spans(mm):
+            pass
+    if valid < size:
+        os.truncate(path, valid)
+
+def _read_chunks(path: str, start: Optional[int], end: Optional[int]) -> Iterator[Tuple[tuple, bytes]]:
+    # (header fields, raw payload) for every complete chunk overlapping [start, end];
+    # torn or corrupt chunks are skipped
+    mm = _open_chunks(path)
+    if mm is None:
+        return
+    with mm:
+        for pos, fields, chunk_end in _chunk_spans(mm):
+            _, _, first, last, _, _, raw_len, _ = fields
+            if (start is not None and last < start) or (end is not None and first > end):
+                continue
+            try:
+                raw = zlib.decompress(mm[pos + CHUNK.size:chunk_end])
+            except zlib.error:
+                continue
+            if len(raw) != raw_len:
+                continue
+            yield fields, raw
+
+def _decode(route: str, fields: tuple, raw: bytes, start: Optional[int], end: Optional[int],
+            stop_id: Optional[str], trip_id: Optional[str]) -> Iterator[HistoryRecord]:
+    _, rows, first, _, trips_len, stops_len, _, _ = fields
+    offset = 0
+
+    def take(typecode: str, count: int) -> array:
+        nonlocal offset
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(raw[offset:offset + size])
+        offset += size
+        return column
+
+    trips = raw[:trips_len].decode("utf-8").split("\n")
+    stops = raw[trips_len:trips_len + stops_len].decode("utf-8").split("\n")
+    offset = trips_len + stops_len
+
+    # Dictionary filters are resolved once per chunk, then compared as integer codes
+    stop_codes = None
+    if stop_id is not None:
+        stop_codes = {i for i, s in enumerate(stops) if s == stop_id or (s[:-1] == stop_id and s[-1:] in ('N', 'S'))}
+        if not stop_codes:
+            return
+    trip_code = None
+    if trip_id is not None:
+        if trip_id not in trips:
+            return
+        trip_code = trips.index(trip_id)
+
+    deltas = take("i", rows)
+    trip = take("H", rows)
+    stop = take("H", rows)
+    arrival = take("i", rows)
+    status = take("b", rows)
+    station = take("h", rows)
+
+    observed = first
+    for i in range(rows):
+        observed += deltas[i]
+        if (start is not None and observed < start) or (end is not None and observed > end):
+            continue
+        if stop_codes is not None and stop[i] not in stop_codes:
+            continue
+        if trip_code is not None and trip[i] != trip_code:
+            continue
+        yield HistoryRecord(
+            observed, route, trips[trip[i]], stops[stop[i]],
+            observed + arrival[i] if arrival[i] != ARRIVAL_NONE else None,
+            STATUS_NAMES[status[i]] if 0 <= status[i] < len(STATUS_NAMES) else None,
+            station[i],
+        )
+
+class HistoryReader():
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def routes(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def days(self, route: str) -> List[str]:
+        directory = os.path.join(self.root, route)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".mth"))
+
+    def query(self, start: Optional[int] = None, end: Optional[int] = None, routes: Optional[Iterable[str]] = None,
+              stop_id: Optional[str] = None, trip_id: Optional[str] = None) -> Iterator[HistoryRecord]:
+        # Streams matching observations in (route, time) order; day partitions outside
+        # [start, end] are never opened and non-overlapping chunks are never decompressed
+        first_day = partition_day(start) if start is not None else None
+        last_day = partition_day(end) if end is not None else None
+        for route in (list(routes) if routes is not None else self.routes()):
+            for day in self.days(route):
+                if (first_day and day < first_day) or (last_day and day > last_day):
+                    continue
+                path = os.path.join(self.root, route, f"{day}.mth")
+                for fields, raw in _read_chunks(path, start, end):
+                    yield from _decode(route, fields, raw, start, end, stop_id, trip_id)
+
+def _parse_time(value: Optional[str]) -> Optional[int]:
+    # Unix seconds or an ISO-8601 date/time (UTC)
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    import calendar
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"unrecognised time '{value}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query recorded train positions")
+    parser.add_argument('root', help='History directory (as passed to mta_rail.py --history)')
+    parser.add_argument('-R', '--routes', type=str, default=None, help='Comma-separated routes (default: all recorded)')
+    parser.add_argument('--start', type=_parse_time, default=None, help='Start time (unix seconds or UTC ISO date/time)')
+    parser.add_argument('--end', type=_parse_time, default=None, help='End time (unix seconds or UTC ISO date/time)')
+    parser.add_argument('--stop', type=str, default=None, help='Only observations whose next stop is this stop_id (base or N/S)')
+    parser.add_argument('--trip', type=str, default=None, help='Only observations of this trip_id')
+    args = parser.parse_args()
+
+    reader = HistoryReader(args.root)
+    routes = args.routes.split(",") if args.routes else None
+    out = sys.stdout
+    out.write("observed,route_id,trip_id,stop_id,arrival_time,current_status,station_index\n")
+    for r in reader.query(args.start, args.end, routes, args.stop, args.trip):
+        out.write(f"{r.observed},{r.route_id},{r.trip_id},{r.stop_id},{r.arrival_time or ''},{r.current_status or ''},{r.station_index}\n")
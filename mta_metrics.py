@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import abc
+import bisect
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, TextIO, Tuple
+
+# http.server (and the email/socketserver modules behind it) is only imported when a
+# metrics endpoint is started, so `import mta_rail` stays fast
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Hot paths check this module global before doing any metrics work, so a disabled
+# registry costs one attribute load per stage (not per entity)
+enabled = False
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+    def snapshot(self) -> list:
+        # Sorted (labels, value) pairs, copied under the lock: the poll thread adds
+        # label sets while scrapes iterate
+        with self._lock:
+            return sorted(self.values.items())
+
+    def take(self) -> list:
+        # (labels, value) pairs recorded since the last take(), which clears them; a
+        # worker process hands these to its parent's merge()
+        with self._lock:
+            values, self.values = self.values, {}
+        return list(values.items())
+
+    @abc.abstractmethod
+    def merge(self, values: list) -> None:
+        ...
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, values: list) -> None:
+        for labels, amount in values:
+            self.inc(labels, amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in self.snapshot()]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            self.values[labels] = value
+
+    def merge(self, values: list) -> None:
+        for labels, value in values:
+            self.set(labels, value)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in self.snapshot()]
+
+class AgeGauge(Gauge):
+    # Stores unix timestamps; exposes their age at scrape time (e.g. feed staleness)
+    def _samples(self) -> List[str]:
+        now = time.time()
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(round(now - value, 3))}" for key, value in self.snapshot()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count, min, max]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0, value, value]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+            if value < state[3]:
+                state[3] = value
+            elif value > state[4]:
+                state[4] = value
+
+    def merge(self, values: list) -> None:
+        with self._lock:
+            for labels, (counts, total, count, low, high) in values:
+                state = self.values.get(labels)
+                if state is None:
+                    self.values[labels] = [list(counts), total, count, low, high]
+                    continue
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+                state[3] = min(state[3], low)
+                state[4] = max(state[4], high)
+
+    def snapshot(self) -> list:
+        # Bucket counts are updated in place, so each state is copied too
+        with self._lock:
+            return [(key, (list(counts), total, count, low, high))
+                    for key, (counts, total, count, low, high) in sorted(self.values.items())]
+
+    def quantile(self, labels: Tuple[str, ...], q: float, state: Optional[tuple] = None) -> Optional[float]:
+        # Linear interpolation inside the bucket holding the q-th observation, clamped
+        # to the observed min/max; `state` is a value from snapshot()
+        if state is None:
+            with self._lock:
+                state = self.values.get(labels)
+                state = (list(state[0]),) + tuple(state[1:]) if state else None
+        if not state or not state[2]:
+            return None
+        counts, _, total, low_seen, high_seen = state
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                low = max(self.buckets[i - 1] if i else 0.0, low_seen)
+                high = min(self.buckets[i] if i < len(self.buckets) else high_seen, high_seen)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return high_seen
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count, _, _) in self.snapshot():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+class Registry():
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def take(self) -> Dict[str, list]:
+        # Everything recorded since the last take(), by metric name (see Metric.take)
+        taken = {}
+        for metric in self.metrics:
+            values = metric.take()
+            if values:
+                taken[metric.name] = values
+        return taken
+
+    def merge(self, taken: Dict[str, list]) -> None:
+        by_name = {metric.name: metric for metric in self.metrics}
+        for name, values in taken.items():
+            by_name[name].merge(values)
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self.metrics:
+            if metric.values:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def dump_profile(self, out: TextIO) -> None:
+        # Per-run summary of every timing histogram plus the counters
+        out.write(f"{'metric':<28s} {'labels':<28s} {'count':>7s} {'total':>10s} {'mean':>10s} {'p50':>10s} {'p95':>10s}\n")
+        for metric in self.metrics:
+            if isinstance(metric, Histogram):
+                for key, state in metric.snapshot():
+                    _, total, count, _, _ = state
+                    label = ",".join(key)
+                    p50, p95 = metric.quantile(key, 0.5, state), metric.quantile(key, 0.95, state)
+                    out.write(f"{metric.name:<28s} {label:<28s} {count:7d} {total * 1000:8.2f}ms {total / count * 1000:8.3f}ms "
+                              f"{p50 * 1000:8.3f}ms {p95 * 1000:8.3f}ms\n")
+        for metric in self.metrics:
+            if isinstance(metric, Counter):
+                for key, value in metric.snapshot():
+                    out.write(f"{metric.name:<28s} {','.join(key):<28s} {_number(value):>7s}\n")
+
+REGISTRY = Registry()
+
+FETCH_SECONDS = REGISTRY.register(Histogram("mta_fetch_seconds", "Feed request latency, including retries", ("feed",)))
+FETCH_BYTES = REGISTRY.register(Counter("mta_fetch_bytes_total", "Feed bytes downloaded", ("feed",)))
+FETCH_RESPONSES = REGISTRY.register(Counter("mta_fetch_responses_total", "Feed responses by HTTP status ('error' when none)", ("feed", "status")))
+PARSE_SECONDS = REGISTRY.register(Histogram("mta_parse_seconds", "FeedMessage.ParseFromString time", ("feed",)))
+FEED_ENTITIES = REGISTRY.register(Gauge("mta_feed_entities", "Entities in the last decoded feed", ("feed",)))
+FEED_TIMESTAMP = REGISTRY.register(Gauge("mta_feed_timestamp_seconds", "Header timestamp of the last decoded feed", ("feed",)))
+FEED_AGE = REGISTRY.register(AgeGauge("mta_feed_age_seconds", "Seconds since the last decoded feed's header timestamp", ("feed",)))
+STAGE_SECONDS = REGISTRY.register(Histogram("mta_stage_seconds", "Per-route processing stage time (extract, sort, render)", ("stage", "route")))
+ROUTE_TRAINS = REGISTRY.register(Gauge("mta_route_trains", "Trains in the last extraction", ("route",)))
+DROPPED = REGISTRY.register(Counter("mta_entities_dropped_total", "Feed entities that never reach the board, by reason", ("route", "reason")))
+POLL_DECISIONS = REGISTRY.register(Counter("mta_scheduler_decisions_total", "Adaptive scheduler decisions per feed (poll, defer, skip)", ("feed", "action")))
+FEED_INTERVAL = REGISTRY.register(Gauge("mta_feed_publish_interval_seconds", "Publish interval learned from successive header timestamps", ("feed",)))
+
+def feed_label(url: str) -> str:
+    # .../nyct%2Fgtfs-ace -> gtfs-ace
+    return url.rstrip("/").rsplit("/", 1)[-1].replace("nyct%2F", "")
+
+class _NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer():
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(self.labels, time.perf_counter() - self.started)
+
+def timed(stage: str, route: str = ""):
+    # `with timed("render", route):` -- a shared no-op when metrics are disabled
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(STAGE_SECONDS, (stage, route))
+
+def record_feed(url: str, feed) -> None:
+    label = (feed_label(url),)
+    FEED_ENTITIES.set(label, len(feed.entity))
+    timestamp = feed.header.timestamp
+    if timestamp:
+        FEED_TIMESTAMP.set(label, timestamp)
+        FEED_AGE.set(label, timestamp)
+
+def make_metrics_server(host: str = "127.0.0.1", port: int = 9100, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0].rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), MetricsHandler)
+
+def serve_metrics(host: str = "127.0.0.1", port: int = 9100) -> ThreadingHTTPServer:
+    # Enables collection and serves /metrics from a daemon thread
+    enable()
+    server = make_metrics_server(host, port)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,20 +1,29 @@
 #!/usr/bin/env python3
 
-import os
+from __future__ import annotations
+
+import sys
 import argparse
-import requests
-from dataclasses import dataclass
-from typing import List, Optional
-from google.transit import gtfs_realtime_pb2
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 import time
-import json
 from collections import OrderedDict
+from functools import lru_cache
+
+import mta_metrics
+
+# protobuf, requests and numpy are imported lazily, on the paths that need them,
+# so --self-test and `import mta_rail` stay fast
+if TYPE_CHECKING:
+    from google.transit import gtfs_realtime_pb2
+    from mta_feed_fetcher import FeedFetcher
+    from mta_station_index import StationIndex
+    from mta_arrivals import ArrivalIndex
+    from mta_history import HistoryWriter
+    from mta_decode_pool import DecodePool
+    from mta_scheduler import PollScheduler
 
-parser = argparse.ArgumentParser(description="NYC MTA Subway Train Tracker")
 route_ids = ['1', '2', '3', '4', '5', '6', '6X', '7', '7X', 'GS', 'A', 'B', 'C', 'D', 'E', 'F', 'FX', 'FS', 'G', 'J', 'L', 'M', 'N', 'Q', 'R', 'H', 'W', 'Z', 'SI']
-parser.add_argument('-l', '-r', '--route', type=str, choices=route_ids, default='6', help='Subway route to track')
-parser.add_argument('-st', '--self-test', action='store_true', help='Run self-test to display route colors and names')
-args = parser.parse_args()
 
 line_to_long_name = {
     "1": "Broadway - 7 Avenue Local",
@@ -126,7 +135,7 @@ line_to_url = {
     "SI": realtime_feed_urls["SIR"]
 }
 
-@dataclass
+@dataclass(slots=True)
 class Train:
     trip_id: str
     route_id: str
@@ -139,20 +148,56 @@ class Train:
     vehicle_stop_id: Optional[str] = None
     current_status: Optional[str] = None
     section_name: Optional[str] = None
+    next_station_name: Optional[str] = None
+    arrival_time: Optional[int] = None
 
     def __str__(self):
         eta = f"{int(self.time_until)}s" if self.time_until is not None else "n/a"
         # vehicle_info = f" | veh_stop: {self.vehicle_stop_id}" if self.vehicle_stop_id else ""
         status_info = f"{self.current_status}" if self.current_status else ""
         
-        # Use the TrainGetter instance to get the station name from the base stop ID
-        base_stop_id = self.next_stop_id[:-1] if self.direction_char else self.next_stop_id
-        next_station_name = traingetter.station_id_to_name(base_stop_id) or self.next_stop_id
+        # Station name is resolved by TrainGetter when the train is built
+        next_station_name = self.next_station_name or self.next_stop_id
         
         direction_prefix = self.direction_char if self.direction_char else ""
 
         return f"""
-{colors[args.route] + f" {direction_prefix} " + "\033[0m"} {"\033[1;44m" + self.trip_id + "\033[0m"} {"\033[1;33m" + status_info}\n{next_station_name} in {eta}\033[0m"""
+{colors.get(self.route_id, "\033[0m") + f" {direction_prefix} " + "\033[0m"} {"\033[1;44m" + self.trip_id + "\033[0m"} {"\033[1;33m" + status_info}\n{next_station_name} in {eta}\033[0m"""
+
+@dataclass
+class TripDiff:
+    added: List[Train] = field(default_factory=list)
+    removed: List[Train] = field(default_factory=list)
+    changed: List[Tuple[Train, Train]] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+def diff_trains(previous: Dict[str, Train], current: List[Train]) -> TripDiff:
+    # A trip has changed when its next stop, predicted arrival or vehicle status moved
+    diff = TripDiff()
+    seen = set()
+    for train in current:
+        seen.add(train.trip_id)
+        old = previous.get(train.trip_id)
+        if old is None:
+            diff.added.append(train)
+        elif (old.next_stop_id != train.next_stop_id or old.arrival_time != train.arrival_time
+              or old.current_status != train.current_status):
+            diff.changed.append((old, train))
+    for trip_id, old in previous.items():
+        if trip_id not in seen:
+            diff.removed.append(old)
+    return diff
+
+_no_station = (None, -1, None)
+
+def _first(item):
+    return item[0]
+
+def order_trains(keyed: List[Tuple[Tuple[int, float], Train]]) -> List[Train]:
+    keyed.sort(key=_first)
+    return [train for _, train in keyed]
 
 def _secs_until(arrival_ts: int) -> float:
     try:
@@ -162,49 +207,76 @@ def _secs_until(arrival_ts: int) -> float:
     except Exception:
         return 0.0
 
+@lru_cache(maxsize=None)
+def load_station_index() -> StationIndex:
+    # Compiled, memory-mapped form of mta_subway_stations.json (rebuilt when the JSON changes)
+    from mta_station_index import StationIndex
+    return StationIndex.open()
+
+def parse_routes(spec: str) -> List[str]:
+    # Accepts "all" or a comma-separated list such as "1,2,A"
+    if spec.strip().lower() == 'all':
+        return list(route_ids)
+    routes = []
+    for route in spec.split(','):
+        route = route.strip().upper()
+        if not route:
+            continue
+        if route not in route_ids:
+            raise ValueError(f"Unknown route '{route}' (choose from {', '.join(route_ids)})")
+        if route not in routes:
+            routes.append(route)
+    return routes
+
+def group_routes_by_url(routes: Iterable[str]) -> Dict[str, List[str]]:
+    # Routes that share a GTFS-RT feed are served from a single download
+    groups: Dict[str, List[str]] = OrderedDict()
+    for route in routes:
+        groups.setdefault(line_to_url[route], []).append(route)
+    return groups
+
+# VehicleStopStatus number -> name, resolved once instead of per train
+@lru_cache(maxsize=None)
+def vehicle_status_names() -> Dict[int, str]:
+    from google.transit import gtfs_realtime_pb2
+    return {v.number: v.name for v in gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus.DESCRIPTOR.values}
+
+def bucket_feed(feed: gtfs_realtime_pb2.FeedMessage, routes: Iterable[str]) -> Tuple[Dict[str, Dict[str, gtfs_realtime_pb2.TripUpdate]], Dict[str, gtfs_realtime_pb2.VehiclePosition]]:
+    # Single pass over the feed: trip updates go to per-route buckets, and only
+    # vehicles on a requested route (or with no route set) are kept, keyed by trip_id
+    trip_updates = {route: {} for route in routes}
+    vehicles = {}
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            tu = entity.trip_update
+            trip = tu.trip
+            bucket = trip_updates.get(trip.route_id)
+            if bucket is not None:
+                if trip.trip_id:
+                    bucket[trip.trip_id] = tu
+                elif mta_metrics.enabled:
+                    mta_metrics.DROPPED.inc((trip.route_id, "no_trip_id"))
+        if entity.HasField('vehicle'):
+            veh = entity.vehicle
+            trip = veh.trip
+            route_id = trip.route_id
+            if trip.trip_id and (route_id in trip_updates or not route_id):
+                vehicles[trip.trip_id] = veh
+    return trip_updates, vehicles
+
 class TrainGetter():
-    def __init__(self) -> None:
+    def __init__(self, route: str) -> None:
+        self.route = route
 
-        # Load station data from mta_subway_stations.json (as OrderedDict)
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        json_path = os.path.join(script_dir, "mta_subway_stations.json")
-        with open(json_path, "r") as f:
-            station_data = json.load(f, object_pairs_hook=OrderedDict)
-        
-        # Load mappings for the specified route
-        self.route_data = station_data.get(args.route, OrderedDict())
-        if args.route in ['GS', 'FS', 'H']:
-            self.route_data = station_data.get('S', OrderedDict())
-            match args.route:
-                case 'GS':
-                    self.route_data = {'42 St Shuttle (Manhattan)': self.route_data.get('42 St Shuttle (Manhattan)', {})}
-                case 'FS':
-                    self.route_data = {'Franklin Shuttle (Brooklyn)': self.route_data.get('Franklin Shuttle (Brooklyn)', {})}
-                case 'H':
-                    self.route_data = {'Rockaway Shuttle (Queens)': self.route_data.get('Rockaway Shuttle (Queens)', {})}
-
-        # --- Precompute helpers from the new nested structure ---
-        self.stop_id_to_name = OrderedDict()
-        self.name_to_index = OrderedDict()
-        self.stop_id_to_section = {}
-        self.section_endpoints = {}
-
-        flat_station_list = []
-        for section_name, stations in self.route_data.items():
-            if stations:
-                # The endpoint of a section is its first station
-                first_stop_id = next(iter(stations))
-                self.section_endpoints[section_name] = stations[first_stop_id]
-
-            for stop_id, stop_name in stations.items():
-                self.stop_id_to_name[stop_id] = stop_name
-                self.stop_id_to_section[stop_id] = section_name
-                if stop_name not in flat_station_list:
-                    flat_station_list.append(stop_name)
-
-        self.name_to_index = {name: i for i, name in enumerate(flat_station_list)}
-        self.station_names = flat_station_list
-        # --- End precomputation ---
+        # Load mappings for the specified route (shuttle routes map onto their section of 'S')
+        (self.route_data, self.stop_id_to_name, self.stop_id_to_section, self.name_to_index,
+         self.station_names, self.section_endpoints) = load_station_index().route_tables(route)
+
+        # base stop_id -> (station name, station index, section name) in one lookup
+        self._stop_lookup = {
+            stop_id: (name, self.name_to_index[name], self.stop_id_to_section[stop_id])
+            for stop_id, name in self.stop_id_to_name.items()
+        }
 
         self._trip_direction_map = None
 
@@ -214,117 +286,84 @@ class TrainGetter():
     def station_name_to_index(self, name: str) -> Optional[int]:
         return self.name_to_index.get(name)
 
-    def get_trains(self, feed: gtfs_realtime_pb2.FeedMessage) -> List[Train]:
-        trip_updates = {}
-        vehicles = {}
-        for entity in feed.entity:
-            if entity.HasField('trip_update'):
-                try:
-                    trip = entity.trip_update.trip
-                    trip_id = getattr(trip, "trip_id", None)
-                    route_id = getattr(trip, "route_id", None)
-                    if trip_id and route_id == args.route:
-                        trip_updates[trip_id] = entity.trip_update
-                except Exception:
-                    continue
-            if entity.HasField('vehicle'):
-                try:
-                    veh_trip = entity.vehicle.trip
-                    veh_trip_id = getattr(veh_trip, "trip_id", None)
-                    if veh_trip_id:
-                        vehicles[veh_trip_id] = entity.vehicle
-                except Exception:
-                    continue
-
-        trains: List[Train] = []
+    def get_trains(self, feed: gtfs_realtime_pb2.FeedMessage, now: Optional[float] = None) -> List[Train]:
+        trip_updates, vehicles = bucket_feed(feed, [self.route])
+        return self.build_trains(trip_updates[self.route], vehicles, now)
+
+    def build_trains(self, trip_updates: Dict[str, gtfs_realtime_pb2.TripUpdate], vehicles: Dict[str, gtfs_realtime_pb2.VehiclePosition], now: Optional[float] = None) -> List[Train]:
+        if not mta_metrics.enabled:
+            return order_trains(self.extract_trains(trip_updates, vehicles, now))
+        with mta_metrics.timed("extract", self.route):
+            keyed = self.extract_trains(trip_updates, vehicles, now)
+        with mta_metrics.timed("sort", self.route):
+            trains = order_trains(keyed)
+        self._record(trains)
+        return trains
+
+    def _record(self, trains: List[Train]) -> None:
+        # Trains with no predicted stop, or whose stop isn't in the station data, are
+        # built but never shown under a section
+        route = self.route
+        mta_metrics.ROUTE_TRAINS.set((route,), len(trains))
+        no_stop = sum(1 for t in trains if t.arrival_time is None)
+        unknown_stop = sum(1 for t in trains if t.arrival_time is not None and t.section_name is None)
+        if no_stop:
+            mta_metrics.DROPPED.inc((route, "no_stop_time"), no_stop)
+        if unknown_stop:
+            mta_metrics.DROPPED.inc((route, "unknown_stop"), unknown_stop)
+
+    def extract_trains(self, trip_updates: Dict[str, gtfs_realtime_pb2.TripUpdate], vehicles: Dict[str, gtfs_realtime_pb2.VehiclePosition], now: Optional[float] = None) -> List[Tuple[Tuple[int, float], Train]]:
+        # Unordered (sort key, train) pairs; `now` defaults to the wall clock
+        if now is None:
+            now = time.time()
+        route = self.route
+        stop_lookup = self._stop_lookup
+        status_names = vehicle_status_names()
+        get_vehicle = vehicles.get
+
+        keyed = []
         for trip_id, tu in trip_updates.items():
-            try:
-                route_id = tu.trip.route_id
-            except Exception:
-                continue
-            if route_id != args.route:
+            trip = tu.trip
+            if trip.route_id != route:
                 continue
 
+            # First stop_time_update with a predicted arrival (or departure) is the next stop
             next_stop_id = "(no stop)"
             arrival_ts = None
             for stu in tu.stop_time_update:
-                at = getattr(stu, "arrival", None)
-                dt = getattr(stu, "departure", None)
-                if at and getattr(at, "time", 0):
-                    arrival_ts = getattr(at, "time")
-                    next_stop_id = getattr(stu, "stop_id", "(no stop)")
-                    break
-                if dt and getattr(dt, "time", 0):
-                    arrival_ts = getattr(dt, "time")
-                    next_stop_id = getattr(stu, "stop_id", "(no stop)")
+                ts = stu.arrival.time or stu.departure.time
+                if ts:
+                    arrival_ts = ts
+                    next_stop_id = stu.stop_id
                     break
 
-            secs = _secs_until(arrival_ts) if arrival_ts else 0.0
-
-            direction_char = None
-            if len(next_stop_id) > 1 and next_stop_id[-1] in ('N', 'S'):
-                direction_char = next_stop_id[-1]
-
-            direction = None
-            try:
-                direction = tu.trip.direction_id
-            except Exception:
-                pass
-
-            veh = vehicles.get(trip_id)
-            veh_stop = None
-            status = None
-            if veh:
-                try:
-                    veh_stop = veh.stop_id if hasattr(veh, "stop_id") else None
-                except Exception:
-                    veh_stop = None
-                try:
-                    status = gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus.Name(veh.current_status)
-                except Exception:
-                    status = str(getattr(veh, "current_status", ""))
+            secs = arrival_ts - now if arrival_ts else 0.0
+            if secs < 0:
+                secs = 0.0
 
+            direction_char = next_stop_id[-1] if len(next_stop_id) > 1 and next_stop_id[-1] in ('N', 'S') else None
             base_stop_id = next_stop_id[:-1] if direction_char else next_stop_id
-            station_name = self.station_id_to_name(base_stop_id)
-            station_index = self.station_name_to_index(station_name) if station_name else -1
-            section_name = self.stop_id_to_section.get(base_stop_id)
-
-            trains.append(Train(
-                trip_id=trip_id,
-                route_id=route_id,
-                start_date=tu.trip.start_date if hasattr(tu.trip, "start_date") else "",
-                next_stop_id=next_stop_id,
-                time_until=secs,
-                direction=direction,
-                next_station_index=station_index,
-                direction_char=direction_char,
-                vehicle_stop_id=veh_stop,
-                current_status=status,
-                section_name=section_name
-            ))
-
-        def get_sort_key(train: Train):
-            # Direction 0 is typically 'North' or towards the higher-indexed station
-            is_to_endpoint = (train.direction_char == 'N')
-            
-            # Primary sort: station index.
-            primary_sort = train.next_station_index - is_to_endpoint
-            primary_sort *= -1
-
-            # Secondary sort: time_until within the same station index block
-            secondary_sort = train.time_until
-
-            # Invert secondary sort based on direction to maintain order within a block
-            secondary_sort *= (1 if is_to_endpoint else -1)
-
-            return (primary_sort, secondary_sort)
+            station_name, station_index, section_name = stop_lookup.get(base_stop_id, _no_station)
 
-        try:
-            trains = sorted(trains, key=get_sort_key)
-        except Exception:
-            pass
-        
-        return trains
+            veh = get_vehicle(trip_id)
+            if veh is not None:
+                veh_stop = veh.stop_id
+                status = status_names.get(veh.current_status) or str(veh.current_status)
+            else:
+                veh_stop = None
+                status = None
+
+            train = Train(trip_id, route, trip.start_date, next_stop_id, secs, trip.direction_id, station_index,
+                          direction_char, veh_stop, status, section_name, station_name, arrival_ts)
+
+            # Direction 0 is typically 'North' or towards the higher-indexed station.
+            # Primary sort: station index; secondary: time_until, inverted by direction
+            # to maintain order within a block.
+            if direction_char == 'N':
+                keyed.append(((1 - station_index, secs), train))
+            else:
+                keyed.append(((-station_index, -secs), train))
+        return keyed
 
 def self_test():
     print("NYC MTA Subway Routes:\n")
@@ -337,49 +376,416 @@ def self_test():
     print(len(colors), "ANSI colors total.")
     print(len(line_to_url), "line to URL mappings total.")
 
-if __name__ == "__main__":
+def group_by_section(traingetter: TrainGetter, trains: List[Train]) -> Dict[str, List[Train]]:
+    trains_by_section = {section: [] for section in traingetter.route_data.keys()}
+    for t in trains:
+        if t.section_name and t.section_name in trains_by_section:
+            trains_by_section[t.section_name].append(t)
+    return trains_by_section
+
+def print_route(traingetter: TrainGetter, trains: List[Train], trains_by_section: Optional[Dict[str, List[Train]]] = None) -> None:
+    with mta_metrics.timed("render", traingetter.route):
+        _print_route(traingetter, trains, trains_by_section)
+
+def _print_route(traingetter: TrainGetter, trains: List[Train], trains_by_section: Optional[Dict[str, List[Train]]]) -> None:
+    route = traingetter.route
+    color = colors.get(route, "\033[0m")
+    print(color + f" {route}: {line_to_long_name.get(route, '')} " + "\033[0m")
+    
+    if not traingetter.route_data:
+        print(f"No station data found for route {route} in mta_subway_stations.json")
+        return
+
+    if not trains:
+        print("No trip updates for this route in feed.")
+    
+    # Group trains by section
+    if trains_by_section is None:
+        trains_by_section = group_by_section(traingetter, trains)
+
+    # Print each section and its trains
+    for section_name, section_trains in trains_by_section.items():
+        print(f"\n\033[1;4m{section_name}\033[0m")
+        if section_trains:
+            for t in section_trains:
+                print(t)
+        else:
+            # It's okay if no trains are on a section
+            pass
+
+def make_fetcher(args, decode: bool = True) -> FeedFetcher:
+    from mta_feed_fetcher import FeedCache, FeedFetcher
+    # The feed cache is shared with every other mta_rail process on the machine. A
+    # PollScheduler times its own fetches (probes land before the cache's TTL runs
+    # out), so --adaptive goes to the network and relies on conditional requests
+    cache = None if args.no_feed_cache or getattr(args, "adaptive", False) else FeedCache(args.feed_cache)
+    return FeedFetcher(base_url=args.feed_base_url, timeout=args.timeout, cache=cache, decode=decode)
+
+def get_trains_multi(fetcher: FeedFetcher, routes: List[str]) -> Dict[str, Tuple[TrainGetter, List[Train]]]:
+    # Fetch every needed feed concurrently, decode each once, then split its entities across the requested routes
+    results = OrderedDict()
+    groups = group_routes_by_url(routes)
+    feeds = fetcher.fetch_all(groups.keys())
+    for url, url_routes in groups.items():
+        result = feeds[url]
+        if not result.ok:
+            print(f"Error fetching data for {', '.join(url_routes)}: {result.error}")
+            continue
+        trip_updates, vehicles = bucket_feed(result.feed, url_routes)
+        for route in url_routes:
+            traingetter = TrainGetter(route)
+            results[route] = (traingetter, traingetter.build_trains(trip_updates[route], vehicles))
+    return results
+
+def get_trains_pooled(fetcher: FeedFetcher, routes: List[str], pool: DecodePool) -> Dict[str, Tuple[TrainGetter, List[Train]]]:
+    # Same as get_trains_multi, but every feed is parsed and extracted in a worker
+    # process; `fetcher` must be made with decode=False
+    groups = group_routes_by_url(routes)
+    feeds = fetcher.fetch_all(groups.keys())
+    payloads = OrderedDict()
+    for url, url_routes in groups.items():
+        if feeds[url].ok:
+            payloads[url] = (feeds[url].payload, url_routes)
+        else:
+            print(f"Error fetching data for {', '.join(url_routes)}: {feeds[url].error}")
+    trains = pool.decode_all(payloads)
+    return OrderedDict((route, (TrainGetter(route), trains[route])) for route in routes if route in trains)
+
+def get_trains_columnar(fetcher: FeedFetcher, routes: List[str]) -> Dict[str, Tuple[TrainGetter, List[Train], Dict[str, List[Train]]]]:
+    # Same as get_trains_multi, but ETAs, ordering and section grouping run as array operations
+    from mta_columnar import build_snapshot
+
+    groups = group_routes_by_url(routes)
+    feeds = fetcher.fetch_all(groups.keys())
+    fetched = []
+    for url, url_routes in groups.items():
+        if feeds[url].ok:
+            fetched.append((feeds[url].feed, url_routes))
+        else:
+            print(f"Error fetching data for {', '.join(url_routes)}: {feeds[url].error}")
+            routes = [route for route in routes if route not in url_routes]
+
+    traingetters = OrderedDict((route, TrainGetter(route)) for route in routes)
+    snapshot = build_snapshot(fetched, traingetters)
+    etas = snapshot.etas()
+    order = snapshot.order(etas=etas)
+
+    results = OrderedDict()
+    for route, traingetter in traingetters.items():
+        trains = snapshot.to_trains(snapshot.route_rows(route, order), traingetters, etas)
+        trains_by_section = OrderedDict(
+            (section_name, snapshot.to_trains(rows, traingetters, etas))
+            for section_name, rows in snapshot.sections(route, order).items()
+        )
+        results[route] = (traingetter, trains, trains_by_section)
+    return results
+
+class FeedWatcher():
+    # Keeps TrainGetters and the last snapshot per route alive between polls.
+    # A feed is only re-extracted when its header timestamp moves. With an
+    # ArrivalIndex, every re-extracted feed also refreshes the per-stop boards and
+    # the stops that changed are left in `changed_stops`. With a HistoryWriter, every
+    # route that changed is recorded at the feed's header timestamp. `polled` holds
+    # the header timestamp of every feed fetched by the last poll (None on error) and
+    # `changed_feeds` whether its body moved, which is what a PollScheduler learns from.
+    def __init__(self, fetcher: FeedFetcher, routes: List[str], arrivals: Optional[ArrivalIndex] = None,
+                 history: Optional[HistoryWriter] = None) -> None:
+        self.fetcher = fetcher
+        self.routes = routes
+        self.groups = group_routes_by_url(routes)
+        self.traingetters = {route: TrainGetter(route) for route in routes}
+        self.snapshots: Dict[str, Dict[str, Train]] = {route: {} for route in routes}
+        self.feed_timestamps: Dict[str, int] = {}
+        # Body digests, for feeds published without a header timestamp
+        self.feed_digests: Dict[str, bytes] = {}
+        self.arrivals = arrivals
+        self.history = history
+        self.changed_stops: set = set()
+        self.polled: Dict[str, Optional[int]] = {}
+        self.changed_feeds: Dict[str, bool] = {}
+
+    def poll(self, urls: Optional[Iterable[str]] = None) -> Dict[str, Tuple[List[Train], TripDiff]]:
+        # Every feed, or only `urls` (e.g. the ones a PollScheduler says are due)
+        updates = OrderedDict()
+        self.changed_stops = set()
+        self.polled = {}
+        self.changed_feeds = {}
+        urls = list(self.groups) if urls is None else [url for url in urls if url in self.groups]
+        feeds = self.fetcher.fetch_all(urls)
+        for url in urls:
+            url_routes = self.groups[url]
+            result = feeds[url]
+            if not result.ok:
+                self.polled[url] = None
+                print(f"Error fetching data for {', '.join(url_routes)}: {result.error}")
+                continue
+            timestamp = result.feed.header.timestamp
+            self.polled[url] = timestamp
+            if result.not_modified:
+                unchanged = True
+            elif timestamp:
+                unchanged = self.feed_timestamps.get(url) == timestamp
+            else:
+                import hashlib
+                digest = hashlib.sha1(result.feed.SerializeToString()).digest()
+                unchanged = self.feed_digests.get(url) == digest
+                self.feed_digests[url] = digest
+            self.changed_feeds[url] = not unchanged
+            if unchanged:
+                continue
+            self.feed_timestamps[url] = timestamp
+
+            if self.arrivals is not None:
+                self.changed_stops |= self.arrivals.update_feed(url, result.feed, url_routes)
+            trip_updates, vehicles = bucket_feed(result.feed, url_routes)
+            for route in url_routes:
+                trains = self.traingetters[route].build_trains(trip_updates[route], vehicles)
+                diff = diff_trains(self.snapshots[route], trains)
+                self.snapshots[route] = {t.trip_id: t for t in trains}
+                if diff:
+                    updates[route] = (trains, diff)
+                    if self.history is not None:
+                        self.history.append(route, trains, timestamp or None)
+        return updates
+
+    def run(self, interval: float, scheduler: Optional[PollScheduler] = None):
+        if scheduler is not None:
+            while True:
+                updates = self.poll(scheduler.next_batch())
+                scheduler.observe_all(self.polled, changed=self.changed_feeds)
+                yield updates
+        while True:
+            started = time.monotonic()
+            yield self.poll()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def print_diff(route: str, diff: TripDiff) -> None:
+    color = colors.get(route, "\033[0m")
+    stamp = time.strftime("%H:%M:%S")
+    print(f"\n[{stamp}] " + color + f" {route} " + "\033[0m" + f" +{len(diff.added)} -{len(diff.removed)} ~{len(diff.changed)}")
+    for t in diff.added:
+        print("\033[1;32m+ added\033[0m", t)
+    for t in diff.removed:
+        print("\033[1;31m- removed\033[0m", t)
+    for old, t in diff.changed:
+        print(f"\033[1;36m~ changed\033[0m ({old.next_stop_id} -> {t.next_stop_id})", t)
+
+def station_board(fetcher: FeedFetcher, stop_id: str, limit: int = 20) -> None:
+    # Fetch only the feeds for routes that serve this stop, and read the board from an ArrivalIndex
+    from mta_arrivals import ArrivalIndex
+
+    served = load_station_index().lookup(stop_id)
+    name = load_station_index().station_name(stop_id)
+    if not served:
+        print(f"Unknown stop_id {stop_id} in mta_subway_stations.json")
+        return
+    # The index lists shuttles both under 'S' and as GS/FS/H; only the latter appear in feeds
+    routes = [route for route in dict.fromkeys(route for route, _, _ in served) if route in line_to_url]
+
+    arrivals = ArrivalIndex()
+    with fetcher:
+        groups = group_routes_by_url(routes)
+        feeds = fetcher.fetch_all(groups.keys())
+    for url, url_routes in groups.items():
+        if feeds[url].ok:
+            arrivals.update_feed(url, feeds[url].feed, url_routes)
+        else:
+            print(f"Error fetching data for {', '.join(url_routes)}: {feeds[url].error}")
+
+    now = time.time()
+    print(f"\033[1;4m{name} ({stop_id})\033[0m")
+    board = arrivals.board(stop_id, now=now, limit=limit)
+    if not board:
+        print("No upcoming arrivals in feed.")
+    for arrival in board:
+        color = colors.get(arrival.route_id, "\033[0m")
+        eta = int(arrival.arrival_time - now)
+        print(color + f" {arrival.route_id} " + "\033[0m" + f" {arrival.direction_char or ' '}  {arrival.trip_id:20s} in {eta}s")
+
+def make_scheduler(args, routes: Iterable[str], require_demand: bool = False) -> Optional[PollScheduler]:
+    # None unless --adaptive; --watch is then only the first guess at each feed's cadence
+    if not args.adaptive:
+        return None
+    from mta_scheduler import PollScheduler
+    return PollScheduler(group_routes_by_url(routes), interval=args.watch or 30.0, max_rate=args.max_rate,
+                         require_demand=require_demand)
+
+def watch(fetcher: FeedFetcher, routes: List[str], interval: float, history: Optional[HistoryWriter] = None,
+          scheduler: Optional[PollScheduler] = None) -> None:
+    with fetcher:
+        watcher = FeedWatcher(fetcher, routes, history=history)
+        first = True
+        try:
+            for updates in watcher.run(interval, scheduler):
+                for route, (trains, diff) in updates.items():
+                    if first:
+                        print_route(watcher.traingetters[route], trains)
+                        print()
+                    else:
+                        print_diff(route, diff)
+                first = False
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if history is not None:
+                history.close()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="NYC MTA Subway Train Tracker")
+    parser.add_argument('-l', '-r', '--route', type=str, choices=route_ids, default=None, help='Subway route to track (default 6; with --serve, every route)')
+    parser.add_argument('-R', '--routes', type=str, default=None, help="Comma-separated routes to track, or 'all' (each feed is fetched once)")
+    parser.add_argument('--feed-base-url', type=str, default=None, help='Fetch feeds from this base URL instead of the MTA API (e.g. a local fixture server)')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Per-request feed timeout in seconds')
+    parser.add_argument('--feed-cache', type=str, default=None, metavar='DIR', help='Directory of the feed cache shared between concurrent runs (default: a per-user directory under the system temp dir)')
+    parser.add_argument('--no-feed-cache', action='store_true', help='Always fetch feeds from the network, bypassing the shared feed cache')
+    parser.add_argument('-w', '--watch', type=float, default=None, metavar='INTERVAL', help='Keep running and re-poll every INTERVAL seconds, printing only what changed')
+    parser.add_argument('-j', '--workers', type=int, default=None, metavar='N', help='With -R (and no --watch, --serve, --tui or --station), parse and extract feeds in N worker processes instead of in this one')
+    parser.add_argument('--columnar', action='store_true', help='Compute ETAs, ordering and section grouping on a NumPy snapshot (requires numpy)')
+    parser.add_argument('-s', '--station', type=str, default=None, metavar='STOP_ID', help='Show the next arrivals at a station (base stop ID, e.g. 127) across every route serving it')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT', help="Serve every tracked route as JSON/SSE on PORT from one shared polling loop (polls every --watch seconds, default 30)")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface for --serve')
+    parser.add_argument('--tui', action='store_true', help='Full-screen live board of every tracked route in split panes (polls every --watch seconds, default 30)')
+    parser.add_argument('--fps', type=float, default=4.0, help='Frame rate for --tui')
+    parser.add_argument('--adaptive', action='store_true', help='With --watch, --serve or --tui, fetch each feed just after it is expected to publish, backing off while it is unchanged (--watch INTERVAL is the first guess; bypasses the shared feed cache)')
+    parser.add_argument('--max-rate', type=float, default=1.0, metavar='RPS', help='With --adaptive, cap feed requests per second across all feeds')
+    parser.add_argument('--history', type=str, default=None, metavar='DIR', help='With --watch or --serve, append every change to a compressed history store in DIR (query with mta_history.py)')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT', help='Expose Prometheus text metrics at http://HOST:PORT/metrics (with --serve they are also at /metrics)')
+    parser.add_argument('--profile', type=str, default=None, metavar='PATH', help="Write a per-stage timing profile to PATH ('-' for stderr) on exit")
+    parser.add_argument('-st', '--self-test', action='store_true', help='Run self-test to display route colors and names')
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
     if args.self_test:
         self_test()
-        exit()
+        return
+
+    if args.routes:
+        try:
+            routes = parse_routes(args.routes)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.route is None and args.serve is not None:
+        # --serve tracks every route unless -r or -R narrows it
+        routes = list(route_ids)
+    else:
+        args.route = args.route or '6'
+        routes = [args.route]
+
+    if args.watch is not None and args.watch <= 0:
+        parser.error("--watch INTERVAL must be positive")
+    if args.history and args.watch is None and args.serve is None:
+        parser.error("--history requires --watch or --serve")
+    if args.history and (args.station or (args.tui and args.serve is None)):
+        parser.error("--history cannot be combined with --tui or --station")
+    if args.workers is not None and args.workers <= 0:
+        parser.error("--workers must be positive")
+    if args.workers is not None and (not args.routes or args.watch is not None or args.serve is not None
+                                     or args.tui or args.station):
+        parser.error("--workers only applies to a one-shot -R/--routes run")
+    if args.adaptive and args.watch is None and args.serve is None and not args.tui:
+        parser.error("--adaptive requires --watch, --serve or --tui")
+    if args.max_rate <= 0:
+        parser.error("--max-rate must be positive")
+
+    # Metrics are only collected when something will read them
+    if args.metrics_port is not None:
+        mta_metrics.serve_metrics(args.host, args.metrics_port)
+    if args.profile or args.serve is not None:
+        mta_metrics.enable()
+    try:
+        run(args, parser, routes)
+    finally:
+        if args.profile:
+            write_profile(args.profile)
+
+def write_profile(path: str) -> None:
+    if path == '-':
+        mta_metrics.REGISTRY.dump_profile(sys.stderr)
+        return
+    with open(path, "w") as f:
+        mta_metrics.REGISTRY.dump_profile(f)
+
+def _terminate(signum, frame) -> None:
+    raise SystemExit(128 + signum)
+
+def run(args, parser: argparse.ArgumentParser, routes: List[str]) -> None:
+    history = None
+    if args.history:
+        from mta_history import HistoryWriter
+        history = HistoryWriter(args.history)
+        # A daemon stopped with SIGTERM unwinds like Ctrl-C, so watch()/serve() close
+        # the writer and the buffered rows are written
+        import signal
+        signal.signal(signal.SIGTERM, _terminate)
+
+    if args.station:
+        station_board(make_fetcher(args), args.station)
+        return
+
+    if args.serve is not None:
+        from mta_server import serve
+        # Feeds nobody is reading are not polled
+        serve(make_fetcher(args), routes, args.host, args.serve, args.watch or 30.0, history,
+              make_scheduler(args, routes, require_demand=True))
+        return
+
+    if args.tui:
+        from mta_tui import run_tui
+        if args.fps <= 0:
+            parser.error("--fps must be positive")
+        run_tui(make_fetcher(args), routes, args.watch or 30.0, args.fps, make_scheduler(args, routes))
+        return
+
+    if args.watch is not None:
+        watch(make_fetcher(args), routes, args.watch, history, make_scheduler(args, routes))
+        return
+
+    if args.workers is not None and args.routes:
+        from mta_decode_pool import DecodePool
+        with make_fetcher(args, decode=False) as fetcher, DecodePool(args.workers) as pool:
+            results = get_trains_pooled(fetcher, routes, pool)
+        for route in routes:
+            if route in results:
+                print_route(*results[route])
+                print()
+        return
+
+    if args.columnar:
+        with make_fetcher(args) as fetcher:
+            results = get_trains_columnar(fetcher, routes)
+        for route in routes:
+            if route in results:
+                print_route(*results[route])
+                print()
+        return
+
+    if args.routes:
+        with make_fetcher(args) as fetcher:
+            results = get_trains_multi(fetcher, routes)
+        for route in routes:
+            if route in results:
+                print_route(*results[route])
+                print()
+        return
 
     if args.route:
-        traingetter = TrainGetter() # Instantiate the class
-        feed = gtfs_realtime_pb2.FeedMessage()
-        url = line_to_url[args.route]
+        traingetter = TrainGetter(args.route) # Instantiate the class
         
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            feed.ParseFromString(response.content)
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data: {e}")
-            exit()
+        with make_fetcher(args) as fetcher:
+            result = fetcher.fetch(line_to_url[args.route])
+        if not result.ok:
+            print(f"Error fetching data: {result.error}")
+            return
+        feed = result.feed
 
         trains = traingetter.get_trains(feed)
+        print_route(traingetter, trains)
 
-        # --- Print the results by section ---
-        color = colors.get(args.route, "\033[0m")
-        print(color + f" {args.route}: {line_to_long_name.get(args.route, '')} " + "\033[0m")
-        
-        if not traingetter.route_data:
-            print(f"No station data found for route {args.route} in mta_subway_stations.json")
-            exit()
-
-        if not trains:
-            print("No trip updates for this route in feed.")
-        
-        # Group trains by section
-        trains_by_section = {section: [] for section in traingetter.route_data.keys()}
-        for t in trains:
-            if t.section_name and t.section_name in trains_by_section:
-                trains_by_section[t.section_name].append(t)
-
-        # Print each section and its trains
-        for section_name, section_trains in trains_by_section.items():
-            print(f"\n\033[1;4m{section_name}\033[0m")
-            if section_trains:
-                for t in section_trains:
-                    print(t)
-            else:
-                # It's okay if no trains are on a section
-                pass
\ No newline at end of file
+if __name__ == "__main__":
+    # Let helper modules that import mta_rail share this module instead of re-running it
+    sys.modules.setdefault("mta_rail", sys.modules[__name__])
+    main()
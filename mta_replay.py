@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from google.transit import gtfs_realtime_pb2
+
+FEED_EXTENSIONS = ('.pb', '.bin', '.txt', '.pbtxt')
+
+def parse_feed_bytes(data: bytes) -> gtfs_realtime_pb2.FeedMessage:
+    # Recorded feeds are either raw protobuf or a text-format dump like feed_debug.txt.
+    # A serialized FeedMessage starts with its header (field 1, length-delimited: 0x0a).
+    from google.transit import gtfs_realtime_pb2
+    from google.protobuf import text_format
+
+    feed = gtfs_realtime_pb2.FeedMessage()
+    if data[:1] == b"\x0a":
+        feed.ParseFromString(data)
+    else:
+        text_format.Parse(data.decode("utf-8"), feed)
+    return feed
+
+def load_feed(path: str) -> gtfs_realtime_pb2.FeedMessage:
+    with open(path, "rb") as f:
+        return parse_feed_bytes(f.read())
+
+def _snapshot_sort_key(path: str) -> Tuple[int, str]:
+    # Prefer a unix timestamp embedded in the file name (e.g. gtfs-ace_1760772235.pb), else mtime
+    stamps = re.findall(r"\d{9,}", os.path.basename(path))
+    return (int(stamps[-1]) if stamps else int(os.path.getmtime(path)), path)
+
+def snapshot_paths(path: str) -> List[str]:
+    # A single recorded feed, or every feed file in a directory of timestamped snapshots
+    if not os.path.isdir(path):
+        return [path]
+    paths = [
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.endswith(FEED_EXTENSIONS) and os.path.isfile(os.path.join(path, name))
+    ]
+    return sorted(paths, key=_snapshot_sort_key)
+
+class ReplayClock():
+    # Simulated wall clock: tracks the header timestamp of the snapshot being replayed,
+    # plus however far playback has been advanced within it
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def set(self, now: float) -> None:
+        self._now = now
+
+    def advance(self, seconds: float) -> None:
+        self._now += seconds
+
+@dataclass
+class ReplayFrame:
+    path: str
+    feed: gtfs_realtime_pb2.FeedMessage
+    now: float
+
+class FeedReplay():
+    def __init__(self, path: str, clock: Optional[ReplayClock] = None) -> None:
+        self.paths = snapshot_paths(path)
+        self.clock = clock or ReplayClock()
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[ReplayFrame]:
+        # Snapshots are loaded lazily; the clock jumps to each feed's header timestamp
+        for path in self.paths:
+            feed = load_feed(path)
+            if feed.header.timestamp:
+                self.clock.set(float(feed.header.timestamp))
+            yield ReplayFrame(path, feed, self.clock.now())
+
+def replay(path: str, routes: List[str], speed: float = 0.0, diff: bool = False) -> None:
+    # Render each snapshot as mta_rail would have at the time it was recorded.
+    # speed=0 replays as fast as possible; speed=1 waits out the real gaps between snapshots.
+    from mta_rail import TrainGetter, bucket_feed, diff_trains, print_diff, print_route
+
+    traingetters = {route: TrainGetter(route) for route in routes}
+    snapshots: Dict[str, dict] = {route: {} for route in routes}
+    previous = None
+    for frame in FeedReplay(path):
+        if speed > 0 and previous is not None and frame.now > previous:
+            time.sleep((frame.now - previous) / speed)
+        previous = frame.now
+
+        print(f"\n\033[2m--- {os.path.basename(frame.path)} @ {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(frame.now))} ---\033[0m")
+        trip_updates, vehicles = bucket_feed(frame.feed, routes)
+        for route, traingetter in traingetters.items():
+            if not trip_updates[route]:
+                continue
+            trains = traingetter.build_trains(trip_updates[route], vehicles, now=frame.now)
+            if diff and snapshots[route]:
+                changes = diff_trains(snapshots[route], trains)
+                if changes:
+                    print_diff(route, changes)
+            else:
+                print_route(traingetter, trains)
+            snapshots[route] = {t.trip_id: t for t in trains}
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    from mta_rail import parse_routes
+
+    parser = argparse.ArgumentParser(description="Replay recorded GTFS-RT feeds through the train tracker")
+    parser.add_argument('path', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "feed_debug.txt"), help='Recorded feed (text or binary protobuf) or a directory of snapshots')
+    parser.add_argument('-R', '--routes', type=str, default='all', help="Comma-separated routes to replay, or 'all'")
+    parser.add_argument('--speed', type=float, default=0.0, help='Playback speed relative to real time (0 = as fast as possible)')
+    parser.add_argument('--diff', action='store_true', help='After the first snapshot, print only per-trip changes')
+    args = parser.parse_args()
+
+    try:
+        routes = parse_routes(args.routes)
+    except ValueError as e:
+        parser.error(str(e))
+    replay(args.path, routes, speed=args.speed, diff=args.diff)
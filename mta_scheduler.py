@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional
+
+import mta_metrics
+
+# Weight of each new publish interval in the learned cadence
+INTERVAL_ALPHA = 0.3
+# While a feed's cadence is still being learned (and every PROBE_EVERY publishes
+# after that) the next fetch is placed half way to the expected publish, since polls
+# that always land after a publish can't tell an interval from a multiple of it
+LEARNING_SAMPLES = 3
+PROBE_EVERY = 20
+# Publish gaps kept per feed to estimate the smallest observed delay (clock skew plus
+# how late after publishing a change can first be seen)
+GAP_SAMPLES = 8
+
+@dataclass(slots=True)
+class FeedSchedule:
+    url: str
+    routes: List[str]
+    interval: float
+    samples: int = 0
+    header_timestamp: int = 0
+    offset: float = 0.0
+    gaps: Deque[float] = field(default_factory=lambda: deque(maxlen=GAP_SAMPLES))
+    misses: int = 0
+    errors: int = 0
+    due: float = 0.0
+    polls: int = 0
+    changes: int = 0
+    last_poll: Optional[float] = None
+    reason: str = "first poll"
+
+@dataclass(slots=True)
+class Decision:
+    at: float
+    feed: str
+    action: str
+    reason: str
+
+class PollScheduler():
+    # Decides when each feed is fetched next instead of polling all of them on one
+    # fixed interval. Each feed's publish interval is learned from successive header
+    # timestamps, and the next fetch is placed just after the next expected publish
+    # (with the occasional earlier probe, see LEARNING_SAMPLES). A poll after the
+    # expected publish that finds no change backs off exponentially until the feed
+    # moves again.
+    # Feeds nobody is watching are skipped when `require_demand` is set, and a token
+    # bucket caps total requests; when several feeds are due at once, the ones with
+    # the most subscribers and the stalest data go first. Every decision is kept
+    # (the last `history` of them) and `snapshot()` explains the current plan.
+    def __init__(self, groups: Dict[str, List[str]], interval: float = 30.0, min_interval: float = 2.0,
+                 max_backoff: float = 120.0, grace: float = 1.0, max_rate: float = 1.0, burst: int = 8,
+                 require_demand: bool = False, interest_ttl: float = 60.0, history: int = 256) -> None:
+        self.feeds: Dict[str, FeedSchedule] = {url: FeedSchedule(url, list(routes), interval) for url, routes in groups.items()}
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.grace = grace
+        self.max_rate = max_rate
+        self.burst = burst
+        self.require_demand = require_demand
+        self.interest_ttl = interest_ttl
+        self.decisions: Deque[Decision] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers: Dict[str, int] = {}
+        self._interest: Dict[str, float] = {}
+        self._tokens = float(burst)
+        # On the same clock as every `now` (wall time unless the caller passes its own)
+        self._refilled: Optional[float] = None
+
+    # -- demand --
+
+    def subscribe(self, routes: Iterable[str]) -> None:
+        # A long-lived watcher (e.g. an SSE client) of these routes
+        with self._lock:
+            for route in routes:
+                self._subscribers[route] = self._subscribers.get(route, 0) + 1
+            self._wake_idle()
+
+    def unsubscribe(self, routes: Iterable[str]) -> None:
+        with self._lock:
+            for route in routes:
+                count = self._subscribers.get(route, 0) - 1
+                if count > 0:
+                    self._subscribers[route] = count
+                else:
+                    self._subscribers.pop(route, None)
+
+    def touch(self, routes: Iterable[str], now: Optional[float] = None) -> None:
+        # A one-off read of these routes keeps them polled for `interest_ttl` seconds
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for route in routes:
+                self._interest[route] = now + self.interest_ttl
+            self._wake_idle(now)
+
+    def demand(self, url: str, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+        routes = self.feeds[url].routes
+        count = sum(self._subscribers.get(route, 0) for route in routes)
+        count += sum(1 for route in routes if self._interest.get(route, 0.0) > now)
+        return count if count or self.require_demand else 1
+
+    def _wake_idle(self, now: Optional[float] = None) -> None:
+        # Feeds skipped for lack of demand are re-checked right away
+        if now is None:
+            now = time.time()
+        for schedule in self.feeds.values():
+            if schedule.reason == "no subscribers":
+                schedule.due = now
+        self._wake.set()
+
+    # -- planning --
+
+    def _refill(self, now: float) -> None:
+        # A clock that steps back refills nothing rather than draining the bucket
+        if self._refilled is None or now > self._refilled:
+            if self._refilled is not None:
+                self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.max_rate)
+            self._refilled = now
+
+    def _decide(self, schedule: FeedSchedule, action: str, reason: str, now: float) -> None:
+        schedule.reason = reason
+        self.decisions.append(Decision(now, mta_metrics.feed_label(schedule.url), action, reason))
+        if mta_metrics.enabled:
+            mta_metrics.POLL_DECISIONS.inc((mta_metrics.feed_label(schedule.url), action))
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        # Feeds to fetch now, in priority order, within the request budget
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._refill(now)
+            ready = []
+            for schedule in self.feeds.values():
+                if schedule.due > now:
+                    continue
+                demand = self.demand(schedule.url, now)
+                if not demand:
+                    if schedule.reason != "no subscribers":
+                        self._decide(schedule, "skip", "no subscribers", now)
+                    # Re-checked by subscribe()/touch(), or after a while regardless
+                    schedule.due = now + self.max_backoff
+                    continue
+                ready.append((demand, now - schedule.header_timestamp, schedule))
+            ready.sort(key=lambda item: (-item[0], -item[1]))
+
+            urls = []
+            for demand, _, schedule in ready:
+                if self._tokens < 1.0:
+                    schedule.due = now + (1.0 - self._tokens) / self.max_rate
+                    self._decide(schedule, "defer", f"rate limit ({self.max_rate:g}/s), demand {demand}", now)
+                    continue
+                self._tokens -= 1.0
+                schedule.polls += 1
+                schedule.last_poll = now
+                self._decide(schedule, "poll", schedule.reason, now)
+                urls.append(schedule.url)
+            return urls
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        # Seconds until the next feed falls due
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if not self.feeds:
+                return self.max_backoff
+            return max(0.0, min(schedule.due for schedule in self.feeds.values()) - now)
+
+    def next_batch(self, stop: Optional[threading.Event] = None) -> List[str]:
+        # Blocks until some feed is due (or `stop` is set, which returns [])
+        while stop is None or not stop.is_set():
+            urls = self.due()
+            if urls:
+                return urls
+            delay = self.wait_time()
+            # Wake at least once a second to notice `stop`
+            self._wake.wait(min(delay, 1.0) if stop is not None else delay)
+            self._wake.clear()
+        return []
+
+    # -- learning --
+
+    def observe(self, url: str, header_timestamp: Optional[int], now: Optional[float] = None,
+                changed: Optional[bool] = None) -> None:
+        # Outcome of a fetch: the feed's header timestamp, or None when it failed.
+        # `changed` says whether the body moved, for feeds that leave the timestamp at 0
+        if now is None:
+            now = time.time()
+        with self._lock:
+            schedule = self.feeds[url]
+            if header_timestamp is None:
+                schedule.errors += 1
+                backoff = self._backoff(schedule.errors)
+                schedule.due = now + backoff
+                schedule.reason = f"fetch failed x{schedule.errors}; retry in {backoff:.1f}s"
+                return
+            schedule.errors = 0
+            if not header_timestamp:
+                # Nothing to learn a cadence from: poll every `interval` while it changes
+                if changed:
+                    schedule.misses = 0
+                    schedule.changes += 1
+                    schedule.due = now + max(schedule.interval, self.min_interval)
+                    schedule.reason = f"updated (no header timestamp); next poll in {schedule.interval:.1f}s"
+                else:
+                    self._miss(schedule, now)
+            elif header_timestamp > schedule.header_timestamp:
+                previous = schedule.header_timestamp
+                if previous:
+                    self._learn(schedule, header_timestamp - previous)
+                schedule.gaps.append(now - header_timestamp)
+                schedule.offset = min(schedule.gaps)
+                schedule.header_timestamp = header_timestamp
+                schedule.misses = 0
+                schedule.changes += 1
+                expected = self._expected(schedule)
+                if schedule.samples < LEARNING_SAMPLES or schedule.changes % PROBE_EVERY == 0:
+                    probe = header_timestamp + schedule.offset + schedule.interval / 2
+                    schedule.due = max(probe + self.grace, now + self.min_interval)
+                    schedule.reason = f"updated; probing for a shorter cadence (expected publish in {expected - now:.1f}s)"
+                else:
+                    schedule.due = max(expected + self.grace, now + self.min_interval)
+                    schedule.reason = f"updated; next publish expected in {expected - now:.1f}s"
+            elif now < self._expected(schedule):
+                # An early probe: wait for the expected publish before backing off
+                expected = self._expected(schedule)
+                schedule.due = max(expected + self.grace, now + self.min_interval)
+                schedule.reason = f"probe unchanged; next publish expected in {expected - now:.1f}s"
+            else:
+                self._miss(schedule, now)
+            if mta_metrics.enabled:
+                mta_metrics.FEED_INTERVAL.set((mta_metrics.feed_label(url),), round(schedule.interval, 3))
+
+    def observe_all(self, timestamps: Dict[str, Optional[int]], now: Optional[float] = None,
+                    changed: Optional[Dict[str, bool]] = None) -> None:
+        for url, header_timestamp in timestamps.items():
+            self.observe(url, header_timestamp, now, changed.get(url) if changed is not None else None)
+
+    def _miss(self, schedule: FeedSchedule, now: float) -> None:
+        schedule.misses += 1
+        backoff = self._backoff(schedule.misses)
+        schedule.due = now + backoff
+        schedule.reason = f"unchanged x{schedule.misses}; retry in {backoff:.1f}s"
+
+    def _expected(self, schedule: FeedSchedule) -> float:
+        # Next publish, on our clock
+        return schedule.header_timestamp + schedule.offset + schedule.interval
+
+    def _learn(self, schedule: FeedSchedule, delta: float) -> None:
+        # With no unchanged poll since the last change, publishes may have been skipped
+        # and the delta can span a multiple of the interval; after misses it is genuine
+        if schedule.samples and not schedule.misses:
+            delta /= max(1, round(delta / schedule.interval))
+        if delta <= 0 or delta > self.max_backoff:
+            return
+        if schedule.samples and delta >= schedule.interval * 0.75:
+            schedule.interval += INTERVAL_ALPHA * (delta - schedule.interval)
+        else:
+            # First sample, or a probe found the cadence clearly shorter than thought
+            schedule.interval = delta
+        schedule.samples += 1
+
+    def _backoff(self, count: int) -> float:
+        return min(self.max_backoff, self.min_interval * 2 ** (count - 1))
+
+    # -- inspection --
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            feeds = []
+            for schedule in self.feeds.values():
+                age = now - schedule.header_timestamp - schedule.offset if schedule.header_timestamp else None
+                feeds.append({
+                    "feed": mta_metrics.feed_label(schedule.url),
+                    "routes": schedule.routes,
+                    "demand": self.demand(schedule.url, now),
+                    "interval": round(schedule.interval, 2),
+                    "learned_from": schedule.samples,
+                    "header_timestamp": schedule.header_timestamp or None,
+                    "age": round(age, 1) if age is not None else None,
+                    "misses": schedule.misses,
+                    "errors": schedule.errors,
+                    "due_in": round(schedule.due - now, 1),
+                    "polls": schedule.polls,
+                    "changes": schedule.changes,
+                    "reason": schedule.reason,
+                })
+            return {
+                "max_rate": self.max_rate,
+                "tokens": round(self._tokens, 2),
+                "feeds": feeds,
+                "decisions": [asdict(decision) for decision in self.decisions],
+            }
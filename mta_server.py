@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import mta_metrics
+from mta_arrivals import ArrivalIndex
+from mta_rail import FeedWatcher, Train, group_by_section, line_to_long_name, load_station_index
+
+if TYPE_CHECKING:
+    from mta_feed_fetcher import FeedFetcher
+    from mta_history import HistoryWriter
+    from mta_scheduler import PollScheduler
+
+# How many poll versions SSE clients can fall behind before they get a full resend
+CHANGE_HISTORY = 64
+SSE_KEEPALIVE = 15.0
+
+def _encode(payload: dict) -> Tuple[str, bytes]:
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return '"' + hashlib.sha1(body).hexdigest() + '"', body
+
+def _train_json(train: Train) -> dict:
+    return asdict(train)
+
+class SnapshotStore():
+    # Latest decoded trains for every route, plus pre-encoded JSON bodies (and ETags)
+    # for every route and station. Readers only ever see a complete generation.
+    # With a PollScheduler, client reads and subscriptions are the polling demand.
+    def __init__(self, watcher: FeedWatcher, scheduler: Optional[PollScheduler] = None) -> None:
+        self.watcher = watcher
+        self.scheduler = scheduler
+        self.version = 0
+        self._cond = threading.Condition()
+        self._bodies: Dict[str, Tuple[str, bytes]] = {}
+        self._changes: "OrderedDict[int, Set[str]]" = OrderedDict()
+
+    def poll(self, urls: Optional[List[str]] = None) -> Set[str]:
+        updates = self.watcher.poll(urls)
+        if not updates and not self.watcher.changed_stops and self.version:
+            return set()
+
+        now = time.time()
+        bodies = dict(self._bodies)
+        for route, (trains, _) in updates.items():
+            bodies[f"/routes/{route}"] = self._route_body(route, trains, now)
+        if not self.version:
+            for route in self.watcher.routes:
+                bodies.setdefault(f"/routes/{route}", self._route_body(route, [], now))
+
+        # Only the station boards whose arrivals changed this poll are re-encoded
+        index = load_station_index()
+        arrivals = self.watcher.arrivals
+        for stop_id in self.watcher.changed_stops:
+            board = arrivals.board(stop_id, now=now)
+            if board:
+                bodies[f"/stations/{stop_id}"] = _encode({
+                    "stop_id": stop_id,
+                    "name": index.station_name(stop_id),
+                    "updated": now,
+                    "arrivals": [asdict(a) for a in board],
+                })
+            else:
+                bodies.pop(f"/stations/{stop_id}", None)
+
+        bodies["/routes"] = _encode({
+            "routes": {route: len(snapshot) for route, snapshot in self.watcher.snapshots.items()},
+            "updated": now,
+        })
+
+        with self._cond:
+            self._bodies = bodies
+            self.version += 1
+            self._changes[self.version] = set(updates)
+            while len(self._changes) > CHANGE_HISTORY:
+                self._changes.popitem(last=False)
+            self._cond.notify_all()
+        return set(updates)
+
+    def _route_body(self, route: str, trains: List[Train], now: float) -> Tuple[str, bytes]:
+        traingetter = self.watcher.traingetters[route]
+        url = next(url for url, routes in self.watcher.groups.items() if route in routes)
+        return _encode({
+            "route": route,
+            "name": line_to_long_name.get(route, ""),
+            "feed_timestamp": self.watcher.feed_timestamps.get(url),
+            "updated": now,
+            "sections": {
+                section: [_train_json(t) for t in section_trains]
+                for section, section_trains in group_by_section(traingetter, trains).items()
+            },
+        })
+
+    def get(self, path: str) -> Optional[Tuple[str, bytes]]:
+        cached = self._bodies.get(path)
+        if cached is None and path.startswith("/stations/"):
+            # Known station with nothing due: answer with an empty board
+            stop_id = path[len("/stations/"):]
+            name = load_station_index().station_name(stop_id)
+            if name is not None:
+                cached = _encode({"stop_id": stop_id, "name": name, "updated": time.time(), "arrivals": []})
+        return cached
+
+    def wait(self, since: int, timeout: float) -> Tuple[int, Optional[Set[str]]]:
+        # Block until a version newer than `since`; returns (version, changed routes),
+        # where None means the client fell too far behind and should resend everything
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > since, timeout=timeout)
+            version = self.version
+            if version <= since:
+                return version, set()
+            if since + 1 not in self._changes:
+                return version, None
+            changed = set()
+            for v in range(since + 1, version + 1):
+                changed |= self._changes.get(v, set())
+            return version, changed
+
+    def run(self, interval: float, stop: threading.Event) -> None:
+        if self.scheduler is not None:
+            self._run_scheduled(stop)
+            return
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling feeds: {e}")
+            stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def _run_scheduled(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            urls = self.scheduler.next_batch(stop)
+            if not urls:
+                continue
+            try:
+                self.poll(urls)
+            except Exception as e:
+                print(f"Error polling feeds: {e}")
+                self.scheduler.observe_all(dict.fromkeys(urls))
+                continue
+            self.scheduler.observe_all(self.watcher.polled, changed=self.watcher.changed_feeds)
+
+    def touch(self, path: str) -> None:
+        # Reads count as interest in the routes behind them
+        if self.scheduler is None:
+            return
+        if path.startswith("/routes/"):
+            self.scheduler.touch([path[len("/routes/"):]])
+        elif path.startswith("/stations/"):
+            # Any tracked feed may serve a station
+            self.scheduler.touch(self.watcher.routes)
+
+def make_handler(store: SnapshotStore):
+    class SnapshotHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            path = parts.path.rstrip("/") or "/"
+            if path == "/events":
+                self._stream(parse_qs(parts.query))
+                return
+            if path == "/metrics":
+                body = mta_metrics.REGISTRY.render().encode("utf-8")
+                self._send(200, body, content_type="text/plain; version=0.0.4; charset=utf-8")
+                return
+            if path == "/scheduler":
+                if store.scheduler is None:
+                    self._send(404, b'{"error":"not polling adaptively (start with --adaptive)"}')
+                else:
+                    self._send(200, json.dumps(store.scheduler.snapshot(), separators=(",", ":")).encode("utf-8"))
+                return
+            store.touch(path)
+            cached = store.get(path)
+            if cached is None:
+                self._send(404, b'{"error":"not found"}')
+                return
+            etag, body = cached
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, b"", etag)
+            else:
+                self._send(200, body, etag)
+
+        def _send(self, status: int, body: bytes, etag: Optional[str] = None, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-cache")
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def _stream(self, query):
+            # Server-Sent Events: one `route` event per changed route the client subscribed to
+            wanted = set()
+            for spec in query.get("routes", []):
+                wanted.update(r.strip().upper() for r in spec.split(",") if r.strip())
+            routes = [r for r in store.watcher.routes if not wanted or r in wanted]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            version, changed = store.version, None
+            if store.scheduler is not None:
+                store.scheduler.subscribe(routes)
+            try:
+                while True:
+                    for route in routes:
+                        if changed is not None and route not in changed:
+                            continue
+                        cached = store.get(f"/routes/{route}")
+                        if cached:
+                            etag, body = cached
+                            self.wfile.write(b"event: route\nid: " + etag.strip('"').encode() + b"\ndata: " + body + b"\n\n")
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    version, changed = store.wait(version, SSE_KEEPALIVE)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                if store.scheduler is not None:
+                    store.scheduler.unsubscribe(routes)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SnapshotHandler
+
+def serve(fetcher: FeedFetcher, routes: List[str], host: str = "127.0.0.1", port: int = 8080, interval: float = 30.0,
+          history: Optional[HistoryWriter] = None, scheduler: Optional[PollScheduler] = None) -> None:
+    # One upstream polling loop shared by every client
+    mta_metrics.enable()
+    store = SnapshotStore(FeedWatcher(fetcher, routes, ArrivalIndex(), history), scheduler)
+    store.poll()
+    if scheduler is not None:
+        # The startup poll fetched everything; learn from it
+        scheduler.observe_all(store.watcher.polled, changed=store.watcher.changed_feeds)
+    stop = threading.Event()
+    poller = threading.Thread(target=store.run, args=(interval, stop), name="feed-poller", daemon=True)
+    poller.start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    server.daemon_threads = True
+    endpoints = "routes, stations, events, metrics" + (", scheduler" if scheduler is not None else "")
+    print(f"Serving {len(routes)} routes at http://{host}:{server.server_port}/ ({endpoints})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        # Wait out a poll in flight (bounded by the fetch timeout) before closing what it writes to
+        poller.join()
+        fetcher.close()
+        if history is not None:
+            history.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_JSON_PATH = os.path.join(SCRIPT_DIR, "mta_subway_stations.json")
+
+# Shuttles are published under route 'S' in the station JSON; each shuttle route id
+# is served from its own section of it
+shuttle_sections = {
+    'GS': '42 St Shuttle (Manhattan)',
+    'FS': 'Franklin Shuttle (Brooklyn)',
+    'H': 'Rockaway Shuttle (Queens)',
+}
+
+# Layout (native byte order, every table 4-byte aligned; the index is a local build artifact):
+#   header   magic, version, json size, json mtime_ns, string count, blob length,
+#            route count, section count, entry count
+#   uint32   string offsets [strings + 1]   (strings are interned and sorted)
+#   bytes    utf-8 string blob
+#   uint32   routes   [route string, first section, section count]
+#   uint32   sections [section string, first entry, entry count]
+#   uint32   entries  [stop string, name string, route, section, station ordinal]
+#   uint32   entries sorted by stop string (permutation, for cross-route lookups)
+MAGIC = b"MTASIDX1"
+VERSION = 1
+HEADER = struct.Struct("=8sIQqIIIII")
+ENTRY = 5
+
+def default_index_path(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + ".idx"
+
+def _pad(n: int) -> int:
+    return (n + 3) & ~3
+
+def compile_index(station_data: Dict[str, Dict[str, Dict[str, str]]], json_size: int = 0, json_mtime_ns: int = 0) -> bytes:
+    # Route -> [(section name, [(stop_id, name), ...]), ...], with shuttle aliases split out of 'S'
+    routes = OrderedDict()
+    for route, sections in station_data.items():
+        routes[route] = [(name, list(stations.items())) for name, stations in sections.items()]
+    shuttles = station_data.get('S', {})
+    for alias, section_name in shuttle_sections.items():
+        routes[alias] = [(section_name, list(shuttles.get(section_name, {}).items()))]
+
+    strings = set(routes)
+    for sections in routes.values():
+        for section_name, stations in sections:
+            strings.add(section_name)
+            for stop_id, name in stations:
+                strings.add(stop_id)
+                strings.add(name)
+    strings = sorted(strings)
+    string_ids = {s: i for i, s in enumerate(strings)}
+
+    blob = bytearray()
+    offsets = array("I", [0])
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    blob += b"\0" * (_pad(len(blob)) - len(blob))
+
+    route_table, section_table, entry_table = array("I"), array("I"), array("I")
+    for r, (route, sections) in enumerate(routes.items()):
+        route_table.extend((string_ids[route], len(section_table) // 3, len(sections)))
+        ordinals: Dict[str, int] = {}
+        for section_name, stations in sections:
+            s = len(section_table) // 3
+            section_table.extend((string_ids[section_name], len(entry_table) // ENTRY, len(stations)))
+            for stop_id, name in stations:
+                # Station ordinal is the position of the (deduplicated) name along the route
+                ordinal = ordinals.setdefault(name, len(ordinals))
+                entry_table.extend((string_ids[stop_id], string_ids[name], r, s, ordinal))
+
+    n_entries = len(entry_table) // ENTRY
+    by_stop = array("I", sorted(range(n_entries), key=lambda e: entry_table[e * ENTRY]))
+
+    header = HEADER.pack(MAGIC, VERSION, json_size, json_mtime_ns, len(strings), len(blob),
+                         len(route_table) // 3, len(section_table) // 3, n_entries)
+    return b"".join((header, offsets.tobytes(), bytes(blob), route_table.tobytes(),
+                     section_table.tobytes(), entry_table.tobytes(), by_stop.tobytes()))
+
+def build_index(json_path: str = DEFAULT_JSON_PATH, index_path: Optional[str] = None) -> bytes:
+    # Compile the station JSON and write the index next to it (atomically); returns the bytes
+    index_path = index_path or default_index_path(json_path)
+    st = os.stat(json_path)
+    with open(json_path, "r") as f:
+        station_data = json.load(f, object_pairs_hook=OrderedDict)
+    data = compile_index(station_data, st.st_size, st.st_mtime_ns)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # Read-only checkout: fall back to the in-memory index
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return data
+
+class StationIndex():
+    def __init__(self, buffer) -> None:
+        self._buffer = buffer
+        view = memoryview(buffer)
+        (magic, version, self.json_size, self.json_mtime_ns, n_strings, blob_len,
+         n_routes, n_sections, n_entries) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a station index (or built by another version)")
+        size = HEADER.size + (n_strings + 1) * 4 + blob_len + (n_routes * 3 + n_sections * 3 + n_entries * (ENTRY + 1)) * 4
+        if view.nbytes != size:
+            raise ValueError(f"station index is {view.nbytes} bytes, its header describes {size}")
+
+        def table(offset: int, count: int):
+            return view[offset:offset + count * 4].cast("I"), offset + count * 4
+
+        offset = HEADER.size
+        self._offsets, offset = table(offset, n_strings + 1)
+        self._blob = view[offset:offset + blob_len]
+        offset += blob_len
+        self._routes, offset = table(offset, n_routes * 3)
+        self._sections, offset = table(offset, n_sections * 3)
+        self._entries, offset = table(offset, n_entries * ENTRY)
+        self._by_stop, offset = table(offset, n_entries)
+        self._n_strings = n_strings
+        self._route_ids = {self.string(self._routes[i * 3]): i for i in range(n_routes)}
+
+    @classmethod
+    def open(cls, json_path: str = DEFAULT_JSON_PATH, index_path: Optional[str] = None) -> "StationIndex":
+        # Memory-map the compiled index, rebuilding it first if the JSON has changed since
+        index_path = index_path or default_index_path(json_path)
+        st = os.stat(json_path)
+        mm = None
+        try:
+            with open(index_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Freshness is read straight off the header so a stale map has no views to release
+            json_size, json_mtime_ns = HEADER.unpack_from(mm, 0)[2:4]
+            if json_size == st.st_size and json_mtime_ns == st.st_mtime_ns:
+                return cls(mm)
+        except (OSError, ValueError, struct.error):
+            pass
+        # Out here the views of a failed cls(mm) are gone with the traceback
+        if mm is not None:
+            mm.close()
+        return cls(build_index(json_path, index_path))
+
+    def string(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def string_id(self, s: str) -> Optional[int]:
+        # Interned strings are sorted, so lookups are a binary search over the table
+        lo, hi = 0, self._n_strings
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(mid) < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self._n_strings and self.string(lo) == s else None
+
+    def routes(self) -> List[str]:
+        return list(self._route_ids)
+
+    def _sections_of(self, route: str):
+        r = self._route_ids.get(route)
+        if r is None:
+            return range(0)
+        first, count = self._routes[r * 3 + 1], self._routes[r * 3 + 2]
+        return range(first, first + count)
+
+    def route_data(self, route: str) -> "OrderedDict[str, OrderedDict[str, str]]":
+        # Same shape as the route's entry in mta_subway_stations.json
+        route_data = OrderedDict()
+        for s in self._sections_of(route):
+            stations = route_data.setdefault(self.string(self._sections[s * 3]), OrderedDict())
+            first, count = self._sections[s * 3 + 1], self._sections[s * 3 + 2]
+            for e in range(first * ENTRY, (first + count) * ENTRY, ENTRY):
+                stations[self.string(self._entries[e])] = self.string(self._entries[e + 1])
+        return route_data
+
+    def route_tables(self, route: str) -> Tuple[OrderedDict, OrderedDict, Dict[str, str], Dict[str, int], List[str], Dict[str, str]]:
+        # route_data, stop_id_to_name, stop_id_to_section, name_to_index, station_names, section_endpoints
+        route_data = OrderedDict()
+        stop_id_to_name = OrderedDict()
+        stop_id_to_section = {}
+        name_to_index = {}
+        section_endpoints = {}
+        for s in self._sections_of(route):
+            section_name = self.string(self._sections[s * 3])
+            stations = route_data.setdefault(section_name, OrderedDict())
+            first, count = self._sections[s * 3 + 1], self._sections[s * 3 + 2]
+            for e in range(first * ENTRY, (first + count) * ENTRY, ENTRY):
+                stop_id = self.string(self._entries[e])
+                name = self.string(self._entries[e + 1])
+                stations[stop_id] = name
+                stop_id_to_name[stop_id] = name
+                stop_id_to_section[stop_id] = section_name
+                name_to_index.setdefault(name, self._entries[e + 4])
+            if stations:
+                # The endpoint of a section is its first station
+                section_endpoints[section_name] = next(iter(stations.values()))
+        station_names = sorted(name_to_index, key=name_to_index.get)
+        return route_data, stop_id_to_name, stop_id_to_section, name_to_index, station_names, section_endpoints
+
+    def _stop_entries(self, stop_id: str) -> List[int]:
+        sid = self.string_id(stop_id)
+        if sid is None:
+            return []
+        entries = self._entries
+        key = lambda e: entries[e * ENTRY]
+        lo = bisect.bisect_left(self._by_stop, sid, key=key)
+        hi = bisect.bisect_right(self._by_stop, sid, lo=lo, key=key)
+        return [e * ENTRY for e in self._by_stop[lo:hi]]
+
+    def lookup(self, stop_id: str) -> List[Tuple[str, str, int]]:
+        # Every (route, section, station ordinal) that serves a base stop_id
+        entries = self._entries
+        return [
+            (self.string(self._routes[entries[e + 2] * 3]), self.string(self._sections[entries[e + 3] * 3]), entries[e + 4])
+            for e in sorted(self._stop_entries(stop_id))
+        ]
+
+    def station_name(self, stop_id: str) -> Optional[str]:
+        found = self._stop_entries(stop_id)
+        return self.string(self._entries[found[0] + 1]) if found else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile mta_subway_stations.json into a memory-mappable station index")
+    parser.add_argument('json', nargs='?', default=DEFAULT_JSON_PATH, help='Station JSON to compile')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Index path (default: next to the JSON, .idx)')
+    args = parser.parse_args()
+
+    data = build_index(args.json, args.output)
+    index = StationIndex(data)
+    print(f"Wrote {args.output or default_index_path(args.json)}: {len(data)} bytes, {len(index.routes())} routes")
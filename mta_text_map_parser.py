@@ -1,181 +1,569 @@
-import requests
-import pandas as pd
-from bs4 import BeautifulSoup
+import argparse
+import csv
+import hashlib
+import io
 import json
+import os
+import re
+import threading
 import time
-import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 base_url = "https://www.mta.info"
 subway_map_url = "https://www.mta.info/maps/subway-line-maps"
 
-# Download MTA_Subway_Stations from NY Open Data as CSV
+# MTA_Subway_Stations from NY Open Data as CSV
 csv_url = "https://data.ny.gov/api/v3/views/39hk-dx4f/export.csv?accessType=DOWNLOAD&app_token=bHWsGtRFRP9x8Hl8lYivqM1hQ"
-stations_csv = requests.get(csv_url)
-stations_df = pd.read_csv(io.StringIO(stations_csv.text))
-print(f"Downloaded {len(stations_df)} stations from CSV.")
-
-# Use a session object to persist cookies and headers
-session = requests.Session()
-
-response = session.get(subway_map_url)
-soup = BeautifulSoup(response.content, "html.parser")
-
-# Find all anchor tags whose href attribute starts with the specified path
-subway_line_links = soup.select('a[href^="/maps/subway-line-maps/"], a[href^="https://new.mta.info/maps/subway-line-maps/"]')
-
-all_lines_data = {} # Dictionary to store all scraped data
-processed_urls = []
-
-# Process and normalize URLs before scraping
-for link in subway_line_links:
-    href = link.get('href')
-    # Get the part of the URL after the domain
-    path_part = href.split('/maps/subway-line-maps/')[1]
-    # Construct the URL with 'new.mta.info' and lowercase line identifier
-    normalized_url = f"https://new.mta.info/maps/subway-line-maps/{path_part.lower()}"
-    if normalized_url not in processed_urls:
-        processed_urls.append(normalized_url)
-
-# Print the extracted line identifiers
-print(f"{len(processed_urls)} Line URLs found and normalized.")
-
-# Visit each link and scrape the station data
-for page_url in processed_urls:
-    session.cookies.clear() 
-    page_response = None
-    for attempt in range(5):
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mta_map_cache")
+# Bump when parse_line_page changes so cached parse results are recomputed
+PARSER_VERSION = 1
+
+class CacheMiss(Exception):
+    pass
+
+class HttpCache():
+    # On-disk HTTP response cache: per URL a body file and a JSON metadata file holding
+    # the validators (ETag / Last-Modified) and the body's sha1. Revalidation is a
+    # conditional GET; a 304 serves the cached body. Offline, only the cache is read.
+    # Parse results derived from a body are cached alongside, keyed by its sha1.
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, offline: bool = False, retries: int = 4, timeout: float = 30.0) -> None:
+        self.directory = directory
+        self.offline = offline
+        self.retries = retries
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def _session(self) -> requests.Session:
+        # One session per worker thread; requests.Session is not safe to share
+        session = getattr(self._local, "session", None)
+        if session is None:
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                respect_retry_after_header=True,
+            )
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            self._local.session = session
+        return session
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + suffix)
+
+    def _write(self, path: str, data: bytes) -> None:
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def meta(self, url: str) -> dict:
+        try:
+            with open(self._path(url, ".json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def cached(self, url: str) -> bytes:
+        try:
+            with open(self._path(url, ".body"), "rb") as f:
+                return f.read()
+        except OSError:
+            raise CacheMiss(f"{url} is not in the cache at {self.directory}")
+
+    def get(self, url: str) -> bytes:
+        if self.offline:
+            return self.cached(url)
+
+        meta = self.meta(url)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        session = self._session()
+        # The MTA site serves stale or blocked pages to clients that carry its cookies over
+        session.cookies.clear()
+        response = session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            try:
+                return self.cached(url)
+            except CacheMiss:
+                response = session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+
+        body = response.content
+        self._write(self._path(url, ".body"), body)
+        self._write(self._path(url, ".json"), json.dumps({
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha1": hashlib.sha1(body).hexdigest(),
+            "fetched": time.time(),
+        }).encode("utf-8"))
+        return body
+
+    def parsed(self, url: str, body: bytes, parse):
+        # parse(body), reusing the cached result while the body (and parser) are unchanged
+        key = f"{PARSER_VERSION}:{hashlib.sha1(body).hexdigest()}"
+        path = self._path(url, ".parsed.json")
         try:
-            page_response = session.get(page_url)
-            page_response.raise_for_status()
-            break
-        except requests.exceptions.RequestException as e:
-            print(f"Attempt {attempt + 1} failed for {page_url}: {e}")
-            if attempt < 4:
-                time.sleep(1)
-            else:
-                print(f"Could not process {page_url} after 5 attempts.")
-    
-    if not page_response or not page_response.ok:
-        continue
-
-    page_soup = BeautifulSoup(page_response.content, "html.parser")
-    
+            with open(path, "r") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return cached["value"]
+        except (OSError, ValueError):
+            pass
+        value = parse(body)
+        self._write(path, json.dumps({"key": key, "value": value}).encode("utf-8"))
+        return value
+
+def line_urls(index_html: bytes) -> list:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(index_html, "html.parser")
+
+    # Find all anchor tags whose href attribute starts with the specified path
+    subway_line_links = soup.select('a[href^="/maps/subway-line-maps/"], a[href^="https://new.mta.info/maps/subway-line-maps/"]')
+
+    processed_urls = []
+    # Process and normalize URLs before scraping
+    for link in subway_line_links:
+        href = link.get('href')
+        # Get the part of the URL after the domain
+        path_part = href.split('/maps/subway-line-maps/')[1]
+        # Construct the URL with 'new.mta.info' and lowercase line identifier
+        normalized_url = f"https://new.mta.info/maps/subway-line-maps/{path_part.lower()}"
+        if normalized_url not in processed_urls:
+            processed_urls.append(normalized_url)
+    return processed_urls
+
+def line_name(page_url: str) -> str:
     # Extract the train line name (e.g., '6' or '6X')
     train_line = page_url.split('/')[-1].upper()
-    train_line = train_line.replace('-LINE', '').strip()
+    return train_line.replace('-LINE', '').strip()
+
+def parse_line_page(html: bytes) -> list:
+    # [(section title, [station names in page order])] for every station table on a line page
+    from bs4 import BeautifulSoup
+    page_soup = BeautifulSoup(html, "html.parser")
+    sections = []
+    for section in page_soup.select('div.mta-table'):
+        title_element = section.find('h2')
+        if not title_element:
+            continue
+        title = title_element.text.strip()
+        names = []
+        for row in section.select('tbody tr'):
+            station_cell = row.find('td')
+            if station_cell:
+                station_name = station_cell.text.strip()
+                if station_name:
+                    names.append(station_name)
+        sections.append((title, names))
+    return sections
+
+class NameRule(NamedTuple):
+    # Replace `old` with `new` unless the name (as normalized so far) contains any of
+    # `unless` or ends with `unless_suffix`
+    old: str
+    new: str
+    unless: Tuple[str, ...] = ()
+    unless_suffix: Optional[str] = None
+
+# Map-page spellings -> NY Open Data 'Stop Name' spellings, applied in order
+NAME_RULES = (
+    NameRule('Square', 'Sq'),
+    NameRule('Parkway', 'Pkwy'),
+    NameRule('Heights', 'Hts'),
+    NameRule('Ave', 'Av'),
+    NameRule('Pk', 'Park', unless=('Pkwy',)),
+    NameRule('North', 'N', unless=('Northern',)),
+    NameRule('South', 'S', unless=('Southern',)),
+    NameRule('West', 'W', unless=('Western', 'Westchester', 'West Farms')),
+    NameRule('East', 'E', unless=('Eastern',), unless_suffix=' East'),
+    NameRule("E 143 St-Mary's St", "E 143 St-St Mary's St"),
+    NameRule('St/Port', 'St-Port'),
+    NameRule('Washington Sq', 'Wash Sq'),
+    NameRule('Boulevard', 'Blvd'),
+    NameRule('Bryant Park', 'Bryant Pk'),
+    NameRule('4-', '4 St-'),
+    NameRule('Bay-50', 'Bay 50'),
+    NameRule('Sts Rockefeller', 'Sts-Rockefeller'),
+    NameRule('Myrtle Willoughby', 'Myrtle-Willoughby'),
+    NameRule('4 Av-9 Sts', '4 Av-9 St'),
+    NameRule('Astoria Ditmars Blvd', 'Astoria-Ditmars Blvd'),
+    NameRule('57-7 Av', '57 St-7 Av'),
+    NameRule('Delancey St Essex St', 'Delancey St-Essex St'),
+    NameRule('Beverly Rd', 'Beverley Rd'),
+    NameRule('Park Place', 'Park Pl'),
+)
+
+# Section titles name a borough; the CSV 'Borough' column uses these codes
+SECTION_BOROUGHS = (('Bronx', 'Bx'), ('Manhattan', 'M'), ('Brooklyn', 'Bk'), ('Queens', 'Q'), ('Staten Island', 'SI'))
+
+# Bump when StationMatcher's steps change
+MATCHER_VERSION = 2
+
+# Identifies the parse + match logic in the manifest; lines are re-matched when it changes
+MATCHER_KEY = hashlib.sha1(repr((PARSER_VERSION, MATCHER_VERSION, NAME_RULES, SECTION_BOROUGHS)).encode("utf-8")).hexdigest()[:12]
+
+def normalize_name(name: str) -> str:
+    for rule in NAME_RULES:
+        if any(word in name for word in rule.unless) or (rule.unless_suffix and name.endswith(rule.unless_suffix)):
+            continue
+        name = name.replace(rule.old, rule.new)
+    return name
+
+def _tokens(name: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", name.lower())
+
+def section_boroughs(title: str) -> Set[str]:
+    return {code for word, code in SECTION_BOROUGHS if word.lower() in title.lower()}
 
+@dataclass
+class Ambiguity:
+    line: str
+    section: str
+    station_name: str
+    step: str
+    candidates: List[Tuple[str, str]]
+    chosen: str
+
+class StationMatcher():
+    # Indexes built once from the stations CSV: exact 'Stop Name' -> rows, route ->
+    # rows serving it, and token prefix -> rows for partial names. Each lookup is a few
+    # dict/set operations instead of DataFrame scans. The match steps are unchanged:
+    # exact name, normalized name, then partial name, each among the rows whose
+    # 'Daytime Routes' contains the line as a substring (as str.contains did, so 'S'
+    # also selects 'SIR' rows), and the first CSV row of a step's matches is used. With prefer_borough, the
+    # borough named in the page section breaks ties first (this can pick a different
+    # stop than before, so it is opt-in).
+    def __init__(self, rows: Iterable[dict], prefer_borough: bool = False) -> None:
+        self.prefer_borough = prefer_borough
+        self.stops: List[Tuple[str, str, str]] = []
+        self.by_name: Dict[str, List[int]] = {}
+        self.routes: List[str] = []
+        # route -> rows, filled per route on first use
+        self.by_route: Dict[str, Set[int]] = {}
+        self.by_prefix: Dict[str, Set[int]] = {}
+        self.ambiguities: List[Ambiguity] = []
+        for row in rows:
+            i = len(self.stops)
+            stop_id, name = row['GTFS Stop ID'], row['Stop Name']
+            self.stops.append((stop_id, name, row.get('Borough') or ''))
+            self.by_name.setdefault(name, []).append(i)
+            self.routes.append(row.get('Daytime Routes') or '')
+            for token in _tokens(name):
+                for end in range(1, len(token) + 1):
+                    self.by_prefix.setdefault(token[:end], set()).add(i)
+
+    @classmethod
+    def from_csv(cls, data: bytes, prefer_borough: bool = False) -> "StationMatcher":
+        return cls(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))), prefer_borough)
+
+    @property
+    def key(self) -> str:
+        # MATCHER_KEY plus the options that change what is chosen
+        return MATCHER_KEY + ("+borough" if self.prefer_borough else "")
+
+    def __len__(self) -> int:
+        return len(self.stops)
+
+    def members(self, route: str) -> Set[int]:
+        # Rows whose 'Daytime Routes' field contains `route`
+        rows = self.by_route.get(route)
+        if rows is None:
+            rows = self.by_route[route] = {i for i, routes in enumerate(self.routes) if route in routes}
+        return rows
+
+    def route_digest(self, route: str) -> str:
+        # Hash of the CSV rows a line can match against; a line only needs re-matching
+        # when this (or its page) changes
+        digest = hashlib.sha1()
+        for i in sorted(self.members(route)):
+            digest.update("\x1f".join(self.stops[i]).encode("utf-8") + b"\x1e")
+        return digest.hexdigest()
+
+    def _partial(self, station_name: str, members: Set[int]) -> List[int]:
+        # Rows whose name contains station_name, exactly as a substring scan would find
+        # them. The first token may start mid-word in a row's name ('ton Av' in
+        # 'Washington Av'), but every later token follows the same separator in both names,
+        # so it starts a token there: only those narrow by prefix, then the substring
+        # check verifies. A one-token name scans the route's rows.
+        candidates = set(members)
+        for token in sorted(_tokens(station_name)[1:], key=len, reverse=True):
+            candidates &= self.by_prefix.get(token, set())
+            if not candidates:
+                return []
+        return sorted(i for i in candidates if station_name in self.stops[i][1])
+
+    def candidates(self, station_name: str, route: str) -> Tuple[str, List[int]]:
+        # (step, CSV rows in file order) from the first step that finds anything
+        members = self.members(route)
+        rows = [i for i in self.by_name.get(station_name, ()) if i in members]
+        if rows:
+            return 'exact', rows
+        rows = [i for i in self.by_name.get(normalize_name(station_name), ()) if i in members]
+        if rows:
+            return 'normalized', rows
+        return 'partial', self._partial(station_name, members)
+
+    def match(self, station_name: str, route: str, line: str = '', section: str = '') -> str:
+        step, rows = self.candidates(station_name, route)
+        if not rows:
+            raise ValueError(f"Station '{station_name}' for line {line or route} not found in CSV.")
+        if len(rows) > 1 and self.prefer_borough:
+            # Prefer the borough the page section is in; otherwise keep CSV order and report it
+            boroughs = section_boroughs(section)
+            in_borough = [i for i in rows if self.stops[i][2] in boroughs]
+            if in_borough:
+                rows = in_borough
+        if len(rows) > 1:
+            self.ambiguities.append(Ambiguity(
+                line or route, section, station_name, step,
+                [(self.stops[i][0], self.stops[i][1]) for i in rows], self.stops[rows[0]][0]))
+        return self.stops[rows[0]][0]
+
+def load_stations(cache: HttpCache, prefer_borough: bool = False) -> StationMatcher:
+    matcher = StationMatcher.from_csv(cache.get(csv_url), prefer_borough)
+    print(f"Loaded {len(matcher)} stations from CSV.")
+    return matcher
+
+def build_line(train_line: str, sections: list, matcher: StationMatcher) -> dict:
     # Create lookup for CSV: '6X' -> '6', '7X' -> '7'
     lookup_line = train_line[:-1] if 'X' in train_line else train_line
-    
-    print(f"--- Scraping {train_line} Line ---")
-    all_lines_data[train_line] = {}
 
-    table_sections = page_soup.select('div.mta-table')
+    line_data = {}
+    for title, names in sections:
+        stations = {}
+        for station_name in names:
+            stations[matcher.match(station_name, lookup_line, train_line, title)] = station_name
+        if title and stations:
+            line_data[title] = stations
+    return line_data
 
-    for section in table_sections:
-        title_element = section.find('h2')
-        if title_element:
-            title = title_element.text.strip()
-            stations = {}
-
-            rows = section.select('tbody tr')
-            for row in rows:
-                station_cell = row.find('td')
-                if station_cell:
-                    station_name = station_cell.text.strip()
-                    if station_name:
-                        # --- STEP 1: Exact Match + Route Filter ---
-                        mask = (stations_df['Stop Name'] == station_name) & \
-                               (stations_df['Daytime Routes'].str.contains(lookup_line, na=False))
-                        gtfs_stop_id = stations_df[mask]['GTFS Stop ID'].values
-
-                        # --- STEP 2: If failed, try Transformations + Route Filter ---
-                        if not gtfs_stop_id.size > 0:
-                            alt_name = station_name
-                            alt_name = alt_name.replace('Square', 'Sq').replace('Parkway', 'Pkwy')
-                            alt_name = alt_name.replace('Heights', 'Hts').replace('Ave', 'Av')
-                            if 'Pkwy' not in alt_name:
-                                alt_name = alt_name.replace('Pk', 'Park')
-                            if 'Northern' not in alt_name:
-                                alt_name = alt_name.replace('North', 'N')
-                            if 'Southern' not in alt_name:
-                                alt_name = alt_name.replace('South', 'S')
-                            if 'Western' not in alt_name and 'Westchester' not in alt_name and 'West Farms' not in alt_name:
-                                alt_name = alt_name.replace('West', 'W')
-                            if 'Eastern' not in alt_name and not alt_name.endswith(' East'):
-                                alt_name = alt_name.replace('East', 'E')
-                            alt_name = alt_name.replace("E 143 St-Mary's St", "E 143 St-St Mary's St")
-                            alt_name = alt_name.replace('St/Port', 'St-Port').replace('Washington Sq', 'Wash Sq')
-                            alt_name = alt_name.replace('Boulevard', 'Blvd').replace('Bryant Park', 'Bryant Pk')
-                            alt_name = alt_name.replace('4-', '4 St-').replace('Bay-50', 'Bay 50')
-                            alt_name = alt_name.replace('Sts Rockefeller', 'Sts-Rockefeller')
-                            alt_name = alt_name.replace('Myrtle Willoughby', 'Myrtle-Willoughby')
-                            alt_name = alt_name.replace('4 Av-9 Sts', '4 Av-9 St')
-                            alt_name = alt_name.replace('Astoria Ditmars Blvd', 'Astoria-Ditmars Blvd')
-                            alt_name = alt_name.replace('57-7 Av', '57 St-7 Av')
-                            alt_name = alt_name.replace('Delancey St Essex St', 'Delancey St-Essex St')
-                            alt_name = alt_name.replace('Beverly Rd', 'Beverley Rd')
-                            alt_name = alt_name.replace('Park Place', 'Park Pl')
-
-                            alt_mask = (stations_df['Stop Name'] == alt_name) & \
-                                       (stations_df['Daytime Routes'].str.contains(lookup_line, na=False))
-                            gtfs_stop_id = stations_df[alt_mask]['GTFS Stop ID'].values
-
-                        # --- STEP 3: If still failed, try Partial Match + Route Filter ---
-                        if not gtfs_stop_id.size > 0:
-                            partial_mask = (stations_df['Stop Name'].str.contains(station_name, na=False)) & \
-                                           (stations_df['Daytime Routes'].str.contains(lookup_line, na=False))
-                            gtfs_stop_id = stations_df[partial_mask]['GTFS Stop ID'].values
-
-                        # --- STEP 4: Final Assignment ---
-                        if gtfs_stop_id.size > 0:
-                            # Use index 0. Because of our route filter, this is safe.
-                            stations[gtfs_stop_id[0]] = station_name
-                        else:
-                            # Only raise error if ALL three methods above found nothing
-                            raise ValueError(f"Station '{station_name}' for line {train_line} not found in CSV.")
-
-            if title and stations:
-                all_lines_data[train_line][title] = stations
-
-# Hardcode data for the Staten Island Railway (SIR)
-si_stations_ordered = {
-    "S09": "Tottenville",
-    "S11": "Arthur Kill",
-    "S13": "Richmond Valley",
-    "S14": "Pleasant Plains",
-    "S15": "Prince's Bay",
-    "S16": "Huguenot",
-    "S17": "Annadale",
-    "S18": "Eltingville",
-    "S19": "Great Kills",
-    "S20": "Bay Terrace",
-    "S21": "Oakwood Heights",
-    "S22": "New Dorp",
-    "S23": "Grant City",
-    "S24": "Jefferson Av",
-    "S25": "Dongan Hills",
-    "S26": "Old Town",
-    "S27": "Grasmere",
-    "S28": "Clifton",
-    "S29": "Stapleton",
-    "S30": "Tompkinsville",
-    "S31": "St George",
-}
-
-# Reverse the dictionary order as requested
-reversed_si_stations = dict(reversed(list(si_stations_ordered.items())))
-
-# Add the SI line data to the main dictionary
-all_lines_data["SI"] = {
-    "Staten Island stations": reversed_si_stations
-}
-print("--- Adding SIR Line ---")
-
-print("\n--- All data collected ---")
-# Pretty-print the final dictionary
-# print(json.dumps(all_lines_data, indent=2))
-# Save the data to a JSON file
-with open("mta_subway_stations.json", "w") as json_file:
-    json.dump(all_lines_data, json_file, indent=2)
-print("Data saved to mta_subway_stations.json")
\ No newline at end of file
+
+def sir_stations() -> dict:
+    # Hardcode data for the Staten Island Railway (SIR)
+    si_stations_ordered = {
+        "S09": "Tottenville",
+        "S11": "Arthur Kill",
+        "S13": "Richmond Valley",
+        "S14": "Pleasant Plains",
+        "S15": "Prince's Bay",
+        "S16": "Huguenot",
+        "S17": "Annadale",
+        "S18": "Eltingville",
+        "S19": "Great Kills",
+        "S20": "Bay Terrace",
+        "S21": "Oakwood Heights",
+        "S22": "New Dorp",
+        "S23": "Grant City",
+        "S24": "Jefferson Av",
+        "S25": "Dongan Hills",
+        "S26": "Old Town",
+        "S27": "Grasmere",
+        "S28": "Clifton",
+        "S29": "Stapleton",
+        "S30": "Tompkinsville",
+        "S31": "St George",
+    }
+    # Reverse the dictionary order as requested
+    return {"Staten Island stations": dict(reversed(list(si_stations_ordered.items())))}
+
+def fetch_line(cache: HttpCache, page_url: str) -> Tuple[str, list]:
+    # Runs in a worker thread: fetch (or revalidate) and parse one line page. The hash
+    # is of the parsed station tables, not the body, so markup that changes on every
+    # request (nonces, build stamps, ads) doesn't make the line look changed
+    body = cache.get(page_url)
+    sections = cache.parsed(page_url, body, parse_line_page)
+    return hashlib.sha1(json.dumps(sections).encode("utf-8")).hexdigest(), sections
+
+def build_stations(cache: HttpCache, workers: int = 6, previous: Optional[dict] = None,
+                   manifest: Optional[dict] = None, prefer_borough: bool = False) -> Tuple[dict, dict, Set[str]]:
+    # Line pages are fetched and parsed concurrently while the CSV loads; station
+    # matching runs on the main thread as each page arrives. Output keeps page order.
+    # With the previous JSON and its manifest, a line whose page hash, matched CSV rows
+    # and matcher are all unchanged is reused as-is instead of being re-matched.
+    # Returns (lines, new manifest, lines that could not be fetched).
+    previous = previous or {}
+    old_sources = (manifest or {}).get("lines", {})
+    sources = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="map-scrape") as executor:
+        stations_future = executor.submit(load_stations, cache, prefer_borough)
+        processed_urls = cache.parsed(subway_map_url, cache.get(subway_map_url), line_urls)
+        print(f"{len(processed_urls)} Line URLs found and normalized.")
+
+        futures = {executor.submit(fetch_line, cache, page_url): page_url for page_url in processed_urls}
+        matcher = stations_future.result()
+
+        lines, failed = {}, set()
+        for future in as_completed(futures):
+            page_url = futures[future]
+            train_line = line_name(page_url)
+            try:
+                page_hash, sections = future.result()
+            except (requests.exceptions.RequestException, CacheMiss) as e:
+                print(f"Could not process {page_url}: {e}")
+                failed.add(train_line)
+                if train_line in old_sources:
+                    sources[train_line] = old_sources[train_line]
+                continue
+            lookup_line = train_line[:-1] if 'X' in train_line else train_line
+            source = {"url": page_url, "page": page_hash, "csv": matcher.route_digest(lookup_line), "matcher": matcher.key}
+            sources[train_line] = source
+            if train_line in previous and old_sources.get(train_line) == source:
+                lines[page_url] = (train_line, previous[train_line])
+                continue
+            print(f"--- Scraping {train_line} Line ---")
+            lines[page_url] = (train_line, build_line(train_line, sections, matcher))
+
+    all_lines_data = {}
+    for page_url in processed_urls:
+        if page_url in lines:
+            train_line, line_data = lines[page_url]
+            all_lines_data[train_line] = line_data
+
+    si = sir_stations()
+    sources["SI"] = {"static": hashlib.sha1(json.dumps(si).encode("utf-8")).hexdigest()}
+    if "SI" in previous and old_sources.get("SI") == sources["SI"]:
+        all_lines_data["SI"] = previous["SI"]
+    else:
+        print("--- Adding SIR Line ---")
+        all_lines_data["SI"] = si
+
+    if matcher.ambiguities:
+        print(f"\n--- {len(matcher.ambiguities)} ambiguous station matches (first candidate used) ---")
+        for a in matcher.ambiguities:
+            options = ", ".join(f"{stop_id} '{name}'" for stop_id, name in a.candidates)
+            print(f"{a.line} / {a.section}: '{a.station_name}' ({a.step}) -> {a.chosen} of {options}")
+    return all_lines_data, {"version": 1, "matcher": matcher.key, "lines": sources}, failed
+
+def merge_stations(previous: dict, lines: dict, failed: Set[str]) -> dict:
+    # Existing lines keep their place (and failed fetches keep their old data); lines
+    # no longer on the site are dropped and new ones are appended in page order
+    merged = {}
+    for train_line, line_data in previous.items():
+        if train_line in lines:
+            merged[train_line] = lines[train_line]
+        elif train_line in failed:
+            merged[train_line] = line_data
+    for train_line, line_data in lines.items():
+        merged.setdefault(train_line, line_data)
+    return merged
+
+def _station_places(line_data: dict) -> Dict[str, Tuple[str, str]]:
+    return {stop_id: (section, name) for section, stations in line_data.items() for stop_id, name in stations.items()}
+
+def affected_routes(train_line: str, sections: Iterable[str]) -> List[str]:
+    # Feed route ids whose station tables depend on a line. Shuttles live as sections
+    # of 'S', which is not a feed route: a changed section maps to its shuttle, and a
+    # section no shuttle is known by (added or renamed) to all of them
+    from mta_station_index import shuttle_sections
+    if train_line == 'S':
+        sections = set(sections)
+        return [route for route, section in shuttle_sections.items() if section in sections] or list(shuttle_sections)
+    return [train_line]
+
+def diff_stations(previous: dict, current: dict) -> dict:
+    # Per changed line: stations added / removed / renamed / moved between sections,
+    # sections added / removed, whether order changed, and the route ids to invalidate
+    changes = {}
+    for train_line in list(previous) + [l for l in current if l not in previous]:
+        old, new = previous.get(train_line, {}), current.get(train_line, {})
+        if json.dumps(old) == json.dumps(new):
+            continue
+        old_places, new_places = _station_places(old), _station_places(new)
+        change = {
+            "added": [{"stop_id": s, "section": new_places[s][0], "name": new_places[s][1]} for s in new_places if s not in old_places],
+            "removed": [{"stop_id": s, "section": old_places[s][0], "name": old_places[s][1]} for s in old_places if s not in new_places],
+            "renamed": [{"stop_id": s, "old": old_places[s][1], "new": new_places[s][1]}
+                        for s in new_places if s in old_places and old_places[s][1] != new_places[s][1]],
+            "moved": [{"stop_id": s, "old_section": old_places[s][0], "new_section": new_places[s][0]}
+                      for s in new_places if s in old_places and old_places[s][0] != new_places[s][0]],
+            "sections_added": [section for section in new if section not in old],
+            "sections_removed": [section for section in old if section not in new],
+            "reordered": [s for s in old_places if s in new_places] != [s for s in new_places if s in old_places]
+                         or [t for t in old if t in new] != [t for t in new if t in old],
+        }
+        touched = {section for section in old.keys() | new.keys() if list(old.get(section, {}).items()) != list(new.get(section, {}).items())}
+        change["routes"] = affected_routes(train_line, touched)
+        changes[train_line] = change
+    return {"lines": changes, "routes": sorted({route for change in changes.values() for route in change["routes"]})}
+
+def print_diff(diff: dict) -> None:
+    if not diff["lines"]:
+        print("No station changes.")
+        return
+    for train_line, change in diff["lines"].items():
+        counts = [f"{len(change[key])} {key}" for key in ("added", "removed", "renamed", "moved") if change[key]]
+        if change["sections_added"] or change["sections_removed"]:
+            counts.append(f"sections +{len(change['sections_added'])} -{len(change['sections_removed'])}")
+        if change["reordered"]:
+            counts.append("reordered")
+        print(f"{train_line}: {', '.join(counts) or 'changed'}")
+    print(f"Routes to invalidate: {', '.join(diff['routes'])}")
+
+def _load_json(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path: str, data: dict) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Rebuild mta_subway_stations.json from the MTA line maps and the NY Open Data station list")
+    parser.add_argument('-o', '--output', type=str, default="mta_subway_stations.json", help='Output JSON path')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR, help='On-disk HTTP response cache')
+    parser.add_argument('--from-cache', action='store_true', help='Rebuild offline from cached pages and CSV only')
+    parser.add_argument('-j', '--workers', type=int, default=6, help='Concurrent page fetches')
+    parser.add_argument('--full', action='store_true', help='Re-match every line even if its sources are unchanged')
+    parser.add_argument('--prefer-section-borough', action='store_true', help="When a name matches several stops on a line, prefer the one in the borough its page section names (default: the first CSV row)")
+    parser.add_argument('--diff', type=str, default=None, metavar='PATH', help='Write the station changes as JSON to PATH')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    # Source hashes for the current output live next to it
+    manifest_path = os.path.splitext(args.output)[0] + ".manifest.json"
+    previous = _load_json(args.output)
+    manifest = {} if args.full else _load_json(manifest_path)
+
+    cache = HttpCache(args.cache_dir, offline=args.from_cache)
+    try:
+        lines, manifest, failed = build_stations(cache, max(1, args.workers), previous, manifest, args.prefer_section_borough)
+    except CacheMiss as e:
+        parser.exit(1, f"{e}; run once without --from-cache to populate it\n")
+
+    print("\n--- All data collected ---")
+    all_lines_data = merge_stations(previous, lines, failed)
+    diff = diff_stations(previous, all_lines_data)
+    print_diff(diff)
+    if args.diff:
+        _write_json(args.diff, diff)
+
+    # Leave the JSON (and its mtime, which keys the station index) alone when nothing changed
+    if diff["lines"] or not os.path.exists(args.output):
+        _write_json(args.output, all_lines_data)
+        print(f"Data saved to {args.output}")
+    _write_json(manifest_path, manifest)
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from mta_columnar import DIRECTION_NORTH, DIRECTION_SOUTH, DIRECTION_UNKNOWN, route_codes
+from mta_rail import TrainGetter, bucket_feed, route_ids
+
+if TYPE_CHECKING:
+    from google.transit import gtfs_realtime_pb2
+
+# Where a trip is at a given time relative to its predicted stops
+BEFORE_FIRST = 0   # not yet at its first predicted stop (approaching it)
+AT_STOP = 1        # between arrival and departure at a stop
+BETWEEN = 2        # travelling between two stops
+FINISHED = 3       # past its last predicted stop
+UNKNOWN = 4        # no timed stops to place it by
+STATE_NAMES = ("approaching", "at", "between", "finished", "unknown")
+
+@dataclass
+class StopETAs:
+    # Trips due at one stop, soonest first
+    trips: np.ndarray
+    arrival: np.ndarray
+    eta: np.ndarray
+
+@dataclass
+class TripPositions:
+    # One entry per trip row. `position` is a fractional station index along the
+    # route's name_to_index ordering (NaN when a stop is not in the station data);
+    # prev/next are stop rows (-1 when there is none).
+    position: np.ndarray
+    fraction: np.ndarray
+    state: np.ndarray
+    prev_stop: np.ndarray
+    next_stop: np.ndarray
+
+@dataclass
+class TripProjection:
+    # Every predicted stop of every trip, not just the next one. Trip rows hold
+    # per-trip columns; stop rows are grouped by trip in predicted order, so trip i's
+    # stops are rows offsets[i]:offsets[i + 1] of the stop columns.
+    trip_ids: List[str]
+    # Stop code -> base stop_id, and back
+    stop_table: List[str]
+    stop_codes: Dict[str, int]
+    route: np.ndarray
+    direction: np.ndarray
+    offsets: np.ndarray
+    stop_trip: np.ndarray
+    stop: np.ndarray
+    ordinal: np.ndarray
+    arrival: np.ndarray
+    departure: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.trip_ids)
+
+    def stop_code(self, stop_id: str) -> int:
+        return self.stop_codes.get(stop_id, -1)
+
+    def etas_to(self, stop_id: str, now: Optional[float] = None) -> StopETAs:
+        # Every trip still due at `stop_id` (base ID, or with an N/S suffix for one
+        # direction), with its predicted arrival and seconds until then
+        if now is None:
+            now = time.time()
+        direction = DIRECTION_UNKNOWN
+        if len(stop_id) > 1 and stop_id[-1] in ('N', 'S'):
+            direction = DIRECTION_NORTH if stop_id[-1] == 'N' else DIRECTION_SOUTH
+            stop_id = stop_id[:-1]
+        code = self.stop_code(stop_id)
+        mask = (self.stop == code) & (self.arrival >= now)
+        if direction != DIRECTION_UNKNOWN:
+            mask &= self.direction[self.stop_trip] == direction
+        rows = np.flatnonzero(mask)
+        # A trip that lists the stop twice (loops) is due at the first visit
+        _, first = np.unique(self.stop_trip[rows], return_index=True)
+        rows = rows[first]
+        rows = rows[np.argsort(self.arrival[rows], kind="stable")]
+        arrival = self.arrival[rows]
+        return StopETAs(self.stop_trip[rows], arrival, arrival - now)
+
+    def positions(self, at: Optional[float] = None) -> TripPositions:
+        # Where every trip is at time `at`, interpolated linearly between the departure
+        # from its last passed stop and the arrival at the next one. Relies on each
+        # trip's predicted times being non-decreasing along its stops.
+        if at is None:
+            at = time.time()
+        starts, ends = self.offsets[:-1], self.offsets[1:]
+        counts = ends - starts
+        passed = np.concatenate(([0], np.cumsum(self.arrival <= at)))
+        k = passed[ends] - passed[starts]
+
+        last = max(len(self.stop) - 1, 0)
+        prev_rows = np.clip(starts + k - 1, 0, last)
+        next_rows = np.clip(starts + k, 0, last)
+        before = k == 0
+        past_last = k >= counts
+        if len(self.stop):
+            dwelling = ~before & (self.departure[prev_rows] > at)
+            leave = self.departure[prev_rows].astype(np.float64)
+            reach = self.arrival[next_rows].astype(np.float64)
+            prev_ordinal = self.ordinal[prev_rows].astype(np.float64)
+            next_ordinal = self.ordinal[next_rows].astype(np.float64)
+        else:
+            dwelling = before
+            leave = reach = prev_ordinal = next_ordinal = np.zeros(len(counts))
+        prev_ordinal[prev_ordinal < 0] = np.nan
+        next_ordinal[next_ordinal < 0] = np.nan
+
+        state = np.full(len(counts), BETWEEN, dtype=np.int8)
+        state[past_last] = FINISHED
+        state[dwelling] = AT_STOP
+        state[before] = BEFORE_FIRST
+        empty = counts == 0
+        state[empty] = UNKNOWN
+
+        span = reach - leave
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(span > 0, (at - leave) / span, 1.0)
+        fraction = np.clip(fraction, 0.0, 1.0)
+        fraction[state != BETWEEN] = 0.0
+        position = prev_ordinal + (next_ordinal - prev_ordinal) * fraction
+        position[before] = next_ordinal[before]
+        position[(state == AT_STOP) | (state == FINISHED)] = prev_ordinal[(state == AT_STOP) | (state == FINISHED)]
+        position[empty] = np.nan
+
+        prev_stop = np.where(before | empty, -1, prev_rows)
+        next_stop = np.where(past_last | empty, -1, next_rows)
+        return TripPositions(position, fraction, state, prev_stop, next_stop)
+
+    def route_trips(self, route: str) -> np.ndarray:
+        return np.flatnonzero(self.route == route_codes[route])
+
+def build_projection(feeds: Iterable[Tuple[gtfs_realtime_pb2.FeedMessage, List[str]]], traingetters: Dict[str, TrainGetter]) -> TripProjection:
+    # `feeds` pairs each decoded feed with the routes it should serve. Stops with
+    # neither an arrival nor a departure time are dropped; a missing one of the two
+    # is filled from the other.
+    trip_ids = []
+    route_col, direction_col, offsets = [], [], [0]
+    stop_trip, stop_col, ordinal_col, arrival_col, departure_col = [], [], [], [], []
+    stop_codes: Dict[str, int] = {}
+    intern = stop_codes.setdefault
+
+    for feed, feed_routes in feeds:
+        trip_updates, _ = bucket_feed(feed, feed_routes)
+        for route, bucket in trip_updates.items():
+            stop_lookup = traingetters[route]._stop_lookup
+            code = route_codes[route]
+            for trip_id, tu in bucket.items():
+                row = len(trip_ids)
+                direction = DIRECTION_UNKNOWN
+                for stu in tu.stop_time_update:
+                    arrival_ts = stu.arrival.time
+                    departure_ts = stu.departure.time
+                    if not (arrival_ts or departure_ts):
+                        continue
+                    stop_id = stu.stop_id
+                    if len(stop_id) > 1 and stop_id[-1] in ('N', 'S'):
+                        direction = DIRECTION_NORTH if stop_id[-1] == 'N' else DIRECTION_SOUTH
+                        stop_id = stop_id[:-1]
+                    stop_trip.append(row)
+                    stop_col.append(intern(stop_id, len(stop_codes)))
+                    entry = stop_lookup.get(stop_id)
+                    ordinal_col.append(entry[1] if entry is not None else -1)
+                    arrival_col.append(arrival_ts or departure_ts)
+                    departure_col.append(departure_ts or arrival_ts)
+                trip_ids.append(trip_id)
+                route_col.append(code)
+                direction_col.append(direction)
+                offsets.append(len(stop_col))
+
+    return TripProjection(
+        trip_ids=trip_ids,
+        stop_table=list(stop_codes),
+        stop_codes=stop_codes,
+        route=np.array(route_col, dtype=np.int16),
+        direction=np.array(direction_col, dtype=np.int8),
+        offsets=np.array(offsets, dtype=np.int64),
+        stop_trip=np.array(stop_trip, dtype=np.int32),
+        stop=np.array(stop_col, dtype=np.int32),
+        ordinal=np.array(ordinal_col, dtype=np.int32),
+        arrival=np.array(arrival_col, dtype=np.int64),
+        departure=np.array(departure_col, dtype=np.int64),
+    )
+
+def print_etas(projection: TripProjection, stop_id: str, now: float, limit: int = 20) -> None:
+    from mta_rail import colors, load_station_index
+
+    base = stop_id[:-1] if len(stop_id) > 1 and stop_id[-1] in ('N', 'S') else stop_id
+    name = load_station_index().station_name(base) or stop_id
+    etas = projection.etas_to(stop_id, now)
+    print(f"\033[1;4m{name} ({stop_id})\033[0m")
+    if not len(etas.trips):
+        print("No trains due.")
+    for trip, arrival, eta in zip(etas.trips[:limit].tolist(), etas.arrival[:limit].tolist(), etas.eta[:limit].tolist()):
+        route = route_ids[projection.route[trip]]
+        stamp = time.strftime("%H:%M:%S", time.localtime(arrival))
+        print(colors.get(route, "\033[0m") + f" {route} " + "\033[0m" + f" {projection.trip_ids[trip]:<24s} {stamp}  {int(eta) // 60}m{int(eta) % 60:02d}s")
+
+def print_positions(projection: TripProjection, traingetters: Dict[str, TrainGetter], at: float) -> None:
+    from mta_rail import colors, line_to_long_name
+
+    positions = projection.positions(at)
+    for route, traingetter in traingetters.items():
+        trips = projection.route_trips(route)
+        if not len(trips):
+            continue
+        print(colors.get(route, "\033[0m") + f" {route}: {line_to_long_name.get(route, '')} " + "\033[0m")
+        # Along the line, in station order
+        for trip in trips[np.argsort(positions.position[trips], kind="stable")].tolist():
+            state = positions.state[trip]
+            prev_stop, next_stop = positions.prev_stop[trip], positions.next_stop[trip]
+            prev_name = traingetter.station_id_to_name(projection.stop_table[projection.stop[prev_stop]]) if prev_stop >= 0 else None
+            next_name = traingetter.station_id_to_name(projection.stop_table[projection.stop[next_stop]]) if next_stop >= 0 else None
+            if state == BETWEEN:
+                where = f"{prev_name} -> {next_name} ({positions.fraction[trip]:.0%})"
+            elif state == BEFORE_FIRST:
+                where = f"approaching {next_name}"
+            elif state == UNKNOWN:
+                where = "no predicted stops"
+            else:
+                where = f"{STATE_NAMES[state]} {prev_name}"
+            position = positions.position[trip]
+            index = f"{position:6.2f}" if not np.isnan(position) else "     -"
+            print(f"  {projection.trip_ids[trip]:<24s} {index}  {where}")
+        print()
+
+if __name__ == "__main__":
+    from mta_rail import group_routes_by_url, parse_routes
+
+    parser = argparse.ArgumentParser(description="Project every train along its full predicted trip: ETAs to any stop and interpolated positions")
+    parser.add_argument('path', nargs='?', default=None, help='Recorded feed (text or binary protobuf); fetches the live feeds when omitted')
+    parser.add_argument('-R', '--routes', type=str, default='all', help="Comma-separated routes, or 'all'")
+    parser.add_argument('-s', '--stop', type=str, default=None, metavar='STOP_ID', help='List every train still due at this stop (base ID, or with N/S for one direction) instead of positions')
+    parser.add_argument('--ahead', type=float, default=0.0, metavar='SECONDS', help='Project this many seconds past the feed time')
+    parser.add_argument('--feed-base-url', type=str, default=None, help='Fetch feeds from this base URL instead of the MTA API')
+    args = parser.parse_args()
+
+    try:
+        routes = parse_routes(args.routes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    traingetters = {route: TrainGetter(route) for route in routes}
+    if args.path:
+        from mta_replay import load_feed
+        feed = load_feed(args.path)
+        feeds = [(feed, routes)]
+        now = float(feed.header.timestamp or time.time())
+    else:
+        from mta_feed_fetcher import FeedFetcher
+        groups = group_routes_by_url(routes)
+        with FeedFetcher(base_url=args.feed_base_url) as fetcher:
+            results = fetcher.fetch_all(groups.keys())
+        feeds = []
+        for url, url_routes in groups.items():
+            if results[url].ok:
+                feeds.append((results[url].feed, url_routes))
+            else:
+                print(f"Error fetching data for {', '.join(url_routes)}: {results[url].error}")
+        now = time.time()
+
+    started = time.perf_counter()
+    projection = build_projection(feeds, traingetters)
+    print(f"{len(projection)} trips, {len(projection.stop)} predicted stops ({(time.perf_counter() - started) * 1000:.1f} ms)\n")
+    if args.stop:
+        print_etas(projection, args.stop, now + args.ahead)
+    else:
+        print_positions(projection, traingetters, now + args.ahead)
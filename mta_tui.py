@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import math
+import shutil
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, TextIO, Tuple
+
+import mta_metrics
+from mta_rail import FeedWatcher, colors, group_by_section, line_to_long_name
+
+if TYPE_CHECKING:
+    from mta_feed_fetcher import FeedFetcher
+    from mta_rail import Train, TrainGetter
+    from mta_scheduler import PollScheduler
+
+RESET = "\033[0m"
+SECTION_STYLE = "\033[1;4m"
+TRIP_STYLE = "\033[1;44m"
+STATUS_STYLE = "\033[1;33m"
+DIM_STYLE = "\033[2m"
+STATUS_LABELS = {'STOPPED_AT': 'STOP', 'INCOMING_AT': 'INC ', 'IN_TRANSIT_TO': 'TRN '}
+# Unchanged cells between two changed runs closer than this are rewritten rather than skipped
+CURSOR_GAP = 4
+
+class FrameBuffer():
+    # A screen's worth of cells: one character and one interned style id per cell
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.chars = [[" "] * width for _ in range(height)]
+        self.styles = [[0] * width for _ in range(height)]
+
+    def put(self, row: int, col: int, text: str, style: int = 0, width: Optional[int] = None) -> int:
+        # Writes text clipped to `width` columns (and the screen); returns columns written
+        if row < 0 or row >= self.height or col >= self.width:
+            return 0
+        limit = self.width - col if width is None else min(width, self.width - col)
+        text = text[:limit]
+        n = len(text)
+        self.chars[row][col:col + n] = text
+        self.styles[row][col:col + n] = [style] * n
+        return n
+
+class TerminalRenderer():
+    # Keeps the frame currently on screen and writes only the cells that differ in the
+    # next one, as cursor-addressed runs with style changes only where the style does.
+    # A size change (or the first frame) repaints everything.
+    def __init__(self, out: TextIO = sys.stdout) -> None:
+        self.out = out
+        self.styles: List[str] = [RESET]
+        self._style_ids: Dict[str, int] = {RESET: 0}
+        self._front: Optional[FrameBuffer] = None
+        self.bytes_written = 0
+
+    def style(self, sgr: str) -> int:
+        style_id = self._style_ids.get(sgr)
+        if style_id is None:
+            style_id = self._style_ids[sgr] = len(self.styles)
+            self.styles.append(sgr)
+        return style_id
+
+    def start(self) -> None:
+        # Alternate screen, hidden cursor
+        self.out.write("\033[?1049h\033[?25l")
+        self.out.flush()
+
+    def stop(self) -> None:
+        self.out.write(RESET + "\033[?25h\033[?1049l")
+        self.out.flush()
+
+    def present(self, frame: FrameBuffer) -> int:
+        front = self._front
+        full = front is None or front.width != frame.width or front.height != frame.height
+        parts = ["\033[2J"] if full else []
+        # The previous frame always ends with a reset
+        current = 0
+        for row in range(frame.height):
+            chars, styles = frame.chars[row], frame.styles[row]
+            if full:
+                spans = [(0, frame.width)]
+            else:
+                old_chars, old_styles = front.chars[row], front.styles[row]
+                if chars == old_chars and styles == old_styles:
+                    continue
+                spans = []
+                col = 0
+                while col < frame.width:
+                    if chars[col] == old_chars[col] and styles[col] == old_styles[col]:
+                        col += 1
+                        continue
+                    start = end = col
+                    while col < frame.width and col - end <= CURSOR_GAP:
+                        if chars[col] != old_chars[col] or styles[col] != old_styles[col]:
+                            end = col + 1
+                        col += 1
+                    spans.append((start, end))
+                    col = end
+            for start, end in spans:
+                parts.append(f"\033[{row + 1};{start + 1}H")
+                run_start = start
+                for col in range(start, end + 1):
+                    if col == end or styles[col] != current:
+                        if col > run_start:
+                            parts.append("".join(chars[run_start:col]))
+                        if col == end:
+                            break
+                        current = styles[col]
+                        parts.append(RESET + self.styles[current] if current else RESET)
+                        run_start = col
+        if not parts:
+            self._front = frame
+            return 0
+        parts.append(RESET)
+        data = "".join(parts)
+        self.out.write(data)
+        self.out.flush()
+        self._front = frame
+        self.bytes_written += len(data)
+        return len(data)
+
+class RoutePane():
+    # Section view of one route, with the badge, section titles and station labels
+    # styled and fitted to the pane width once rather than on every frame
+    def __init__(self, traingetter: TrainGetter, renderer: TerminalRenderer) -> None:
+        self.traingetter = traingetter
+        route = traingetter.route
+        self.route_style = renderer.style(colors.get(route, RESET))
+        self.section_style = renderer.style(SECTION_STYLE)
+        self.trip_style = renderer.style(TRIP_STYLE)
+        self.status_style = renderer.style(STATUS_STYLE)
+        self.dim_style = renderer.style(DIM_STYLE)
+        self.badge = f" {route} "
+        self.title = f" {line_to_long_name.get(route, '')}"
+        self.sections = list(traingetter.route_data.keys())
+        self._width = None
+        self._labels: Dict[str, str] = {}
+
+    def _layout(self, width: int) -> None:
+        # Row layout: " N " badge, trip id, status, station label, ETA right-aligned
+        self._width = width
+        self.trip_width = min(16, max(0, width - 24))
+        self.label_width = max(0, width - 3 - 1 - self.trip_width - 1 - 4 - 1 - 1 - 6)
+        self._labels = {}
+
+    def label(self, name: str) -> str:
+        label = self._labels.get(name)
+        if label is None:
+            label = self._labels[name] = name[:self.label_width].ljust(self.label_width)
+        return label
+
+    def draw(self, frame: FrameBuffer, top: int, left: int, width: int, height: int,
+             trains: List[Train], now: float) -> None:
+        if width != self._width:
+            self._layout(width)
+        bottom = top + height
+        row = top
+        col = left + frame.put(row, left, self.badge, self.route_style, width)
+        frame.put(row, col, self.title, 0, width - (col - left))
+        row += 1
+
+        if width < 24:
+            # Too narrow for train rows
+            return
+        by_section = group_by_section(self.traingetter, trains)
+        for section in self.sections:
+            if row >= bottom:
+                return
+            frame.put(row, left, section, self.section_style, width)
+            row += 1
+            for t in by_section.get(section, ()):
+                if row >= bottom:
+                    return
+                self._draw_train(frame, row, left, t, now)
+                row += 1
+        if not trains and row < bottom:
+            frame.put(row, left, "No trip updates for this route in feed.", self.dim_style, width)
+
+    def _draw_train(self, frame: FrameBuffer, row: int, left: int, t: Train, now: float) -> None:
+        col = left
+        col += frame.put(row, col, f" {t.direction_char or ' '} ", self.route_style)
+        col += 1
+        col += frame.put(row, col, t.trip_id[:self.trip_width].ljust(self.trip_width), self.trip_style) + 1
+        col += frame.put(row, col, STATUS_LABELS.get(t.current_status, "    "), self.status_style) + 1
+        col += frame.put(row, col, self.label(t.next_station_name or t.next_stop_id)) + 1
+        frame.put(row, col, _format_eta(t, now).rjust(6))
+
+def _format_eta(t: Train, now: float) -> str:
+    secs = t.arrival_time - now if t.arrival_time else t.time_until
+    if secs is None:
+        return "n/a"
+    secs = int(secs)
+    if secs < 0:
+        return "due"
+    return f"{secs // 60}m{secs % 60:02d}s" if secs >= 60 else f"{secs}s"
+
+def pane_grid(count: int, width: int, height: int, min_width: int = 40) -> List[Tuple[int, int, int, int]]:
+    # (top, left, width, height) per pane: as many columns as fit min_width, then rows
+    columns = max(1, min(count, width // min_width))
+    rows = math.ceil(count / columns)
+    cell_width = (width - (columns - 1)) // columns
+    cell_height = (height - (rows - 1)) // rows
+    return [
+        ((i // columns) * (cell_height + 1), (i % columns) * (cell_width + 1), cell_width, cell_height)
+        for i in range(count)
+    ]
+
+class LiveBoard():
+    # Polls feeds on a background thread; the render loop repaints at a fixed frame rate
+    # but only builds a frame when the data or the displayed second changed.
+    def __init__(self, fetcher: FeedFetcher, routes: List[str], interval: float, fps: float = 4.0,
+                 out: TextIO = sys.stdout, scheduler: Optional[PollScheduler] = None) -> None:
+        self.watcher = FeedWatcher(fetcher, routes)
+        self.scheduler = scheduler
+        self.routes = routes
+        self.interval = interval
+        self.fps = fps
+        self.renderer = TerminalRenderer(out)
+        self.panes = [RoutePane(self.watcher.traingetters[route], self.renderer) for route in routes]
+        self.status_style = self.renderer.style(DIM_STYLE)
+        self.separator_style = self.renderer.style(DIM_STYLE)
+        self._lock = threading.Lock()
+        self._trains: Dict[str, List[Train]] = {route: [] for route in routes}
+        self._version = 0
+        self._updated: Optional[float] = None
+        self._error: Optional[str] = None
+
+    def _poll_loop(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            started = time.monotonic()
+            urls = None
+            if self.scheduler is not None:
+                urls = self.scheduler.next_batch(stop)
+                if not urls:
+                    continue
+            try:
+                updates = self.watcher.poll(urls)
+                if self.scheduler is not None:
+                    self.scheduler.observe_all(self.watcher.polled, changed=self.watcher.changed_feeds)
+                with self._lock:
+                    for route, (trains, _) in updates.items():
+                        self._trains[route] = trains
+                    self._updated = time.time()
+                    self._error = None
+                    self._version += 1
+            except Exception as e:
+                if self.scheduler is not None:
+                    self.scheduler.observe_all(dict.fromkeys(urls))
+                with self._lock:
+                    self._error = str(e)
+                    self._version += 1
+            if self.scheduler is None:
+                stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def build_frame(self, width: int, height: int, now: float) -> FrameBuffer:
+        frame = FrameBuffer(width, height)
+        with self._lock:
+            trains = dict(self._trains)
+            updated, error = self._updated, self._error
+        grid = pane_grid(len(self.panes), width, max(1, height - 1))
+        for pane, (top, left, pane_width, pane_height) in zip(self.panes, grid):
+            pane.draw(frame, top, left, pane_width, pane_height, trains[pane.traingetter.route], now)
+            if left + pane_width < width:
+                for row in range(top, top + pane_height):
+                    frame.put(row, left + pane_width, "│", self.separator_style)
+        stamp = time.strftime("%H:%M:%S", time.localtime(updated)) if updated else "--:--:--"
+        polling = "polling adaptively" if self.scheduler is not None else f"polling every {self.interval:g}s"
+        status = f" updated {stamp}  {polling}  {time.strftime('%H:%M:%S', time.localtime(now))}"
+        if error:
+            status += f"  error: {error}"
+        frame.put(height - 1, 0, status.ljust(width), self.status_style)
+        return frame
+
+    def run(self) -> None:
+        stop = threading.Event()
+        poller = threading.Thread(target=self._poll_loop, args=(stop,), name="feed-poller", daemon=True)
+        poller.start()
+        period = 1.0 / self.fps
+        shown = None
+        self.renderer.start()
+        try:
+            deadline = time.monotonic()
+            while True:
+                now = time.time()
+                size = shutil.get_terminal_size()
+                with self._lock:
+                    version = self._version
+                key = (version, int(now), size.columns, size.lines)
+                if key != shown:
+                    with mta_metrics.timed("render", "tui"):
+                        self.renderer.present(self.build_frame(size.columns, size.lines, now))
+                    shown = key
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            self.renderer.stop()
+
+def run_tui(fetcher: FeedFetcher, routes: List[str], interval: float = 30.0, fps: float = 4.0,
+            scheduler: Optional[PollScheduler] = None) -> None:
+    with fetcher:
+        LiveBoard(fetcher, routes, interval, fps, scheduler=scheduler).run()
@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FEED_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs"
+
+@pytest.fixture(scope="session")
+def feed_payload():
+    from mta_feed_fetcher import load_feed_payload
+    return load_feed_payload(os.path.join(ROOT, "feed_debug.txt"))
+
+@pytest.fixture(scope="session")
+def feed(feed_payload):
+    from google.transit import gtfs_realtime_pb2
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(feed_payload)
+    return message
+
+@pytest.fixture
+def fixture_server(feed_payload):
+    # Local stand-in for the MTA API serving feed_debug.txt on every feed path;
+    # yields its base URL and counts requests by status
+    from mta_feed_fetcher import make_fixture_server
+    server = make_fixture_server(feed_payload)
+    statuses = []
+    handler = server.RequestHandlerClass
+    send_response = handler.send_response
+
+    def counting_send_response(self, code, message=None):
+        statuses.append(code)
+        send_response(self, code, message)
+
+    handler.send_response = counting_send_response
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.statuses = statuses
+    server.base_url = f"http://127.0.0.1:{server.server_port}/"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    # Serves whatever payload the test last put on the server, unconditionally
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        payload = self.server.payload
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def upstream(feed_payload):
+    # Like fixture_server, but the test can change the feed between polls by setting
+    # `upstream.payload` (see moved_feed); serves at `upstream.base_url`
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FeedHandler)
+    server.daemon_threads = True
+    server.payload = feed_payload
+    server.base_url = f"http://127.0.0.1:{server.server_port}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def moved_feed(feed, route):
+    # The feed a minute later, with the first train of `route` one stop further on
+    from google.transit import gtfs_realtime_pb2
+    moved = gtfs_realtime_pb2.FeedMessage()
+    moved.CopyFrom(feed)
+    moved.header.timestamp += 60
+    for entity in moved.entity:
+        tu = entity.trip_update
+        if entity.HasField("trip_update") and tu.trip.route_id == route and len(tu.stop_time_update) > 1:
+            del tu.stop_time_update[0]
+            return moved.SerializeToString()
+    raise AssertionError(f"no {route} train to move")
@@ -0,0 +1,93 @@
+from google.transit import gtfs_realtime_pb2
+
+from mta_arrivals import ArrivalIndex, extract_arrivals
+
+def _feed(*trips):
+    # trips: (route_id, trip_id, [(stop_id, arrival), ...])
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    for route_id, trip_id, stops in trips:
+        entity = feed.entity.add(id=trip_id)
+        entity.trip_update.trip.route_id = route_id
+        entity.trip_update.trip.trip_id = trip_id
+        for stop_id, arrival in stops:
+            stu = entity.trip_update.stop_time_update.add(stop_id=stop_id)
+            if arrival:
+                stu.arrival.time = arrival
+    return feed
+
+def _board(index, stop_id, **kwargs):
+    return [(a.route_id, a.trip_id, a.direction_char, a.arrival_time) for a in index.board(stop_id, now=0, **kwargs)]
+
+def test_extract_groups_by_base_stop_in_time_order():
+    by_stop = extract_arrivals(_feed(
+        ("1", "t1", [("127S", 300), ("128S", 400)]),
+        ("1", "t2", [("127N", 100), ("128N", 0)]),
+        ("2", "t3", [("127S", 200)]),
+    ))
+    assert [(a.trip_id, a.direction_char) for a in by_stop["127"]] == [("t2", "N"), ("t3", "S"), ("t1", "S")]
+    # Untimed updates are skipped
+    assert [a.trip_id for a in by_stop["128"]] == ["t1"]
+
+def test_extract_filters_routes():
+    by_stop = extract_arrivals(_feed(("1", "t1", [("127S", 300)]), ("2", "t2", [("127S", 200)])), routes=["2"])
+    assert [a.trip_id for a in by_stop["127"]] == ["t2"]
+
+def test_feeds_are_merged_per_stop():
+    index = ArrivalIndex()
+    index.update_feed("a", _feed(("1", "t1", [("127S", 300)]), ("1", "t2", [("127S", 100)])))
+    index.update_feed("b", _feed(("A", "t3", [("127N", 200)]), ("A", "t4", [("A27S", 50)])))
+    assert _board(index, "127") == [("1", "t2", "S", 100), ("A", "t3", "N", 200), ("1", "t1", "S", 300)]
+    assert sorted(index.stops()) == ["127", "A27"]
+
+def test_update_replaces_a_feeds_contribution():
+    index = ArrivalIndex()
+    index.update_feed("a", _feed(("1", "t1", [("127S", 300), ("128S", 400)])))
+    index.update_feed("b", _feed(("A", "t3", [("127N", 200)])))
+    changed = index.update_feed("a", _feed(("1", "t1", [("127S", 350)]), ("1", "t2", [("129S", 500)])))
+    # 127 moved, 128 was dropped, 129 is new; feed b's arrivals are untouched
+    assert changed == {"127", "128", "129"}
+    assert _board(index, "127") == [("A", "t3", "N", 200), ("1", "t1", "S", 350)]
+    assert _board(index, "128") == []
+    assert "128" not in index.stops()
+
+def test_unchanged_update_reports_nothing():
+    index = ArrivalIndex()
+    feed = _feed(("1", "t1", [("127S", 300)]))
+    index.update_feed("a", feed)
+    assert index.update_feed("a", feed) == set()
+
+def test_remove_feed():
+    index = ArrivalIndex()
+    index.update_feed("a", _feed(("1", "t1", [("127S", 300)])))
+    index.update_feed("b", _feed(("A", "t3", [("127N", 200), ("A27N", 100)])))
+    assert index.remove_feed("b") == {"127", "A27"}
+    assert _board(index, "127") == [("1", "t1", "S", 300)]
+    assert index.stops() == ["127"]
+
+def test_board_filters():
+    index = ArrivalIndex()
+    index.update_feed("a", _feed(*[("1" if i % 2 else "2", f"t{i}", [("127" + "NS"[i % 3 == 0], 100 * i)]) for i in range(1, 10)]))
+    assert [a.arrival_time for a in index.board("127", now=450)] == [500, 600, 700, 800, 900]
+    assert [a.arrival_time for a in index.board("127", now=450, limit=2)] == [500, 600]
+    assert [a.arrival_time for a in index.board("127", now=0, direction="S")] == [300, 600, 900]
+    assert [a.arrival_time for a in index.board("127", now=0, routes=["2"], limit=3)] == [200, 400, 600]
+    assert index.board("999", now=0) == []
+
+def test_index_matches_a_full_scan_of_the_recorded_feed(feed):
+    index = ArrivalIndex()
+    index.update_feed("all", feed)
+    expected = {}
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        for stu in entity.trip_update.stop_time_update:
+            when = stu.arrival.time or stu.departure.time
+            if when:
+                stop_id = stu.stop_id[:-1] if stu.stop_id[-1:] in ("N", "S") and len(stu.stop_id) > 1 else stu.stop_id
+                expected.setdefault(stop_id, []).append((when, entity.trip_update.trip.trip_id))
+    assert sorted(index.stops()) == sorted(expected)
+    for stop_id, arrivals in expected.items():
+        board = [(a.arrival_time, a.trip_id) for a in index.board(stop_id, now=0)]
+        assert sorted(board) == sorted(arrivals)
+        assert [when for when, _ in board] == sorted(when for when, _ in arrivals)
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from conftest import FEED_URL
+from mta_columnar import build_snapshot
+from mta_rail import TrainGetter, bucket_feed, group_by_section, group_routes_by_url, route_ids
+
+# Every route served by the recorded feed
+ROUTES = group_routes_by_url(route_ids)[FEED_URL]
+
+@pytest.fixture(scope="module")
+def traingetters():
+    return {route: TrainGetter(route) for route in ROUTES}
+
+def _base(stop_id):
+    return stop_id[:-1] if len(stop_id) > 1 and stop_id[-1] in "NS" else stop_id
+
+def _serial(feed, traingetters, now):
+    trip_updates, vehicles = bucket_feed(feed, ROUTES)
+    return {route: tg.build_trains(trip_updates[route], vehicles, now) for route, tg in traingetters.items()}
+
+@pytest.mark.parametrize("offset", [-120, 0, 300])
+def test_snapshot_matches_build_trains(feed, traingetters, offset):
+    # Same trains, fields and order per route as the serial path, against one `now`
+    # (before, at and after the feed's timestamp so some ETAs clamp to 0)
+    now = feed.header.timestamp + offset
+    serial = _serial(feed, traingetters, now)
+    snapshot = build_snapshot([(feed, ROUTES)], traingetters)
+    etas = snapshot.etas(now)
+    order = snapshot.order(etas=etas)
+
+    assert len(snapshot) == sum(len(trains) for trains in serial.values())
+    for route, tg in traingetters.items():
+        trains = snapshot.to_trains(snapshot.route_rows(route, order), traingetters, etas)
+        assert trains == serial[route], route
+        sections = {name: snapshot.to_trains(rows, traingetters, etas)
+                    for name, rows in snapshot.sections(route, order).items()}
+        assert sections == group_by_section(tg, serial[route]), route
+        assert list(sections) == list(tg.route_data)
+
+def test_station_board_matches_a_scan(feed, traingetters):
+    now = feed.header.timestamp
+    serial = [train for trains in _serial(feed, traingetters, now).values() for train in trains]
+    snapshot = build_snapshot([(feed, ROUTES)], traingetters)
+    etas = snapshot.etas(now)
+    base_stops = {_base(train.next_stop_id) for train in serial if train.arrival_time}
+    assert base_stops
+    for stop_id in base_stops:
+        board = snapshot.to_trains(snapshot.station_board(stop_id, etas=etas), traingetters, etas)
+        expected = sorted((t for t in serial if t.arrival_time and _base(t.next_stop_id) == stop_id),
+                          key=lambda t: t.time_until)
+        assert [t.time_until for t in board] == [t.time_until for t in expected]
+        assert sorted(t.trip_id for t in board) == sorted(t.trip_id for t in expected)
+    assert snapshot.station_board("nope", etas=etas).size == 0
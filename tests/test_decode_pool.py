@@ -0,0 +1,81 @@
+from dataclasses import astuple
+
+import pytest
+
+import mta_decode_pool
+import mta_metrics
+from mta_decode_pool import DecodePool, decode_trains, encode_trains, extract_payload
+from mta_feed_fetcher import FeedFetcher
+from mta_rail import Train, get_trains_multi, get_trains_pooled, group_routes_by_url, parse_routes
+
+# Inside the recorded feed's service day, so ETAs are realistic
+NOW = 1760740000
+
+@pytest.fixture(scope="module")
+def pool():
+    with DecodePool(2) as pool:
+        yield pool
+
+def _rows(trains):
+    return [astuple(t) for t in trains]
+
+def _payloads(feed_payload):
+    return {url: (feed_payload, routes) for url, routes in group_routes_by_url(parse_routes("all")).items()}
+
+def test_record_encoding_round_trip():
+    trains = [
+        Train("000100_1..S", "1", "20251017", "127S", 42.5, 1, 12, "S", "127S", "STOPPED_AT", "Manhattan", "Times Sq", NOW + 42),
+        Train("000200_1..N", "1", "20251017", "(no stop)", 0.0, None, -1, None, None, None, None, None, None),
+        Train("000300_GS..N", "GS", "20251017", "902N", -5.0, 0, 0, "N", None, "IN_TRANSIT_TO", None, "Grand Central", NOW - 5),
+    ]
+    decoded = decode_trains(encode_trains([("1", trains[:2]), ("GS", trains[2:])]), ["1", "GS", "2"])
+    assert {route: _rows(t) for route, t in decoded.items()} == {"1": _rows(trains[:2]), "GS": _rows(trains[2:]), "2": []}
+
+def test_pool_matches_serial_extraction(pool, feed_payload):
+    payloads = _payloads(feed_payload)
+    pooled = pool.decode_all(payloads, now=NOW)
+    serial = {route: trains for payload, routes in payloads.values() for route, trains in extract_payload(payload, routes, NOW)}
+    assert sorted(pooled) == sorted(serial)
+    assert sum(len(trains) for trains in serial.values()) > 0
+    for route, trains in serial.items():
+        assert _rows(pooled[route]) == _rows(trains), route
+
+def test_results_too_big_for_the_block_come_back_inline(pool, feed_payload, monkeypatch):
+    payloads = _payloads(feed_payload)
+    expected = pool.decode_all(payloads, now=NOW)
+    monkeypatch.setattr(mta_decode_pool, "RESULT_SPACE", 0)
+    monkeypatch.setattr(mta_decode_pool, "MIN_RESULT_SPACE", 16)
+    with DecodePool(1) as small:
+        inline = small.decode_all(payloads, now=NOW)
+    assert {route: _rows(t) for route, t in inline.items()} == {route: _rows(t) for route, t in expected.items()}
+
+def test_worker_metrics_reach_the_parent(feed_payload, monkeypatch):
+    monkeypatch.setattr(mta_metrics, "enabled", True)
+    url, routes = next(iter(group_routes_by_url(["1"]).items()))
+    label = (mta_metrics.feed_label(url),)
+
+    def parses():
+        return sum(state[2] for labels, state in mta_metrics.PARSE_SECONDS.snapshot() if labels == label)
+
+    before = parses()
+    with DecodePool(1) as pool:
+        pool.decode_all({url: (feed_payload, routes)}, now=NOW)
+        pool.decode_all({url: (feed_payload, routes)}, now=NOW)
+    assert parses() == before + 2
+
+def test_pooled_and_serial_fetch_paths_agree(fixture_server, pool):
+    routes = parse_routes("all")
+    with FeedFetcher(base_url=fixture_server.base_url) as fetcher:
+        serial = get_trains_multi(fetcher, routes)
+    with FeedFetcher(base_url=fixture_server.base_url, decode=False) as fetcher:
+        pooled = get_trains_pooled(fetcher, routes, pool)
+    # Callers print in their own route order, so only the contents have to agree
+    assert sorted(pooled) == sorted(serial)
+    for route, (_, trains) in serial.items():
+        _, pooled_trains = pooled[route]
+        assert len(pooled_trains) == len(trains), route
+        for a, b in zip(pooled_trains, trains):
+            # Each path reads the clock itself; everything but the ETA is identical
+            assert a.time_until == pytest.approx(b.time_until, abs=5)
+            a.time_until = b.time_until
+            assert a == b
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+import mta_metrics
+from conftest import FEED_URL
+from mta_feed_cache import FETCHED_AT, FETCHED_AT_OFFSET, CacheEntry, FeedCache
+from mta_feed_fetcher import FeedFetcher
+
+def _parses(url):
+    label = (mta_metrics.feed_label(url),)
+    return sum(count for labels, (_, _, count, _, _) in mta_metrics.PARSE_SECONDS.snapshot() if labels == label)
+
+def test_fresh_entry_is_shared_without_network(fixture_server, tmp_path):
+    cache = FeedCache(str(tmp_path), ttl=3600, min_ttl=3600)
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as first:
+        fetched = first.fetch(FEED_URL)
+    # A second fetcher (another process, in practice) finds the entry fresh
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as second:
+        shared = second.fetch(FEED_URL)
+        again = second.fetch(FEED_URL)
+    assert fetched.ok and not fetched.cached
+    assert shared.ok and shared.cached
+    assert shared.feed.header.timestamp == fetched.feed.header.timestamp
+    # Unchanged entry: the memoized FeedMessage, not a re-parse
+    assert again.not_modified and again.feed is shared.feed
+    assert fixture_server.statuses == [200]
+
+def test_cache_hits_record_parse_time(fixture_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(mta_metrics, "enabled", True)
+    cache = FeedCache(str(tmp_path), ttl=3600, min_ttl=3600)
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as first:
+        first.fetch(FEED_URL)
+    before = _parses(FEED_URL)
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as second:
+        assert second.fetch(FEED_URL).cached
+    assert _parses(FEED_URL) == before + 1
+
+def test_stale_entry_is_revalidated(fixture_server, tmp_path):
+    cache = FeedCache(str(tmp_path), ttl=0, min_ttl=0)
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as fetcher:
+        first = fetcher.fetch(FEED_URL)
+        second = fetcher.fetch(FEED_URL)
+    assert second.ok and not second.cached
+    assert second.status == 304
+    assert second.not_modified and second.feed is first.feed
+    assert fixture_server.statuses == [200, 304]
+
+def test_not_modified_after_eviction_refetches(fixture_server, tmp_path):
+    cache = FeedCache(str(tmp_path), ttl=0, min_ttl=0)
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache) as fetcher:
+        fetcher.fetch(FEED_URL)
+        touch = cache.touch
+
+        def evicting_touch(url, header_timestamp, fetched_at=None):
+            # Another process removes the entry between the conditional request and
+            # the 304 being served from it
+            os.remove(cache.path(url))
+            return touch(url, header_timestamp, fetched_at)
+
+        cache.touch = evicting_touch
+        result = fetcher.fetch(FEED_URL)
+    assert result.ok, result.error
+    assert result.status == 200
+    assert not result.not_modified
+    assert fixture_server.statuses == [200, 304, 200]
+
+@pytest.mark.parametrize("decode", [True, False])
+def test_not_modified_only_rewrites_fetched_at(fixture_server, feed_payload, feed, tmp_path, decode):
+    cache = FeedCache(str(tmp_path), ttl=0, min_ttl=60)
+    target = fixture_server.base_url + "nyct%2Fgtfs"
+    etag = '"' + hashlib.sha1(feed_payload).hexdigest() + '"'
+    cache.store(target, feed_payload, feed.header.timestamp, etag, fetched_at=time.time() - 120)
+    path = cache.path(target)
+    with open(path, "rb") as f:
+        before = f.read()
+    inode, stamp = os.stat(path).st_ino, cache.stamp(target)
+
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache, decode=decode) as fetcher:
+        result = fetcher.fetch(FEED_URL)
+        again = fetcher.fetch(FEED_URL)
+    assert result.ok and result.status == 304
+    assert again.ok and again.cached and again.not_modified
+    # Same file, same bytes apart from fetched-at, and a stamp other processes notice
+    assert os.stat(path).st_ino == inode
+    assert cache.stamp(target) != stamp
+    with open(path, "rb") as f:
+        after = f.read()
+    assert len(after) == len(before)
+    assert after[:FETCHED_AT_OFFSET] == before[:FETCHED_AT_OFFSET]
+    assert after[FETCHED_AT_OFFSET + FETCHED_AT.size:] == before[FETCHED_AT_OFFSET + FETCHED_AT.size:]
+    entry, _ = cache.load(target)
+    assert time.time() - entry.fetched_at < 10
+    assert cache.fresh(entry)
+
+    # Another process now finds it fresh for min_ttl without asking upstream
+    with FeedFetcher(base_url=fixture_server.base_url, cache=cache, decode=decode) as other:
+        shared = other.fetch(FEED_URL)
+    assert shared.ok and shared.cached
+    assert fixture_server.statuses == [304]
+
+def test_touch_only_updates_the_same_entry(tmp_path):
+    cache = FeedCache(str(tmp_path))
+    assert not cache.touch("u", 100, 5.0)
+    cache.store("u", b"payload", 100, '"e"', fetched_at=1.0)
+    assert not cache.touch("u", 101, 5.0)
+    assert cache.load("u")[0].fetched_at == 1.0
+    assert cache.touch("u", 100, 5.0)
+    entry, _ = cache.load("u")
+    assert (entry.fetched_at, entry.header_timestamp, entry.etag, entry.payload) == (5.0, 100, '"e"', b"payload")
+
+def test_freshness_is_the_later_of_ttl_and_min_ttl(tmp_path):
+    cache = FeedCache(str(tmp_path), ttl=30, min_ttl=5)
+    entry = CacheEntry(header_timestamp=1000, fetched_at=1010, etag="", last_modified="", payload=b"")
+    # Header timestamp + ttl
+    assert cache.fresh(entry, now=1029.9)
+    assert not cache.fresh(entry, now=1030)
+    # A feed whose timestamp stopped moving stays fresh for min_ttl after each fetch
+    entry.fetched_at = 1100
+    assert cache.fresh(entry, now=1104.9)
+    assert not cache.fresh(entry, now=1105)
+
+def test_concurrent_refreshes_coalesce_on_the_lock(fixture_server, tmp_path):
+    # Fetchers in several threads (separate lock file handles, like separate
+    # processes) all miss at once; one fetches and the rest find its entry fresh
+    cache = FeedCache(str(tmp_path), ttl=0, min_ttl=60)
+    fetchers = [FeedFetcher(base_url=fixture_server.base_url, cache=cache) for _ in range(4)]
+    barrier = threading.Barrier(len(fetchers))
+    results = []
+
+    def fetch(fetcher):
+        barrier.wait()
+        results.append(fetcher.fetch(FEED_URL))
+
+    threads = [threading.Thread(target=fetch, args=(fetcher,)) for fetcher in fetchers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for fetcher in fetchers:
+        fetcher.close()
+    assert all(result.ok for result in results)
+    assert sum(not result.cached for result in results) == 1
+    assert fixture_server.statuses == [200]
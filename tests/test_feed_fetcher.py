@@ -0,0 +1,43 @@
+from conftest import FEED_URL
+from mta_feed_fetcher import FeedFetcher
+
+def test_first_fetch_decodes_feed(fixture_server, feed):
+    with FeedFetcher(base_url=fixture_server.base_url) as fetcher:
+        result = fetcher.fetch(FEED_URL)
+    assert result.ok
+    assert result.status == 200
+    assert not result.not_modified
+    assert result.feed.header.timestamp == feed.header.timestamp
+    assert len(result.feed.entity) == len(feed.entity)
+
+def test_conditional_refetch_reuses_decoded_feed(fixture_server):
+    with FeedFetcher(base_url=fixture_server.base_url) as fetcher:
+        first = fetcher.fetch(FEED_URL)
+        second = fetcher.fetch(FEED_URL)
+    assert second.ok
+    assert second.status == 304
+    assert second.not_modified
+    # The 304 is answered from the remembered FeedMessage, not a re-parse
+    assert second.feed is first.feed
+    assert fixture_server.statuses == [200, 304]
+
+def test_raw_payloads_without_decode(fixture_server, feed_payload):
+    with FeedFetcher(base_url=fixture_server.base_url, decode=False) as fetcher:
+        first = fetcher.fetch(FEED_URL)
+        second = fetcher.fetch(FEED_URL)
+    assert first.feed is None and first.payload == feed_payload
+    assert second.not_modified and second.payload == feed_payload
+
+def test_fetch_all_keys_results_by_url(fixture_server):
+    urls = [FEED_URL, FEED_URL + "-ace", FEED_URL + "-g"]
+    with FeedFetcher(base_url=fixture_server.base_url) as fetcher:
+        results = fetcher.fetch_all(urls)
+    assert sorted(results) == sorted(urls)
+    assert all(result.ok for result in results.values())
+
+def test_unreachable_host_is_reported_not_raised():
+    with FeedFetcher(base_url="http://127.0.0.1:9/", retries=0, timeout=1.0, connect_timeout=0.5) as fetcher:
+        result = fetcher.fetch(FEED_URL)
+    assert not result.ok
+    assert result.error is not None
+    assert result.feed is None
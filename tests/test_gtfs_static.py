@@ -0,0 +1,190 @@
+import csv
+import io
+import mmap
+import os
+import random
+import zipfile
+
+import pytest
+
+import mta_gtfs_static
+from mta_gtfs_static import StaticSchedule, default_index_path, short_trip_key, trip_key
+from mta_rail import Train
+
+FRIDAY, SATURDAY, HOLIDAY = "20251017", "20251018", "20251013"
+STOPS = [f"{n}{d}" for n in range(101, 111) for d in "NS"]
+
+def _write(archive, name, header, rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(rows)
+    archive.writestr(name, text.getvalue())
+
+def _clock(seconds):
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def _trips(rng):
+    # (trip_id, route, service, [(stop_id, arrival seconds), ...]); every origin time
+    # runs under both services, Saturday 5 minutes later, like the MTA's schedules
+    trips = []
+    for route in ("1", "2"):
+        for n in range(12):
+            origin = 5 * 3600 + n * 7 * 3600 // 4
+            direction = "NS"[n % 2]
+            stops = [s for s in STOPS if s[-1] == direction]
+            if direction == "N":
+                stops.reverse()
+            if n == 3:
+                # A loop that visits its first stop again
+                stops.append(stops[0])
+            key = f"{origin * 100 // 60:06d}_{route}..{direction}03R"
+            for service, shift in (("Weekday", 0), ("Saturday", 300)):
+                arrivals = []
+                when = origin + shift
+                for stop in stops:
+                    arrivals.append((stop, when))
+                    when += rng.randrange(60, 180)
+                trips.append((f"AFA25GEN-{route}038-{service}-00_{key}", route, service, arrivals))
+    return trips
+
+def _zip(path, trips, shuffle=False, rng=None):
+    stop_times = [(trip_id, _clock(t), _clock(t), stop, seq + 1)
+                  for trip_id, _, _, arrivals in trips for seq, (stop, t) in enumerate(arrivals)]
+    if shuffle:
+        rng.shuffle(stop_times)
+    with zipfile.ZipFile(path, "w") as archive:
+        _write(archive, "agency.txt", ["agency_id", "agency_name", "agency_timezone"], [["MTA", "MTA", "America/New_York"]])
+        _write(archive, "stops.txt", ["stop_id", "stop_name"], [[s, f"Stop {s[:-1]}"] for s in STOPS])
+        _write(archive, "trips.txt", ["route_id", "service_id", "trip_id", "direction_id"],
+               [[route, service, trip_id, 0] for trip_id, route, service, _ in trips])
+        _write(archive, "stop_times.txt", ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"], stop_times)
+        _write(archive, "calendar.txt", ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday",
+                                         "sunday", "start_date", "end_date"],
+               [["Weekday", 1, 1, 1, 1, 1, 0, 0, "20250101", "20261231"],
+                ["Saturday", 0, 0, 0, 0, 0, 1, 0, "20250101", "20261231"]])
+        # A Monday holiday running the Saturday schedule
+        _write(archive, "calendar_dates.txt", ["service_id", "date", "exception_type"],
+               [["Weekday", HOLIDAY, 2], ["Saturday", HOLIDAY, 1]])
+    return str(path)
+
+@pytest.fixture(scope="module")
+def trips():
+    return _trips(random.Random(11))
+
+@pytest.fixture(scope="module")
+def schedule(trips, tmp_path_factory):
+    return StaticSchedule.open(_zip(tmp_path_factory.mktemp("gtfs") / "gtfs.zip", trips))
+
+def _realtime(trip_id):
+    # Realtime ids carry only the key, often without the path suffix
+    return short_trip_key(trip_key(trip_id))
+
+def test_trip_keys():
+    assert trip_key("AFA23GEN-1038-Weekday-00_014600_1..S03R") == "014600_1..S03R"
+    assert short_trip_key("014600_1..S03R") == "014600_1..S"
+    assert trip_key("no key here") is None
+
+def test_match_picks_the_service_running_that_day(schedule, trips):
+    for trip, (trip_id, _, service, _) in enumerate(trips):
+        wanted = {"Weekday": FRIDAY, "Saturday": SATURDAY}[service]
+        for realtime in (trip_key(trip_id), _realtime(trip_id)):
+            matched = schedule.match(realtime, wanted)
+            assert schedule.trip_id(matched) == trip_id
+    assert schedule.match("000000_1..S", FRIDAY) is None
+    assert schedule.match(_realtime(trips[0][0]), "") is None
+
+def test_calendar_exceptions(schedule, trips):
+    trip_id = next(t for t, _, service, _ in trips if service == "Saturday")
+    assert schedule.trip_service(schedule.match(_realtime(trip_id), HOLIDAY)) == "Saturday"
+
+def test_stop_time_row_matches_a_scan(schedule, trips):
+    for trip, (trip_id, _, _, arrivals) in enumerate(trips):
+        rows = schedule.trip_stop_times(trip)
+        for stop in STOPS:
+            first = next((row for row in rows if schedule.stop_id(schedule.stop_time_stop[row]) == stop), None)
+            assert schedule.stop_time_row(trip, stop) == first
+        assert [schedule.stop_time_arrival[row] for row in rows] == [t for _, t in arrivals]
+    assert schedule.stop_time_row(0, "999N") is None
+
+def test_delay_against_schedule(schedule, trips):
+    trip_id, _, _, arrivals = [trip for trip in trips if trip[2] == "Weekday"][5]
+    stop, scheduled = arrivals[4]
+    date = int(FRIDAY)
+    arrival = schedule.day_start(date) + scheduled + 120
+    train = Train(_realtime(trip_id), "1", FRIDAY, stop, 0.0, arrival_time=arrival)
+    assert schedule.delay(train) == 120
+    assert schedule.scheduled_arrival(schedule.match(train.trip_id, FRIDAY), stop, date) == arrival - 120
+    train.arrival_time = None
+    assert schedule.delay(train) is None
+
+def test_departures_in_time_order(schedule, trips):
+    date = int(FRIDAY)
+    after = 8 * 3600
+    departures = schedule.departures("105S", date, after=after, limit=100)
+    expected = sorted((t, trip_id) for trip_id, _, service, arrivals in trips if service == "Weekday"
+                      for stop, t in arrivals if stop == "105S" and t >= after)
+    assert [(schedule.stop_time_departure[row], schedule.trip_id(trip)) for trip, row in departures] == expected
+    assert len(schedule.departures("105S", date, after=after, limit=2)) == 2
+
+def test_ungrouped_stop_times_compile_the_same(schedule, trips, tmp_path):
+    shuffled = StaticSchedule.open(_zip(tmp_path / "shuffled.zip", trips, shuffle=True, rng=random.Random(2)))
+    assert shuffled.n_stop_times == schedule.n_stop_times
+    for trip in range(schedule.n_trips):
+        assert shuffled.trip_id(trip) == schedule.trip_id(trip)
+        assert [shuffled.stop_time_arrival[r] for r in shuffled.trip_stop_times(trip)] == \
+               [schedule.stop_time_arrival[r] for r in schedule.trip_stop_times(trip)]
+    for route in schedule.routes():
+        assert shuffled.route_trips(route) == schedule.route_trips(route)
+
+def test_index_is_reused_until_the_zip_changes(trips, tmp_path):
+    path = _zip(tmp_path / "gtfs.zip", trips)
+    first = StaticSchedule.open(path)
+    assert os.path.exists(default_index_path(path))
+    built = os.stat(default_index_path(path)).st_mtime_ns
+    reopened = StaticSchedule.open(path)
+    assert os.stat(default_index_path(path)).st_mtime_ns == built
+    assert reopened.n_trips == first.n_trips
+
+    _zip(tmp_path / "gtfs.zip", trips[:4])
+    changed = StaticSchedule.open(path)
+    assert changed.n_trips == 4
+
+@pytest.fixture
+def maps(monkeypatch):
+    # Every mmap StaticSchedule.open makes, to check which ones it leaves open
+    made = []
+    real = mmap.mmap
+
+    def recording(*args, **kwargs):
+        mm = real(*args, **kwargs)
+        made.append(mm)
+        return mm
+
+    monkeypatch.setattr(mta_gtfs_static.mmap, "mmap", recording)
+    return made
+
+def test_stale_index_map_is_closed(trips, tmp_path, maps):
+    path = _zip(tmp_path / "gtfs.zip", trips)
+    StaticSchedule.open(path)
+    _zip(tmp_path / "gtfs.zip", trips[:4])
+    assert StaticSchedule.open(path).n_trips == 4
+    assert len(maps) == 1 and maps[0].closed
+
+@pytest.mark.parametrize("cut", [4, 6, 1000])
+def test_truncated_index_is_rebuilt(trips, tmp_path, maps, cut):
+    path = _zip(tmp_path / "gtfs.zip", trips)
+    first = StaticSchedule.open(path)
+    index_path = default_index_path(path)
+    with open(index_path, "rb") as f:
+        data = f.read()
+    with pytest.raises(ValueError):
+        StaticSchedule(data[:-cut])
+    with open(index_path, "wb") as f:
+        f.write(data[:-cut])
+
+    reopened = StaticSchedule.open(path)
+    assert (reopened.n_trips, reopened.n_stop_times) == (first.n_trips, first.n_stop_times)
+    assert all(mm.closed for mm in maps)
+    with open(index_path, "rb") as f:
+        assert f.read() == data
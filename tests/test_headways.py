@@ -0,0 +1,103 @@
+from mta_headways import HeadwayTracker, RollingStats
+from mta_history import HistoryRecord
+from mta_rail import Train
+
+def _train(trip, stop, status=None, arrival=None, index=0):
+    return Train(trip, "1", "20251017", stop, 0.0, None, index, stop[-1:], None, status, None, None, arrival)
+
+def _observe(tracker, observations):
+    # observations: (observed, [train, ...]) in time order
+    events = []
+    for observed, trains in observations:
+        events.extend(tracker.observe("1", trains, observed))
+    return events
+
+def test_pass_through_visit_uses_clamped_prediction():
+    events = _observe(HeadwayTracker(), [
+        (1000, [_train("t1", "101S", "IN_TRANSIT_TO", 1050)]),
+        (1060, [_train("t1", "102S", "IN_TRANSIT_TO", 1150)]),
+    ])
+    assert [(e.stop_id, e.arrival, e.departure, e.dwell) for e in events] == [("101S", 1050, 1050, None)]
+
+    # A prediction outside the observations is clamped to them
+    events = _observe(HeadwayTracker(), [
+        (1000, [_train("t1", "101S", "IN_TRANSIT_TO", 5000)]),
+        (1060, [_train("t1", "102S", "IN_TRANSIT_TO", 5100)]),
+    ])
+    assert events[0].arrival == 1060
+
+def test_dwell_from_stopped_observations():
+    events = _observe(HeadwayTracker(), [
+        (1000, [_train("t1", "101S", "IN_TRANSIT_TO", 1100)]),
+        (1090, [_train("t1", "101S", "STOPPED_AT", 1100)]),
+        (1120, [_train("t1", "101S", "STOPPED_AT", 1100)]),
+        (1150, [_train("t1", "102S", "IN_TRANSIT_TO", 1250)]),
+    ])
+    (event,) = events
+    # Arrival clamped to when it was first seen stopped; departure halfway to moving on
+    assert (event.arrival, event.departure, event.dwell) == (1090, 1135, 45)
+
+def test_run_time_between_stops():
+    tracker = HeadwayTracker()
+    _observe(tracker, [
+        (1000, [_train("t1", "101S", "IN_TRANSIT_TO", 1030)]),
+        (1060, [_train("t1", "102S", "IN_TRANSIT_TO", 1150)]),
+        (1180, [_train("t1", "103S", "IN_TRANSIT_TO", 1300)]),
+    ])
+    run = tracker.runs[("1", "101S", "102S")]
+    assert (run.count, run.mean) == (1, 120)
+
+def test_headways_and_bunching():
+    tracker = HeadwayTracker(min_samples=3, bunch_ratio=0.25)
+    observations = []
+    arrivals = [0, 300, 600, 900, 950]
+    for n, arrival in enumerate(arrivals):
+        trip = f"t{n}"
+        observations.append((arrival - 10, [_train(trip, "101S", "IN_TRANSIT_TO", arrival)]))
+        observations.append((arrival + 10, [_train(trip, "102S", "IN_TRANSIT_TO", arrival + 120)]))
+    observations.sort(key=lambda o: o[0])
+    events = [e for e in _observe(tracker, observations) if e.stop_id == "101S"]
+    assert [e.headway for e in events] == [None, 300, 300, 300, 50]
+    assert [e.bunched for e in events] == [False, False, False, False, True]
+    stats = tracker.stops[("1", "101S")]
+    assert (stats.visits, stats.bunches) == (5, 1)
+
+def test_placeholder_stop_is_not_a_visit():
+    events = _observe(HeadwayTracker(), [
+        (1000, [_train("t1", "101S", "IN_TRANSIT_TO", 1100)]),
+        # Extraction's placeholder when a trip has no usable stop_time_update
+        (1030, [_train("t1", "(no stop)")]),
+        (1060, [_train("t1", "101S", "IN_TRANSIT_TO", 1100)]),
+        (1090, [_train("t1", "")]),
+        (1120, [_train("t1", "102S", "IN_TRANSIT_TO", 1200)]),
+    ])
+    assert [(e.stop_id, e.arrival) for e in events] == [("101S", 1100)]
+
+def test_records_and_trains_agree():
+    observations = []
+    for observed in range(0, 3600, 30):
+        trains = []
+        for n, start in enumerate(range(0, 3000, 240)):
+            elapsed = observed - start
+            if not 0 <= elapsed < 1200:
+                continue
+            index, offset = divmod(elapsed, 120)
+            status = "STOPPED_AT" if offset >= 90 else "IN_TRANSIT_TO"
+            trains.append(_train(f"t{n}", f"{100 + index}S", status, start + index * 120 + 90, index))
+        observations.append((observed, trains))
+    from_trains = _observe(HeadwayTracker(), observations)
+    records = [HistoryRecord(observed, "1", t.trip_id, t.next_stop_id, t.arrival_time, t.current_status, t.next_station_index)
+               for observed, trains in observations for t in trains]
+    from_records = list(HeadwayTracker().observe_records(records))
+    assert from_trains == from_records
+    assert len(from_trains) > 100
+    # Exact predictions and 30s snapshots: arrivals are the simulated ones, headways the 240s schedule
+    assert all((e.arrival - 90) % 120 == 0 for e in from_trains)
+    assert {e.headway for e in from_trains if e.headway is not None} == {240}
+
+def test_rolling_stats_window():
+    stats = RollingStats(window=3)
+    for value in (10, 20, 30, 40):
+        stats.add(value)
+    assert (stats.count, stats.total, stats.mean) == (3, 4, 30)
+    assert stats.stdev == 10
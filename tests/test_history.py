@@ -0,0 +1,129 @@
+import os
+import random
+
+import pytest
+
+from mta_history import HistoryReader, HistoryRecord, HistoryWriter, partition_day
+from mta_rail import Train
+
+# 2025-10-17 23:50 UTC, ten minutes before the day partition rolls over
+EVENING = 1760745000
+STATUSES = ("STOPPED_AT", "IN_TRANSIT_TO", "INCOMING_AT", None)
+
+def _train(route, trip, stop, observed, arrival=60, status="IN_TRANSIT_TO", index=3):
+    return Train(trip, route, "20251017", stop, float(arrival or 0), None, index, stop[-1], None, status,
+                 None, None, observed + arrival if arrival is not None else None)
+
+def _snapshots(rng, routes, start, count, step=30):
+    snapshots = []
+    for n in range(count):
+        observed = start + n * step
+        for route in routes:
+            trains = [_train(route, f"{rng.randrange(50):06d}_{route}..{rng.choice('NS')}",
+                             f"{rng.randrange(100, 140)}{rng.choice('NS')}", observed,
+                             arrival=rng.choice([None, rng.randrange(-30, 900)]),
+                             status=rng.choice(STATUSES), index=rng.randrange(-1, 40))
+                      for _ in range(rng.randrange(0, 12))]
+            snapshots.append((route, observed, trains))
+    return snapshots
+
+def _records(snapshots):
+    return [HistoryRecord(observed, route, t.trip_id, t.next_stop_id, t.arrival_time, t.current_status, t.next_station_index)
+            for route, observed, trains in snapshots for t in trains]
+
+def _by_route(records):
+    return sorted(records, key=lambda r: (r.route_id, r.observed))
+
+def test_round_trip(tmp_path):
+    snapshots = _snapshots(random.Random(3), ["1", "A", "GS"], EVENING - 3600, 200)
+    with HistoryWriter(str(tmp_path), chunk_rows=500) as writer:
+        for route, observed, trains in snapshots:
+            writer.append(route, trains, observed)
+    reader = HistoryReader(str(tmp_path))
+    assert reader.routes() == ["1", "A", "GS"]
+    assert list(reader.query()) == _by_route(_records(snapshots))
+
+def test_query_filters(tmp_path):
+    snapshots = _snapshots(random.Random(5), ["1", "2"], EVENING - 1800, 120)
+    with HistoryWriter(str(tmp_path), chunk_rows=64) as writer:
+        for route, observed, trains in snapshots:
+            writer.append(route, trains, observed)
+    reader = HistoryReader(str(tmp_path))
+    records = _by_route(_records(snapshots))
+    start, end = EVENING - 1200, EVENING - 600
+    assert list(reader.query(start, end)) == [r for r in records if start <= r.observed <= end]
+    assert list(reader.query(routes=["2"])) == [r for r in records if r.route_id == "2"]
+    # A base stop_id matches both directions
+    assert list(reader.query(stop_id="120")) == [r for r in records if r.stop_id[:-1] == "120"]
+    assert list(reader.query(stop_id="120N")) == [r for r in records if r.stop_id == "120N"]
+    trip = records[len(records) // 2].trip_id
+    assert list(reader.query(trip_id=trip)) == [r for r in records if r.trip_id == trip]
+
+def test_finished_day_is_written_before_close(tmp_path):
+    writer = HistoryWriter(str(tmp_path), flush_interval=3600)
+    writer.append("1", [_train("1", "000100_1..S", "127S", EVENING)], EVENING)
+    today = tmp_path / "1" / f"{partition_day(EVENING)}.mth"
+    assert not today.exists()
+    # The first observation after midnight UTC closes out the previous day, even on another route
+    tomorrow = EVENING + 900
+    writer.append("A", [_train("A", "000200_A..N", "A27N", tomorrow)], tomorrow)
+    assert today.exists()
+    assert [r.trip_id for r in HistoryReader(str(tmp_path)).query(routes=["1"])] == ["000100_1..S"]
+    writer.close()
+    assert HistoryReader(str(tmp_path)).days("A") == [partition_day(tomorrow)]
+
+def test_quiet_route_is_written_after_flush_interval(tmp_path):
+    writer = HistoryWriter(str(tmp_path), flush_interval=0)
+    writer.append("1", [_train("1", "000100_1..S", "127S", EVENING)], EVENING)
+    writer.append("A", [], EVENING + 30)
+    assert [r.route_id for r in HistoryReader(str(tmp_path)).query()] == ["1"]
+    writer.close()
+
+def test_torn_final_chunk_is_ignored(tmp_path):
+    with HistoryWriter(str(tmp_path)) as writer:
+        writer.append("1", [_train("1", "000100_1..S", "127S", EVENING)], EVENING)
+    path = os.path.join(str(tmp_path), "1", f"{partition_day(EVENING)}.mth")
+    with open(path, "rb") as f:
+        chunk = f.read()
+    with open(path, "ab") as f:
+        # A crash mid-append leaves part of the next chunk behind
+        f.write(chunk[:len(chunk) - 5])
+    assert len(list(HistoryReader(str(tmp_path)).query())) == 1
+
+def _day_file(tmp_path, route="1", observed=EVENING):
+    return os.path.join(str(tmp_path), route, f"{partition_day(observed)}.mth")
+
+def _torn_append(path, cut):
+    # What a crash partway through an append leaves behind
+    with open(path, "rb") as f:
+        chunk = f.read()
+    with open(path, "ab") as f:
+        f.write(chunk[:cut])
+    return len(chunk)
+
+@pytest.mark.parametrize("cut", [3, 20, -5])
+def test_restarted_writer_cuts_off_a_torn_chunk(tmp_path, cut):
+    with HistoryWriter(str(tmp_path)) as writer:
+        writer.append("1", [_train("1", "000100_1..S", "127S", EVENING)], EVENING)
+    path = _day_file(tmp_path)
+    size = _torn_append(path, cut)
+    with HistoryWriter(str(tmp_path)) as writer:
+        writer.append("1", [_train("1", "000200_1..S", "128S", EVENING + 30)], EVENING + 30)
+    assert [r.trip_id for r in HistoryReader(str(tmp_path)).query()] == ["000100_1..S", "000200_1..S"]
+    # The torn bytes are gone, not just skipped: the new chunk follows the old one
+    with open(path, "rb") as f:
+        assert f.read()[size:size + 4] == b"MTHC"
+
+def test_reader_resyncs_past_a_torn_chunk_mid_file(tmp_path):
+    # Files written before writers cut torn tails can have complete chunks after one
+    with HistoryWriter(str(tmp_path)) as writer:
+        writer.append("1", [_train("1", "000100_1..S", "127S", EVENING)], EVENING)
+    path = _day_file(tmp_path)
+    _torn_append(path, -5)
+    second = HistoryWriter(str(tmp_path))
+    second._recovered.add(path)
+    second.append("1", [_train("1", "000200_1..S", "128S", EVENING + 30)], EVENING + 30)
+    second.close()
+    reader = HistoryReader(str(tmp_path))
+    assert [r.trip_id for r in reader.query()] == ["000100_1..S", "000200_1..S"]
+    assert [r.trip_id for r in reader.query(start=EVENING + 10)] == ["000200_1..S"]
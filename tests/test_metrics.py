@@ -0,0 +1,99 @@
+import pytest
+
+from mta_metrics import AgeGauge, Counter, Gauge, Histogram, Metric, Registry
+
+def _registry():
+    registry = Registry()
+    counter = registry.register(Counter("t_responses_total", "Responses", ("feed", "status")))
+    gauge = registry.register(Gauge("t_entities", "Entities", ("feed",)))
+    histogram = registry.register(Histogram("t_seconds", "Latency", ("feed",), buckets=(0.1, 1.0)))
+    return registry, counter, gauge, histogram
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("t", "abstract")
+
+    class Partial(Metric):
+        def _samples(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial("t", "no merge")
+
+def test_text_exposition():
+    registry, counter, gauge, histogram = _registry()
+    registry.register(Counter("t_unused_total", "Never touched"))
+    counter.inc(("gtfs", "200"))
+    counter.inc(("gtfs", "200"), 2)
+    counter.inc(('g"t\\fs\n', "error"))
+    gauge.set(("gtfs",), 1.5)
+    gauge.set(("gtfs-ace",), 7.0)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(("gtfs",), value)
+
+    assert registry.render() == "\n".join([
+        "# HELP t_responses_total Responses",
+        "# TYPE t_responses_total counter",
+        't_responses_total{feed="g\\"t\\\\fs\\n",status="error"} 1',
+        't_responses_total{feed="gtfs",status="200"} 3',
+        "# HELP t_entities Entities",
+        "# TYPE t_entities gauge",
+        't_entities{feed="gtfs"} 1.5',
+        't_entities{feed="gtfs-ace"} 7',
+        "# HELP t_seconds Latency",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{feed="gtfs",le="0.1"} 2',
+        't_seconds_bucket{feed="gtfs",le="1"} 3',
+        't_seconds_bucket{feed="gtfs",le="+Inf"} 4',
+        't_seconds_sum{feed="gtfs"} 3.65',
+        't_seconds_count{feed="gtfs"} 4',
+    ]) + "\n"
+
+def test_unlabelled_and_age_samples(monkeypatch):
+    counter = Counter("t_total", "Unlabelled")
+    counter.inc()
+    assert counter.render()[-1] == "t_total 1"
+    age = AgeGauge("t_age_seconds", "Age", ("feed",))
+    age.set(("gtfs",), 1000.0)
+    monkeypatch.setattr("mta_metrics.time.time", lambda: 1012.25)
+    assert age.render()[-1] == 't_age_seconds{feed="gtfs"} 12.25'
+
+def test_take_and_merge_add_a_workers_values():
+    parent, counter, gauge, histogram = _registry()
+    counter.inc(("gtfs", "200"), 5)
+    gauge.set(("gtfs",), 10)
+    histogram.observe(("gtfs",), 0.5)
+
+    worker, w_counter, w_gauge, w_histogram = _registry()
+    w_counter.inc(("gtfs", "200"))
+    w_counter.inc(("gtfs", "304"))
+    w_gauge.set(("gtfs",), 12)
+    w_histogram.observe(("gtfs",), 0.01)
+    w_histogram.observe(("gtfs",), 2.0)
+    w_histogram.observe(("gtfs-l",), 0.2)
+
+    taken = worker.take()
+    assert set(taken) == {"t_responses_total", "t_entities", "t_seconds"}
+    # take() hands off what was recorded and starts over
+    assert worker.take() == {}
+    assert worker.render() == "\n"
+    parent.merge(taken)
+
+    assert counter.snapshot() == [(("gtfs", "200"), 6), (("gtfs", "304"), 1)]
+    assert gauge.snapshot() == [(("gtfs",), 12)]
+    assert histogram.snapshot() == [
+        (("gtfs",), ([1, 1, 1], 2.51, 3, 0.01, 2.0)),
+        (("gtfs-l",), ([0, 1, 0], 0.2, 1, 0.2, 0.2)),
+    ]
+    # The merged-in state is a copy, not the worker's lists
+    taken["t_seconds"][0][1][0][0] = 99
+    assert histogram.snapshot()[0][1][0] == [1, 1, 1]
+
+def test_histogram_quantiles_stay_within_observed_range():
+    histogram = Histogram("t_seconds", "Latency", buckets=(0.1, 1.0))
+    assert histogram.quantile((), 0.5) is None
+    for value in (0.2, 0.4, 0.6, 0.8):
+        histogram.observe((), value)
+    assert histogram.quantile((), 0.5) == pytest.approx(0.5)
+    assert histogram.quantile((), 0.0) >= 0.2
+    assert histogram.quantile((), 1.0) == pytest.approx(0.8)
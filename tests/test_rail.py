@@ -0,0 +1,155 @@
+import subprocess
+import sys
+
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+import mta_rail
+from conftest import ROOT, moved_feed
+from mta_feed_fetcher import FeedFetcher
+from mta_history import HistoryReader, HistoryWriter
+from mta_rail import TrainGetter, bucket_feed, main, route_ids, watch
+
+def _entity(feed, entity_id, route_id, trip_id, stop_id=None, arrival=0, vehicle_stop=None, status=None):
+    entity = feed.entity.add(id=entity_id)
+    if stop_id is not None:
+        tu = entity.trip_update
+        tu.trip.route_id = route_id
+        tu.trip.trip_id = trip_id
+        tu.trip.start_date = "20251017"
+        stu = tu.stop_time_update.add(stop_id=stop_id)
+        stu.arrival.time = arrival
+    if vehicle_stop is not None:
+        vehicle = entity.vehicle
+        vehicle.trip.route_id = route_id
+        vehicle.trip.trip_id = trip_id
+        vehicle.stop_id = vehicle_stop
+        vehicle.current_status = status
+    return entity
+
+def _feed():
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    return feed
+
+def test_entity_with_trip_update_and_vehicle_keeps_both():
+    feed = _feed()
+    _entity(feed, "1", "1", "000100_1..S", "127S", 1000, "127S", gtfs_realtime_pb2.VehiclePosition.STOPPED_AT)
+    trip_updates, vehicles = bucket_feed(feed, ["1"])
+    assert list(trip_updates["1"]) == ["000100_1..S"]
+    assert list(vehicles) == ["000100_1..S"]
+    (train,) = TrainGetter("1").build_trains(trip_updates["1"], vehicles, now=900)
+    assert (train.vehicle_stop_id, train.current_status) == ("127S", "STOPPED_AT")
+
+def test_separate_entities_and_route_filtering():
+    feed = _feed()
+    _entity(feed, "1", "1", "000100_1..S", "127S", 1000)
+    _entity(feed, "1v", "1", "000100_1..S", vehicle_stop="127S", status=gtfs_realtime_pb2.VehiclePosition.INCOMING_AT)
+    _entity(feed, "2", "2", "000200_2..N", "120N", 1100, "120N", gtfs_realtime_pb2.VehiclePosition.IN_TRANSIT_TO)
+    # Vehicles without a route are kept; trip updates without a trip id are not
+    _entity(feed, "3v", "", "000300_1..N", vehicle_stop="126N", status=gtfs_realtime_pb2.VehiclePosition.IN_TRANSIT_TO)
+    _entity(feed, "4", "1", "", "128S", 1200)
+    trip_updates, vehicles = bucket_feed(feed, ["1"])
+    assert list(trip_updates) == ["1"]
+    assert list(trip_updates["1"]) == ["000100_1..S"]
+    assert sorted(vehicles) == ["000100_1..S", "000300_1..N"]
+    (train,) = TrainGetter("1").build_trains(trip_updates["1"], vehicles, now=900)
+    assert train.current_status == "INCOMING_AT"
+
+@pytest.fixture
+def ticks(monkeypatch):
+    # Replaces the sleep between watch polls: runs the next queued action (e.g. a feed
+    # update), and stops the watch like Ctrl-C once they run out
+    actions = []
+
+    def sleep(seconds):
+        assert seconds <= 30
+        if not actions:
+            raise KeyboardInterrupt
+        actions.pop(0)()
+
+    monkeypatch.setattr(mta_rail.time, "sleep", sleep)
+    return actions
+
+def test_watch_prints_the_board_then_only_changes(upstream, feed, ticks, capsys, tmp_path):
+    moved = moved_feed(feed, "1")
+    ticks.append(lambda: None)
+    ticks.append(lambda: setattr(upstream, "payload", moved))
+    history = HistoryWriter(str(tmp_path))
+    watch(FeedFetcher(base_url=upstream.base_url), ["1", "2"], 30, history)
+    out = capsys.readouterr().out
+
+    # The first poll prints both boards, an unchanged poll nothing, the update one diff
+    boards, _, diffs = out.partition("\n[")
+    assert " 1: " in boards and " 2: " in boards
+    assert diffs.count("\n[") == 0
+    assert " 1 " in diffs and "+0 -0 ~1" in diffs
+    assert "~ changed" in diffs and "+ added" not in diffs and "- removed" not in diffs
+
+    # The history writer was closed on the way out, with both polls of the 1 and one of the 2
+    records = list(HistoryReader(str(tmp_path)).query())
+    observed = {(r.route_id, r.observed) for r in records}
+    assert observed == {("1", feed.header.timestamp), ("2", feed.header.timestamp), ("1", feed.header.timestamp + 60)}
+
+def test_watch_survives_a_failed_poll(upstream, feed, ticks, capsys):
+    moved = moved_feed(feed, "1")
+
+    def outage():
+        upstream.payload = b"not a feed"
+
+    ticks.append(outage)
+    ticks.append(lambda: setattr(upstream, "payload", moved))
+    watch(FeedFetcher(base_url=upstream.base_url), ["1"], 30)
+    out = capsys.readouterr().out
+    assert "Error fetching data for 1" in out
+    assert "~ changed" in out
+
+def test_import_and_self_test_skip_heavy_dependencies():
+    # A fresh interpreter: importing mta_rail (and --self-test) parses no arguments
+    # and loads neither protobuf, requests, numpy nor the station index
+    code = ("import sys, mta_rail; mta_rail.main(['--self-test']); "
+            "print(sorted(m for m in ('google.protobuf', 'requests', 'numpy', 'mta_station_index', 'mta_feed_fetcher') "
+            "if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code, "--route", "not-a-route"], cwd=ROOT, capture_output=True,
+                         text=True, check=True).stdout
+    assert "routes total." in out
+    assert out.splitlines()[-1] == "[]"
+
+@pytest.mark.parametrize("argv", [["-r", "1"], ["-R", "1,2"], ["-R", "1,2", "--columnar"]])
+def test_main_prints_boards_from_the_fixture_feed(fixture_server, capsys, argv):
+    if "--columnar" in argv:
+        pytest.importorskip("numpy")
+    main(argv + ["--feed-base-url", fixture_server.base_url, "--no-feed-cache"])
+    out = capsys.readouterr().out
+    assert " 1: " in out
+    assert (" 2: " in out) == ("-R" in argv)
+    assert "Error" not in out
+
+@pytest.mark.parametrize("argv", [
+    ["--watch", "0"],
+    ["--history", "h"],
+    ["--workers", "2"],
+    ["-R", "1", "--workers", "2", "--watch", "5"],
+    ["--adaptive"],
+    ["--max-rate", "0"],
+    ["-R", "1,nope"],
+    ["-r", "nope"],
+])
+def test_main_rejects_bad_arguments(argv, capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(argv)
+    assert excinfo.value.code == 2
+    assert "error:" in capsys.readouterr().err
+
+@pytest.mark.parametrize("argv, routes", [
+    ([], list(route_ids)),
+    (["-r", "A"], ["A"]),
+    (["-R", "1,2"], ["1", "2"]),
+])
+def test_serve_tracks_the_requested_routes(monkeypatch, argv, routes):
+    import mta_server
+    served = []
+    monkeypatch.setattr(mta_server, "serve", lambda fetcher, routes, *args: served.append(routes))
+    monkeypatch.setattr(mta_rail.mta_metrics, "enabled", False)
+    main(["--serve", "0", "--no-feed-cache"] + argv)
+    assert served == [routes]
@@ -0,0 +1,64 @@
+import os
+import re
+
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+import mta_replay
+from conftest import ROOT, moved_feed
+from mta_replay import FeedReplay, ReplayClock, parse_feed_bytes, replay, snapshot_paths
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+@pytest.fixture
+def snapshots(tmp_path, feed_payload, feed):
+    # Two snapshots a minute apart, out of order on disk, plus files replay skips
+    _write(tmp_path / f"gtfs_{feed.header.timestamp + 60}.pb", moved_feed(feed, "1"))
+    _write(tmp_path / f"gtfs_{feed.header.timestamp}.pb", feed_payload)
+    _write(tmp_path / "notes.md", b"not a feed")
+    os.mkdir(tmp_path / "old.pb")
+    return str(tmp_path)
+
+def test_text_dump_and_binary_parse_the_same(feed_payload):
+    with open(os.path.join(ROOT, "feed_debug.txt"), "rb") as f:
+        text = f.read()
+    assert text[:1] != b"\x0a"
+    assert parse_feed_bytes(text) == parse_feed_bytes(feed_payload)
+
+def test_snapshots_are_ordered_by_name_timestamp_then_mtime(snapshots, feed, tmp_path):
+    names = [os.path.basename(path) for path in snapshot_paths(snapshots)]
+    assert names == [f"gtfs_{feed.header.timestamp}.pb", f"gtfs_{feed.header.timestamp + 60}.pb"]
+    # Without a timestamp in the name, the file's mtime places it
+    undated = _write(tmp_path / "undated.pb", b"")
+    os.utime(undated, (feed.header.timestamp + 30, feed.header.timestamp + 30))
+    assert [os.path.basename(path) for path in snapshot_paths(snapshots)][1] == "undated.pb"
+    assert snapshot_paths(undated) == [undated]
+
+def test_replay_clock_follows_header_timestamps(snapshots, feed, tmp_path):
+    untimed = gtfs_realtime_pb2.FeedMessage()
+    untimed.header.gtfs_realtime_version = "2.0"
+    _write(tmp_path / f"gtfs_{feed.header.timestamp + 90}.pb", untimed.SerializeToString())
+    clock = ReplayClock()
+    frames = list(FeedReplay(snapshots, clock))
+    # A snapshot without a header timestamp keeps the previous time
+    assert [frame.now for frame in frames] == [feed.header.timestamp, feed.header.timestamp + 60, feed.header.timestamp + 60]
+    assert frames[1].feed.header.timestamp == feed.header.timestamp + 60
+    clock.advance(5)
+    assert clock.now() == feed.header.timestamp + 65
+
+def test_replay_renders_as_of_each_snapshot(snapshots, capsys, monkeypatch):
+    slept = []
+    monkeypatch.setattr(mta_replay.time, "sleep", slept.append)
+    replay(snapshots, ["1", "2"], speed=2.0, diff=True)
+    out = capsys.readouterr().out
+
+    first, second = out.split("\n\033[2m--- ")[1:]
+    assert " 1: " in first and " 2: " in first
+    # ETAs are against the recorded time, not today's clock
+    assert any(int(eta) > 0 for eta in re.findall(r" in (\d+)s", first))
+    # Then only what changed, after the real gap scaled by the speed
+    assert " 1: " not in second and "~ changed" in second
+    assert slept == [30.0]
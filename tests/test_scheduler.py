@@ -0,0 +1,89 @@
+import math
+
+import pytest
+
+from mta_scheduler import PollScheduler
+
+START = 1760740000.0
+
+class SimulatedFeed():
+    # Publishes every `period` seconds from `phase`; a publish becomes visible `delay`
+    # seconds later, with the publish time as its header timestamp
+    def __init__(self, period, phase=0.0, delay=2.0):
+        self.period = period
+        self.phase = phase
+        self.delay = delay
+
+    def header_timestamp(self, now):
+        k = math.floor((now - self.delay - START - self.phase) / self.period)
+        return int(START + self.phase + k * self.period)
+
+def _simulate(scheduler, feeds, seconds, step=0.25):
+    # Drives the scheduler on a simulated clock the way SnapshotStore does on the real one
+    now = START
+    polls = {url: 0 for url in feeds}
+    while now < START + seconds:
+        urls = scheduler.due(now)
+        for url in urls:
+            polls[url] += 1
+        scheduler.observe_all({url: feeds[url].header_timestamp(now) for url in urls}, now)
+        now += max(step, scheduler.wait_time(now))
+    return polls
+
+def test_learns_each_feeds_cadence():
+    feeds = {"https://example/15": SimulatedFeed(15, 3), "https://example/30": SimulatedFeed(30, 11),
+             "https://example/45": SimulatedFeed(45, 20)}
+    scheduler = PollScheduler({url: [url[-2:]] for url in feeds}, interval=30.0)
+    seconds = 1800
+    polls = _simulate(scheduler, feeds, seconds)
+    for url, feed in feeds.items():
+        schedule = scheduler.feeds[url]
+        assert schedule.interval == pytest.approx(feed.period, abs=1.0), url
+        publishes = seconds / feed.period
+        # Every publish is picked up, without polling much more often than that
+        assert schedule.changes >= publishes - 3, url
+        assert polls[url] <= publishes * 1.5, url
+
+def test_unchanged_feed_backs_off():
+    scheduler = PollScheduler({"https://example/a": ["A"]}, min_interval=2.0, max_backoff=16.0)
+    url = "https://example/a"
+    scheduler.due(START)
+    scheduler.observe(url, int(START), START)
+    now = scheduler.feeds[url].due
+    delays = []
+    for _ in range(6):
+        assert scheduler.due(now) == [url]
+        scheduler.observe(url, int(START), now)
+        delays.append(scheduler.feeds[url].due - now)
+        now = scheduler.feeds[url].due
+    assert delays[-4:] == [4.0, 8.0, 16.0, 16.0]
+
+def test_token_bucket_runs_on_the_callers_clock():
+    urls = [f"https://example/{i}" for i in range(5)]
+    scheduler = PollScheduler({url: [str(i)] for i, url in enumerate(urls)}, max_rate=1.0, burst=2)
+    assert len(scheduler.due(START)) == 2
+    deferred = [url for url in urls if scheduler.feeds[url].reason.startswith("rate limit")]
+    assert len(deferred) == 3
+    assert all(scheduler.feeds[url].due == START + 1.0 for url in deferred)
+    # No simulated time has passed, however long the test takes on the wall clock
+    assert scheduler.due(START + 0.5) == []
+    assert len(scheduler.due(START + 1.0)) == 1
+    # One token per simulated second, never more than the burst
+    assert len(scheduler.due(START + 2.0)) == 1
+    assert len(scheduler.due(START + 100.0)) == 2
+    assert scheduler.snapshot(START + 100.0)["tokens"] == 0.0
+
+def test_clock_stepping_back_does_not_refill():
+    scheduler = PollScheduler({"https://example/a": ["A"], "https://example/b": ["B"]}, max_rate=1.0, burst=1)
+    assert len(scheduler.due(START)) == 1
+    assert scheduler.due(START - 50.0) == []
+    assert len(scheduler.due(START + 1.0)) == 1
+
+def test_demand_gates_polling():
+    scheduler = PollScheduler({"https://example/a": ["A"]}, require_demand=True, interest_ttl=60.0)
+    assert scheduler.due(START) == []
+    assert scheduler.feeds["https://example/a"].reason == "no subscribers"
+    scheduler.touch(["A"], now=START + 1)
+    assert scheduler.due(START + 1) == ["https://example/a"]
+    assert scheduler.demand("https://example/a", START + 30) == 1
+    assert scheduler.demand("https://example/a", START + 62) == 0
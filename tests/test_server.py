@@ -0,0 +1,127 @@
+import http.client
+import json
+import threading
+import time
+import types
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from conftest import moved_feed
+from mta_arrivals import ArrivalIndex
+from mta_feed_fetcher import FeedFetcher
+from mta_rail import FeedWatcher
+import mta_server
+from mta_server import SnapshotStore, make_handler
+
+ROUTES = ["1", "2"]
+
+@pytest.fixture
+def store(upstream, feed, monkeypatch):
+    # Station boards only list arrivals after `now`; read them as of the recorded feed
+    clock = types.SimpleNamespace(time=lambda: float(feed.header.timestamp), monotonic=time.monotonic)
+    monkeypatch.setattr(mta_server, "time", clock)
+    with FeedFetcher(base_url=upstream.base_url) as fetcher:
+        store = SnapshotStore(FeedWatcher(fetcher, ROUTES, ArrivalIndex()))
+        store.poll()
+        yield store
+
+@pytest.fixture
+def api(store):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _get(api, path, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", api.server_port, timeout=10)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.getheader("ETag"), response.read()
+    finally:
+        conn.close()
+
+def test_route_bodies_carry_etags_and_revalidate(api, store):
+    status, etag, body = _get(api, "/routes/1")
+    assert status == 200 and etag
+    assert (etag, body) == store.get("/routes/1")
+    payload = json.loads(body)
+    assert payload["route"] == "1" and payload["sections"]
+
+    status, again, body = _get(api, "/routes/1", {"If-None-Match": etag})
+    assert (status, again, body) == (304, etag, b"")
+    status, _, body = _get(api, "/routes/1", {"If-None-Match": '"stale"'})
+    assert status == 200 and body
+    assert _get(api, "/routes/L")[0] == 404
+
+    # Polling an unchanged feed keeps every body (and so every ETag)
+    version = store.version
+    assert store.poll() == set()
+    assert store.version == version
+    assert _get(api, "/routes/1", {"If-None-Match": etag})[0] == 304
+
+def test_changed_route_gets_a_new_etag(api, store, upstream, feed):
+    etag_1, etag_2 = store.get("/routes/1")[0], store.get("/routes/2")[0]
+    upstream.payload = moved_feed(feed, "1")
+    assert store.poll() == {"1"}
+    assert store.get("/routes/1")[0] != etag_1
+    assert store.get("/routes/2")[0] == etag_2
+    assert _get(api, "/routes/1", {"If-None-Match": etag_1})[0] == 200
+
+def test_station_boards(api, store):
+    stops = store.watcher.arrivals.stops()
+    boards = [stop_id for stop_id in stops if store.get(f"/stations/{stop_id}")]
+    assert boards
+    status, etag, body = _get(api, f"/stations/{boards[0]}")
+    assert status == 200 and json.loads(body)["arrivals"]
+    assert _get(api, f"/stations/{boards[0]}", {"If-None-Match": etag})[0] == 304
+    # A known station with nothing due answers with an empty board
+    assert "A02" not in stops
+    status, _, body = _get(api, "/stations/A02")
+    assert status == 200 and json.loads(body)["arrivals"] == []
+    assert _get(api, "/stations/nope")[0] == 404
+
+def _events(stream):
+    # (event, id, data) for each event up to the next keepalive comment
+    events, fields = [], {}
+    while True:
+        line = stream.readline()
+        assert line, "stream closed"
+        line = line.rstrip(b"\n")
+        if line.startswith(b": keepalive"):
+            stream.readline()
+            return events
+        if not line:
+            events.append((fields[b"event"].decode(), fields[b"id"].decode(), fields[b"data"]))
+            fields = {}
+            continue
+        name, _, value = line.partition(b": ")
+        fields[name] = value
+
+def test_events_stream_changed_routes(api, store, upstream, feed):
+    conn = http.client.HTTPConnection("127.0.0.1", api.server_port, timeout=10)
+    try:
+        conn.request("GET", "/events?routes=1,2")
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "text/event-stream"
+
+        # Every subscribed route on connect
+        initial = _events(response.fp)
+        assert [event for event, _, _ in initial] == ["route", "route"]
+        assert {json.loads(data)["route"] for _, _, data in initial} == {"1", "2"}
+        for _, event_id, data in initial:
+            route = json.loads(data)["route"]
+            assert (f'"{event_id}"', data) == store.get(f"/routes/{route}")
+
+        # Then only the routes a poll changed
+        upstream.payload = moved_feed(feed, "1")
+        store.poll()
+        (update,) = _events(response.fp)
+        assert json.loads(update[2])["route"] == "1"
+        assert (f'"{update[1]}"', update[2]) == store.get("/routes/1")
+    finally:
+        conn.close()
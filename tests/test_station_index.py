@@ -0,0 +1,123 @@
+import json
+import mmap
+import os
+import shutil
+from collections import OrderedDict
+
+import pytest
+
+import mta_station_index
+from mta_station_index import StationIndex, build_index, compile_index, default_index_path, shuttle_sections
+
+@pytest.fixture
+def station_json(tmp_path):
+    path = tmp_path / "stations.json"
+    shutil.copy(mta_station_index.DEFAULT_JSON_PATH, path)
+    return str(path)
+
+@pytest.fixture
+def maps(monkeypatch):
+    # Every mmap StationIndex.open makes, to check which ones it leaves open
+    made = []
+    real = mmap.mmap
+
+    def recording(*args, **kwargs):
+        mm = real(*args, **kwargs)
+        made.append(mm)
+        return mm
+
+    monkeypatch.setattr(mta_station_index.mmap, "mmap", recording)
+    return made
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+def _expected_routes(station_data):
+    routes = OrderedDict((route, sections) for route, sections in station_data.items())
+    for alias, section_name in shuttle_sections.items():
+        routes[alias] = OrderedDict([(section_name, station_data.get("S", {}).get(section_name, OrderedDict()))])
+    return routes
+
+def _reference_lookup(routes, stop_id):
+    found = []
+    for route, sections in routes.items():
+        ordinals = {}
+        for section_name, stations in sections.items():
+            for stop, name in stations.items():
+                ordinal = ordinals.setdefault(name, len(ordinals))
+                if stop == stop_id:
+                    found.append((route, section_name, ordinal))
+    return found
+
+def test_compiled_index_round_trips_the_json(station_json):
+    station_data = _load(station_json)
+    routes = _expected_routes(station_data)
+    index = StationIndex(compile_index(station_data))
+
+    assert index.routes() == list(routes)
+    for route, sections in routes.items():
+        assert index.route_data(route) == sections
+    stop_ids = {stop for sections in routes.values() for stations in sections.values() for stop in stations}
+    for stop_id in stop_ids:
+        assert sorted(index.lookup(stop_id)) == sorted(_reference_lookup(routes, stop_id))
+        assert index.station_name(stop_id) is not None
+    assert index.lookup("nope") == []
+    assert index.station_name("nope") is None
+    assert index.route_data("nope") == OrderedDict()
+
+def test_open_maps_a_fresh_index_without_rebuilding(station_json, maps):
+    build_index(station_json)
+    index_path = default_index_path(station_json)
+    built = os.stat(index_path).st_mtime_ns
+
+    index = StationIndex.open(station_json)
+    assert index.route_data("1") == _load(station_json)["1"]
+    assert len(maps) == 1 and not maps[0].closed
+    assert os.stat(index_path).st_mtime_ns == built
+
+@pytest.mark.parametrize("change", ["size", "mtime"])
+def test_open_rebuilds_when_the_json_changes(station_json, maps, change):
+    build_index(station_json)
+    before = os.stat(station_json)
+    with open(station_json, "rb") as f:
+        data = f.read()
+    # Same length for "mtime", so only the timestamp tells the edit apart
+    renamed = "Van Cortlandt Park-242 St" if change == "size" else "Van Cortlandt Park-24X"
+    with open(station_json, "wb") as f:
+        f.write(data.replace(b"Van Cortlandt Park-242", renamed.encode(), 1))
+    st = os.stat(station_json)
+    os.utime(station_json, ns=(st.st_atime_ns, before.st_mtime_ns + 10 ** 9))
+    assert (os.stat(station_json).st_size == before.st_size) == (change == "mtime")
+
+    index = StationIndex.open(station_json)
+    assert index.station_name("101") == renamed
+    assert (index.json_size, index.json_mtime_ns) == (os.stat(station_json).st_size, os.stat(station_json).st_mtime_ns)
+    # The stale map was released, and the rewritten index is picked up next time
+    assert maps[0].closed
+    StationIndex.open(station_json)
+    assert len(maps) == 2 and not maps[1].closed
+
+@pytest.mark.parametrize("damage", ["magic", "truncated", "empty"])
+def test_open_rebuilds_an_invalid_index(station_json, maps, damage):
+    build_index(station_json)
+    index_path = default_index_path(station_json)
+    with open(index_path, "rb") as f:
+        data = f.read()
+    if damage == "magic":
+        data = b"X" + data[1:]
+    elif damage == "truncated":
+        data = data[:len(data) - 6]
+    else:
+        data = b""
+    with open(index_path, "wb") as f:
+        f.write(data)
+
+    index = StationIndex.open(station_json)
+    assert index.route_data("1") == _load(station_json)["1"]
+    assert all(mm.closed for mm in maps)
+
+def test_truncated_index_is_rejected(station_json):
+    data = build_index(station_json)
+    with pytest.raises(ValueError):
+        StationIndex(data[:-4])
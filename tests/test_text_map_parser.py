@@ -0,0 +1,313 @@
+import csv
+import hashlib
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import mta_text_map_parser
+from mta_text_map_parser import (CacheMiss, HttpCache, StationMatcher, affected_routes, build_stations, diff_stations,
+                                 merge_stations, normalize_name)
+
+# (GTFS Stop ID, Stop Name, Borough, Daytime Routes): a slice of the NY Open Data
+# stations CSV plus rows that make names and route fields ambiguous
+STATIONS = [
+    ("101", "Van Cortlandt Park-242 St", "Bx", "1"),
+    ("121", "86 St", "M", "1"),
+    ("127", "Times Sq-42 St", "M", "1 2 3"),
+    ("R16", "Times Sq-42 St", "M", "N Q R W"),
+    ("725", "Times Sq-42 St", "M", "7"),
+    ("902", "Times Sq-42 St", "M", "S"),
+    ("631", "Grand Central-42 St", "M", "4 5 6"),
+    ("901", "Grand Central-42 St", "M", "S"),
+    ("626", "86 St", "M", "4 5 6"),
+    ("N10", "86 St", "Bk", "N"),
+    ("R44", "86 St", "Bk", "R"),
+    ("A34", "Canal St", "M", "A C E"),
+    ("M20", "Canal St", "M", "J Z"),
+    ("Q01", "Canal St", "M", "N Q R W"),
+    ("639", "Canal St", "M", "4 6"),
+    ("A44", "Clinton-Washington Avs", "Bk", "C"),
+    ("G35", "Clinton-Washington Avs", "Bk", "G"),
+    ("D43", "Washington Av", "Bk", "JZ"),
+    ("S04", "Botanic Garden", "Bk", "S"),
+    ("S03", "Park Pl", "Bk", "S"),
+    ("S31", "St George", "SI", "SIR"),
+    ("S30", "Tompkinsville", "SI", "SIR"),
+    ("B21", "Bay 50 St", "Bk", "D"),
+    ("B22", "Bay Pkwy", "Bk", "D"),
+    ("F24", "Bay Pkwy", "Bk", "F"),
+    ("N07", "Bay Pkwy", "Bk", "N"),
+    ("R01", "Astoria-Ditmars Blvd", "Q", "N W"),
+    ("G06", "Sutphin Blvd-Archer Av-JFK Airport", "Q", "E J Z"),
+    ("M09", "Central Av", "Bk", "M"),
+    ("M90", "Central Av", "Q", "M"),
+    ("H01", "Aqueduct Racetrack", "Q", "A"),
+    ("X01", "Closed Station", "M", ""),
+]
+LINES = ["1", "2", "4", "6", "7", "A", "C", "D", "F", "G", "J", "M", "N", "R", "S", "SIR", "Z", "X"]
+
+def _csv():
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["GTFS Stop ID", "Stop Name", "Borough", "Daytime Routes"])
+    writer.writerows(STATIONS)
+    return text.getvalue().encode("utf-8")
+
+def _reference(name, line):
+    # The original DataFrame steps: exact, normalized, then substring name match, each
+    # among rows whose 'Daytime Routes' contains the line; first CSV row wins
+    on_line = [row for row in STATIONS if line in row[3]]
+    for rows in ([r for r in on_line if r[1] == name],
+                 [r for r in on_line if r[1] == normalize_name(name)],
+                 [r for r in on_line if name in r[1]]):
+        if rows:
+            return rows[0][0]
+    return None
+
+def _match(matcher, name, line):
+    try:
+        return matcher.match(name, line)
+    except ValueError:
+        return None
+
+@pytest.fixture
+def matcher():
+    return StationMatcher.from_csv(_csv())
+
+def test_matches_the_original_scan_for_every_substring(matcher):
+    # Every substring of every name, including ones starting or ending mid-word
+    queries = {name[i:j] for _, name, _, _ in STATIONS for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+    queries |= {"Washington Avenue", "Times Square-42 St", "Bay Parkway", "Astoria Ditmars Boulevard"}
+    checked = 0
+    for name in sorted(queries):
+        if not name.strip():
+            continue
+        for line in LINES:
+            assert _match(matcher, name, line) == _reference(name, line), (name, line)
+            checked += 1
+    assert checked > 10000
+
+def test_route_filter_is_a_substring_match(matcher):
+    # 'S' also selects SIR rows and 'J' the concatenated 'JZ' field, as str.contains did
+    assert matcher.match("St George", "S") == "S31"
+    assert matcher.match("Washington Av", "J") == "D43"
+    assert _match(matcher, "Closed Station", "M") is None
+
+def test_steps_in_order(matcher):
+    step, rows = matcher.candidates("Bay Pkwy", "D")
+    assert (step, [matcher.stops[i][0] for i in rows]) == ("exact", ["B22"])
+    assert matcher.candidates("Bay Parkway", "F")[0] == "normalized"
+    assert matcher.candidates("Washington", "C")[0] == "partial"
+    with pytest.raises(ValueError):
+        matcher.match("Nowhere", "1")
+
+def test_ambiguous_names_keep_csv_order_and_are_reported(matcher):
+    # Two Central Av rows on the M: CSV order decides, whatever the section says
+    assert matcher.match("Central Av", "M", section="Queens") == "M09"
+    (ambiguity,) = matcher.ambiguities
+    assert ambiguity.step == "exact"
+    assert [stop_id for stop_id, _ in ambiguity.candidates] == ["M09", "M90"]
+    assert ambiguity.chosen == "M09"
+    assert matcher.match("86 St", "4") == "626"
+    assert len(matcher.ambiguities) == 1
+
+def test_borough_tie_break_is_opt_in():
+    matcher = StationMatcher.from_csv(_csv(), prefer_borough=True)
+    assert matcher.match("Central Av", "M", section="Queens stations") == "M90"
+    assert matcher.match("Central Av", "M", section="Brooklyn stations") == "M09"
+    # No borough in the section title: CSV order, reported
+    assert matcher.match("Central Av", "M", section="Express") == "M09"
+    assert len(matcher.ambiguities) == 1
+    assert matcher.key != StationMatcher.from_csv(_csv()).key
+
+class _PageHandler(BaseHTTPRequestHandler):
+    # Serves server.pages[path] with an ETag, answering a matching If-None-Match with 304
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.server.pages[self.path]
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    server.daemon_threads = True
+    server.pages, server.requests = {}, []
+    server.url = lambda path: f"http://127.0.0.1:{server.server_port}{path}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_http_cache_revalidates_and_reuses_the_body(site, tmp_path):
+    site.pages["/page"] = b"<html>v1</html>"
+    cache = HttpCache(str(tmp_path), retries=0)
+    url = site.url("/page")
+    assert cache.get(url) == b"<html>v1</html>"
+    etag = cache.meta(url)["etag"]
+    assert cache.get(url) == b"<html>v1</html>"
+    assert site.requests == [("/page", None), ("/page", etag)]
+
+    # A changed page is fetched whole and replaces the cached copy
+    site.pages["/page"] = b"<html>v2</html>"
+    assert cache.get(url) == b"<html>v2</html>"
+    assert cache.meta(url)["etag"] != etag
+    assert HttpCache(str(tmp_path), offline=True).get(url) == b"<html>v2</html>"
+    with pytest.raises(CacheMiss):
+        HttpCache(str(tmp_path), offline=True).get(site.url("/other"))
+
+def test_http_cache_reuses_parse_results_per_body(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    calls = []
+
+    def parse(body):
+        calls.append(body)
+        return [["Section", [body.decode()]]]
+
+    assert cache.parsed("u", b"a", parse) == [["Section", ["a"]]]
+    assert cache.parsed("u", b"a", parse) == [["Section", ["a"]]]
+    assert cache.parsed("u", b"b", parse) == [["Section", ["b"]]]
+    assert calls == [b"a", b"b"]
+
+def _stations_csv(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["GTFS Stop ID", "Stop Name", "Borough", "Daytime Routes"])
+    writer.writerows(rows)
+    return text.getvalue().encode("utf-8")
+
+@pytest.fixture
+def scrape(site, tmp_path, monkeypatch):
+    # The map index, two line pages and the stations CSV on the local site. Parse
+    # results are seeded into the cache (as a previous run would have left them), so
+    # no HTML parser is needed; every run revalidates the pages over HTTP
+    monkeypatch.setattr(mta_text_map_parser, "subway_map_url", site.url("/maps"))
+    monkeypatch.setattr(mta_text_map_parser, "csv_url", site.url("/stations.csv"))
+    cache = HttpCache(str(tmp_path / "cache"), retries=0)
+    pages = {
+        "/maps/subway-line-maps/1-line": [["Bronx", ["Van Cortlandt Park-242 St"]], ["Manhattan", ["86 St", "Times Sq-42 St"]]],
+        "/maps/subway-line-maps/7-line": [["Manhattan", ["Times Sq-42 St"]]],
+    }
+
+    def publish(path, sections):
+        site.pages[path] = repr(sections).encode("utf-8")
+        cache.parsed(site.url(path), site.pages[path], lambda body: sections)
+
+    publish("/maps", [site.url(path) for path in pages])
+    for path, sections in pages.items():
+        publish(path, sections)
+    site.pages["/stations.csv"] = _csv()
+
+    matched = []
+    build_line = mta_text_map_parser.build_line
+
+    def recording_build_line(train_line, sections, matcher):
+        matched.append(train_line)
+        return build_line(train_line, sections, matcher)
+
+    monkeypatch.setattr(mta_text_map_parser, "build_line", recording_build_line)
+    return cache, publish, matched
+
+def test_unchanged_sources_reuse_the_previous_lines(scrape, site):
+    cache, publish, matched = scrape
+    lines, manifest, failed = build_stations(cache, workers=2)
+    assert failed == set()
+    assert sorted(matched) == ["1", "7"]
+    assert lines["1"] == {"Bronx": {"101": "Van Cortlandt Park-242 St"}, "Manhattan": {"121": "86 St", "127": "Times Sq-42 St"}}
+    assert lines["7"] == {"Manhattan": {"725": "Times Sq-42 St"}}
+    assert list(lines) == ["1", "7", "SI"]
+
+    matched.clear()
+    again, manifest_again, _ = build_stations(cache, workers=2, previous=lines, manifest=manifest)
+    assert matched == []
+    assert (again, manifest_again) == (lines, manifest)
+    # Both runs revalidated every page rather than refetching it
+    assert all(etag for path, etag in site.requests[len(site.requests) // 2:])
+
+def test_changed_route_rows_force_a_rematch(scrape, site):
+    cache, publish, matched = scrape
+    lines, manifest, _ = build_stations(cache, workers=2)
+    matched.clear()
+
+    # The 1's 86 St gets a new stop id; nothing the 7 matches against moves
+    rows = [("120", name, borough, routes) if stop_id == "121" else (stop_id, name, borough, routes)
+            for stop_id, name, borough, routes in STATIONS]
+    site.pages["/stations.csv"] = _stations_csv(rows)
+    again, manifest_again, _ = build_stations(cache, workers=2, previous=lines, manifest=manifest)
+    assert matched == ["1"]
+    assert manifest_again["lines"]["1"]["csv"] != manifest["lines"]["1"]["csv"]
+    assert manifest_again["lines"]["7"] == manifest["lines"]["7"]
+    assert again["1"]["Manhattan"] == {"120": "86 St", "127": "Times Sq-42 St"}
+    assert again["7"] is lines["7"]
+
+    # A changed page re-matches only its line
+    matched.clear()
+    publish("/maps/subway-line-maps/7-line", [["Manhattan", ["Times Sq-42 St"]], ["Queens", ["Times Sq-42 St"]]])
+    build_stations(cache, workers=2, previous=again, manifest=manifest_again)
+    assert matched == ["7"]
+
+def test_matcher_change_forces_a_rematch(scrape):
+    cache, publish, matched = scrape
+    lines, manifest, _ = build_stations(cache, workers=2)
+    matched.clear()
+    build_stations(cache, workers=2, previous=lines, manifest=manifest, prefer_borough=True)
+    assert sorted(matched) == ["1", "7"]
+
+def test_merge_keeps_order_and_failed_lines():
+    previous = {"1": {"a": {"101": "x"}}, "2": {"a": {"201": "y"}}, "3": {"a": {"301": "z"}}}
+    lines = {"4": {"a": {"401": "w"}}, "1": {"a": {"101": "x2"}}}
+    merged = merge_stations(previous, lines, failed={"2"})
+    # 3 is gone from the site, 2 failed to fetch and keeps its data, 4 is new
+    assert merged == {"1": {"a": {"101": "x2"}}, "2": {"a": {"201": "y"}}, "4": {"a": {"401": "w"}}}
+    assert list(merged) == ["1", "2", "4"]
+
+def test_diff_reports_station_and_section_changes():
+    previous = {
+        "1": {"Bronx": {"101": "Van Cortlandt Park", "103": "238 St"}, "Manhattan": {"116": "116 St", "117": "110 St"}},
+        "2": {"Bronx": {"201": "Wakefield"}},
+        "S": {"42 St Shuttle (Manhattan)": {"901": "Grand Central"}, "Franklin Shuttle (Brooklyn)": {"S01": "Franklin Av"}},
+    }
+    current = {
+        "1": {"Manhattan": {"117": "110 St-Cathedral Pkwy", "116": "116 St", "103": "238 St"},
+              "Upper Manhattan": {"104": "231 St"}},
+        "2": {"Bronx": {"201": "Wakefield"}},
+        "S": {"42 St Shuttle (Manhattan)": {"901": "Grand Central"}, "Franklin Shuttle (Brooklyn)": {"S01": "Franklin Avenue"}},
+        "7": {"Queens": {"701": "Flushing-Main St"}},
+    }
+    diff = diff_stations(previous, current)
+    assert list(diff["lines"]) == ["1", "S", "7"]
+    one = diff["lines"]["1"]
+    assert one["added"] == [{"stop_id": "104", "section": "Upper Manhattan", "name": "231 St"}]
+    assert one["removed"] == [{"stop_id": "101", "section": "Bronx", "name": "Van Cortlandt Park"}]
+    assert one["renamed"] == [{"stop_id": "117", "old": "110 St", "new": "110 St-Cathedral Pkwy"}]
+    assert one["moved"] == [{"stop_id": "103", "old_section": "Bronx", "new_section": "Manhattan"}]
+    assert (one["sections_added"], one["sections_removed"]) == (["Upper Manhattan"], ["Bronx"])
+    assert one["reordered"] and one["routes"] == ["1"]
+    assert diff["lines"]["S"]["routes"] == ["FS"]
+    assert diff["lines"]["7"]["added"] == [{"stop_id": "701", "section": "Queens", "name": "Flushing-Main St"}]
+    assert diff["routes"] == ["1", "7", "FS"]
+    assert diff_stations(current, current) == {"lines": {}, "routes": []}
+
+def test_affected_routes_map_shuttle_sections():
+    assert affected_routes("A", ["Manhattan"]) == ["A"]
+    assert affected_routes("S", ["42 St Shuttle (Manhattan)"]) == ["GS"]
+    assert affected_routes("S", ["Rockaway Shuttle (Queens)", "Franklin Shuttle (Brooklyn)"]) == ["FS", "H"]
+    # A section no shuttle is known by could be any of them
+    assert affected_routes("S", ["Renamed Shuttle"]) == ["GS", "FS", "H"]
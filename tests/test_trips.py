@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from mta_rail import TrainGetter
+from mta_trips import AT_STOP, BEFORE_FIRST, BETWEEN, FINISHED, UNKNOWN, build_projection
+
+def _feed(*trips):
+    # trips: (trip_id, [(stop_id, arrival, departure), ...]) on the 1
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    for trip_id, stops in trips:
+        tu = feed.entity.add(id=trip_id).trip_update
+        tu.trip.route_id = "1"
+        tu.trip.trip_id = trip_id
+        for stop_id, arrival, departure in stops:
+            stu = tu.stop_time_update.add(stop_id=stop_id)
+            if arrival:
+                stu.arrival.time = arrival
+            if departure:
+                stu.departure.time = departure
+    return feed
+
+@pytest.fixture(scope="module")
+def traingetters():
+    return {"1": TrainGetter("1")}
+
+def _ordinal(traingetters, stop_id):
+    return traingetters["1"]._stop_lookup[stop_id][1]
+
+@pytest.fixture
+def projection(traingetters):
+    feed = _feed(
+        ("t1", [("120S", 1000, 1030), ("121S", 1100, 1130), ("122S", 1200, 1230)]),
+        ("t2", [("121N", 1050, 0), ("120N", 1150, 0)]),
+        # Loops back through 121S
+        ("t3", [("121S", 1300, 1300), ("122S", 1400, 1400), ("121S", 1500, 1500)]),
+        # Nothing timed: no position can be given
+        ("t4", [("123S", 0, 0)]),
+    )
+    return build_projection([(feed, ["1"])], traingetters)
+
+def test_stop_codes(projection):
+    assert projection.stop_table[projection.stop_code("121")] == "121"
+    assert projection.stop_code("121S") == -1
+    assert projection.stop_code("999") == -1
+    # t4's untimed stop was dropped
+    assert projection.stop_code("123") == -1
+    assert list(np.diff(projection.offsets)) == [3, 2, 3, 0]
+
+def test_etas_to_a_stop(projection):
+    etas = projection.etas_to("121", now=1040)
+    assert [projection.trip_ids[t] for t in etas.trips] == ["t2", "t1", "t3"]
+    assert list(etas.arrival) == [1050, 1100, 1300]
+    assert list(etas.eta) == [10, 60, 260]
+    # One direction only
+    assert [projection.trip_ids[t] for t in projection.etas_to("121S", now=1040).trips] == ["t1", "t3"]
+    assert [projection.trip_ids[t] for t in projection.etas_to("121N", now=1040).trips] == ["t2"]
+    # t3 is past its first visit: its second one counts
+    etas = projection.etas_to("121S", now=1350)
+    assert [(projection.trip_ids[t], a) for t, a in zip(etas.trips, etas.arrival)] == [("t3", 1500)]
+    assert len(projection.etas_to("999", now=0).trips) == 0
+
+def test_positions(projection, traingetters):
+    t1 = projection.trip_ids.index("t1")
+    o120, o121 = _ordinal(traingetters, "120"), _ordinal(traingetters, "121")
+    cases = [
+        (900, BEFORE_FIRST, o120, 0.0),
+        (1010, AT_STOP, o120, 0.0),
+        (1065, BETWEEN, o120 + (o121 - o120) * 0.5, 0.5),
+        (1110, AT_STOP, o121, 0.0),
+        (1300, FINISHED, _ordinal(traingetters, "122"), 0.0),
+    ]
+    for at, state, position, fraction in cases:
+        positions = projection.positions(at)
+        assert positions.state[t1] == state, at
+        assert positions.position[t1] == pytest.approx(position), at
+        assert positions.fraction[t1] == pytest.approx(fraction), at
+    positions = projection.positions(1065)
+    rows = projection.offsets[t1]
+    assert (positions.prev_stop[t1], positions.next_stop[t1]) == (rows, rows + 1)
+
+def test_trip_without_timed_stops_is_unknown(projection):
+    t4 = projection.trip_ids.index("t4")
+    for at in (0, 1065, 5000):
+        positions = projection.positions(at)
+        assert positions.state[t4] == UNKNOWN
+        assert math.isnan(positions.position[t4])
+        assert (positions.prev_stop[t4], positions.next_stop[t4]) == (-1, -1)
+
+def test_etas_match_a_scan_of_the_recorded_feed(feed, traingetters):
+    projection = build_projection([(feed, ["1"])], traingetters)
+    now = feed.header.timestamp
+    stops = {stu.stop_id for e in feed.entity if e.HasField("trip_update") and e.trip_update.trip.route_id == "1"
+             for stu in e.trip_update.stop_time_update}
+    assert stops
+    for stop_id in sorted(stops):
+        expected = []
+        for e in feed.entity:
+            tu = e.trip_update
+            if not e.HasField("trip_update") or tu.trip.route_id != "1" or not tu.trip.trip_id:
+                continue
+            due = [stu.arrival.time or stu.departure.time for stu in tu.stop_time_update
+                   if stu.stop_id == stop_id and (stu.arrival.time or stu.departure.time) >= now]
+            if due:
+                expected.append((due[0], tu.trip.trip_id))
+        etas = projection.etas_to(stop_id, now)
+        assert sorted((int(a), projection.trip_ids[t]) for t, a in zip(etas.trips, etas.arrival)) == sorted(expected)
+        assert list(etas.arrival) == sorted(a for a, _ in expected)
@@ -0,0 +1,137 @@
+import io
+import random
+import re
+
+from mta_tui import CURSOR_GAP, RESET, FrameBuffer, TerminalRenderer
+
+ESCAPE = re.compile(r"\033\[(?:(\d+);(\d+)H|2J|[\d;]*m)")
+
+class Screen():
+    # Just enough of a terminal to replay what the renderer wrote: cursor moves,
+    # clears and SGR changes, tracking the SGR in effect for every cell
+    def __init__(self, width, height):
+        self.chars = [[" "] * width for _ in range(height)]
+        self.sgr = [[RESET] * width for _ in range(height)]
+        self.row = self.col = 0
+        self.current = RESET
+
+    def feed(self, data):
+        pos = 0
+        for m in ESCAPE.finditer(data):
+            self._text(data[pos:m.start()])
+            pos = m.end()
+            if m.group(1):
+                self.row, self.col = int(m.group(1)) - 1, int(m.group(2)) - 1
+            elif m.group(0) == "\033[2J":
+                for row in range(len(self.chars)):
+                    self.chars[row] = [" "] * len(self.chars[row])
+                    self.sgr[row] = [RESET] * len(self.sgr[row])
+            elif m.group(0) == RESET:
+                self.current = RESET
+            else:
+                self.current = m.group(0)
+        self._text(data[pos:])
+
+    def _text(self, text):
+        for ch in text:
+            self.chars[self.row][self.col] = ch
+            self.sgr[self.row][self.col] = self.current
+            self.col += 1
+
+def _render(width=20, height=4):
+    out = io.StringIO()
+    return TerminalRenderer(out), out
+
+def _written(out):
+    data = out.getvalue()
+    out.seek(0)
+    out.truncate()
+    return data
+
+def test_first_frame_repaints_everything():
+    renderer, out = _render()
+    frame = FrameBuffer(20, 4)
+    frame.put(1, 2, "hello")
+    assert renderer.present(frame) > 0
+    data = _written(out)
+    assert data.startswith("\033[2J")
+    assert "hello" in data
+
+def test_unchanged_frame_writes_nothing():
+    renderer, out = _render()
+    frame = FrameBuffer(20, 4)
+    frame.put(0, 0, "same")
+    renderer.present(frame)
+    _written(out)
+    again = FrameBuffer(20, 4)
+    again.put(0, 0, "same")
+    assert renderer.present(again) == 0
+    assert out.getvalue() == ""
+
+def test_only_changed_cells_are_rewritten():
+    renderer, out = _render()
+    frame = FrameBuffer(20, 4)
+    frame.put(2, 0, "1 train 3 min")
+    renderer.present(frame)
+    _written(out)
+    frame = FrameBuffer(20, 4)
+    frame.put(2, 0, "1 train 2 min")
+    renderer.present(frame)
+    data = _written(out)
+    assert "\033[2J" not in data
+    assert data == "\033[3;9H2" + RESET
+
+def test_nearby_changes_share_one_cursor_move():
+    renderer, out = _render(width=40)
+    renderer.present(FrameBuffer(40, 4))
+    _written(out)
+    frame = FrameBuffer(40, 4)
+    frame.put(0, 0, "a")
+    frame.put(0, CURSOR_GAP, "b")
+    frame.put(0, 30, "c")
+    renderer.present(frame)
+    data = _written(out)
+    moves = re.findall(r"\033\[(\d+);(\d+)H", data)
+    assert moves == [("1", "1"), ("1", "31")]
+
+def test_style_change_alone_is_redrawn():
+    renderer, out = _render()
+    bold = renderer.style("\033[1m")
+    frame = FrameBuffer(20, 4)
+    frame.put(0, 0, "A")
+    renderer.present(frame)
+    _written(out)
+    frame = FrameBuffer(20, 4)
+    frame.put(0, 0, "A", bold)
+    renderer.present(frame)
+    assert _written(out) == "\033[1;1H" + RESET + "\033[1m" + "A" + RESET
+
+def test_resize_repaints_everything():
+    renderer, out = _render()
+    renderer.present(FrameBuffer(20, 4))
+    _written(out)
+    renderer.present(FrameBuffer(30, 4))
+    assert _written(out).startswith("\033[2J")
+
+def test_diffs_reproduce_every_frame():
+    rng = random.Random(7)
+    width, height = 32, 6
+    renderer, out = _render(width, height)
+    styles = [0] + [renderer.style(sgr) for sgr in ("\033[1m", "\033[1;44m", "\033[2m")]
+    screen = Screen(width, height)
+    frame = FrameBuffer(width, height)
+    for _ in range(200):
+        previous = frame
+        frame = FrameBuffer(width, height)
+        for row in range(height):
+            frame.chars[row] = list(previous.chars[row])
+            frame.styles[row] = list(previous.styles[row])
+        for _ in range(rng.randrange(4)):
+            text = "".join(rng.choice("abc 123") for _ in range(rng.randrange(1, 8)))
+            frame.put(rng.randrange(height), rng.randrange(width), text, rng.choice(styles))
+        renderer.present(frame)
+        screen.feed(_written(out))
+        assert screen.chars == frame.chars
+        assert screen.sgr == [[renderer.styles[s] for s in row] for row in frame.styles]
+        # Every frame ends with attributes reset
+        assert screen.current == RESET